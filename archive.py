@@ -0,0 +1,216 @@
+"""
+Помесячные архивы старых заказов.
+
+Закрытые рабочие месяцы переносятся из живой базы в отдельные файлы
+ARCHIVE_DIR/orders_ГГГГ_ММ.db: orders, order_items и actions_log с теми же id.
+В живой базе остаются последние ARCHIVE_KEEP_MONTHS месяцев, справочники и сводка
+daily_sales за всё время, поэтому размер файла и текущие запросы не растут с историей,
+а сводные листы отчётов архивов не касаются.
+
+Детальные выборки за период подключают (ATTACH) только архивы нужных месяцев,
+по одному: ограничение SQLite — не больше 10 подключённых баз на соединение.
+Для чтения архив подключается только на чтение (mode=ro); схему архивов догоняет
+до живой базы upgrade_archives() при старте и сама команда архивации.
+"""
+
+import logging
+import re
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+import db
+import timeutils
+from config import ARCHIVE_DIR, ARCHIVE_KEEP_MONTHS
+
+logger = logging.getLogger(__name__)
+
+ALIAS = "arc"
+_FILE_NAME = re.compile(r"^orders_(\d{4})_(\d{2})\.db$")
+
+# Что переносится и какие строки относятся к месяцу (параметры — ключи первого и последнего дня).
+# Позиции идут первыми: их фильтр ссылается на orders, которые удаляются следом.
+ARCHIVED_TABLES = {
+    "order_items": "order_id IN (SELECT id FROM main.orders WHERE day BETWEEN ? AND ?)",
+    "orders": "day BETWEEN ? AND ?",
+    "actions_log": "day BETWEEN ? AND ?",
+}
+
+ARCHIVE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_orders_day ON orders(day, ts)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_order_items_order ON order_items(order_id)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_actions_log_ts ON actions_log(ts)",
+)
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def next_month(d: date) -> date:
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def month_days(month: date) -> tuple[int, int]:
+    """Ключи первого и последнего рабочего дня месяца."""
+    return timeutils.day_key(month), timeutils.day_key(next_month(month) - timedelta(days=1))
+
+
+def archive_path(month: date) -> Path:
+    return Path(ARCHIVE_DIR) / f"orders_{month.year:04d}_{month.month:02d}.db"
+
+
+def list_archives(start: date | None = None, end: date | None = None) -> list[tuple[date, Path]]:
+    """Существующие архивы месяцев, пересекающихся с рабочими днями [start, end], по возрастанию."""
+    folder = Path(ARCHIVE_DIR)
+    if not folder.is_dir():
+        return []
+    found = []
+    for path in folder.iterdir():
+        match = _FILE_NAME.match(path.name)
+        if not match:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        if start is not None and next_month(month) <= start:
+            continue
+        if end is not None and month > end:
+            continue
+        found.append((month, path))
+    return sorted(found)
+
+
+def _columns(conn, schema: str, table: str) -> list[tuple]:
+    """(имя, тип, значение по умолчанию) колонок таблицы."""
+    return [(r[1], r[2], r[4]) for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _ensure_archive_schema(conn, schema: str = ALIAS):
+    """
+    Создаёт в архиве таблицы по образцу живой базы и добавляет колонки,
+    появившиеся в ней после создания архива (новые миграции архивы не трогают).
+    """
+    for table in ARCHIVED_TABLES:
+        sql = conn.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()[0]
+        # после ALTER TABLE ... RENAME имя в DDL может быть в кавычках
+        conn.execute(re.sub(r"^CREATE TABLE\s+(IF NOT EXISTS\s+)?", f"CREATE TABLE IF NOT EXISTS {schema}.", sql))
+        existing = {name for name, _, _ in _columns(conn, schema, table)}
+        for name, decl_type, default in _columns(conn, "main", table):
+            if name not in existing:
+                default_sql = f" DEFAULT {default}" if default is not None else ""
+                conn.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {decl_type}{default_sql}")
+    for sql in ARCHIVE_INDEXES:
+        conn.execute(sql.format(schema=schema))
+
+
+@contextmanager
+def attached(path: Path, alias: str = ALIAS, readonly: bool = True):
+    """
+    Подключает архив к соединению текущего потока на время блока (вне транзакции).
+    По умолчанию только на чтение; readonly=False — для переноса месяца и обновления схемы.
+    """
+    conn = db.get_connection()
+    target = Path(path).resolve().as_uri() + "?mode=ro" if readonly else str(path)
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (target,))
+    try:
+        yield conn
+    finally:
+        conn.execute(f"DETACH DATABASE {alias}")
+
+
+def upgrade_archives() -> int:
+    """Добавляет в существующие архивы таблицы, колонки и индексы живой базы. Возвращает число архивов."""
+    found = list_archives()
+    for _, path in found:
+        with attached(path, readonly=False) as conn:
+            _ensure_archive_schema(conn, ALIAS)
+    return len(found)
+
+
+def sources(start: date | None = None, end: date | None = None):
+    """
+    Имена схем, где лежат заказы рабочих дней [start, end] (None — без границы):
+    сначала нужные архивы по возрастанию месяца, каждый подключён только на время
+    своей итерации, затем живая база "main".
+    """
+    for _, path in list_archives(start, end):
+        with attached(path):
+            yield ALIAS
+    yield "main"
+
+
+def archive_month(month: date) -> dict[str, int]:
+    """
+    Переносит заказы и журнал рабочего месяца в архивный файл.
+    Копирование (INSERT OR IGNORE по id), сверка содержимого и удаление из живой базы
+    идут одной транзакцией; в WAL она не атомарна между файлами, поэтому команда
+    идемпотентна — повторный запуск после сбоя дописывает и удаляет оставшееся.
+    Возвращает число перенесённых строк по таблицам.
+    """
+    month = month_start(month)
+    params = month_days(month)
+    conn = db.get_connection()
+    has_rows = conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM orders WHERE day BETWEEN ? AND ?) "
+        "OR EXISTS (SELECT 1 FROM actions_log WHERE day BETWEEN ? AND ?)",
+        params + params,
+    ).fetchone()[0]
+    if not has_rows:
+        return {table: 0 for table in ARCHIVED_TABLES}
+
+    path = archive_path(month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    moved = {}
+    with attached(path, readonly=False), db.transaction() as conn:
+        _ensure_archive_schema(conn, ALIAS)
+        for table, where in ARCHIVED_TABLES.items():
+            cols = ", ".join(name for name, _, _ in _columns(conn, "main", table))
+            conn.execute(
+                f"INSERT OR IGNORE INTO {ALIAS}.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE {where}",
+                params,
+            )
+            # каждая строка месяца должна лежать в архиве в точности такой же
+            missing = conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT {cols} FROM main.{table} WHERE {where} "
+                f"EXCEPT SELECT {cols} FROM {ALIAS}.{table})",
+                params,
+            ).fetchone()[0]
+            if missing:
+                raise RuntimeError(f"Archive {path} verification failed: {missing} {table} rows differ")
+
+        for table, where in ARCHIVED_TABLES.items():
+            moved[table] = conn.execute(f"DELETE FROM main.{table} WHERE {where}", params).rowcount
+    logger.info(f"Archived {month:%Y-%m} to {path}: {moved}")
+    return moved
+
+
+def archive_closed_months(keep_months: int = ARCHIVE_KEEP_MONTHS) -> list[tuple[date, dict]]:
+    """
+    Архивирует все месяцы старше последних keep_months (текущий месяц всегда остаётся).
+    Возвращает [(месяц, перенесено по таблицам), ...].
+    """
+    cutoff = month_start(timeutils.business_day())
+    for _ in range(max(1, keep_months) - 1):
+        cutoff = month_start(cutoff - timedelta(days=1))
+
+    first = db.get_connection().execute(
+        "SELECT MIN(day) FROM (SELECT MIN(day) AS day FROM orders WHERE day > 0 "
+        "UNION ALL SELECT MIN(day) FROM actions_log WHERE day > 0)"
+    ).fetchone()[0]
+    if first is None:
+        return []
+
+    done = []
+    month = month_start(timeutils.key_to_date(first))
+    while month < cutoff:
+        moved = archive_month(month)
+        if any(moved.values()):
+            done.append((month, moved))
+        month = next_month(month)
+    return done
+
+
+def rebuild_daily_sales() -> int:
+    """Пересчитывает daily_sales по живой базе и всем архивам."""
+    return db.rebuild_daily_sales(path for _, path in list_archives())
@@ -0,0 +1,256 @@
+"""
+Онлайн-резервные копии базы заказов через SQLite backup API.
+
+Копия снимается, пока бот работает: sqlite3.Connection.backup переносит по
+BACKUP_PAGES_PER_STEP страниц за шаг, а между шагами поток спит BACKUP_STEP_SLEEP_MS,
+поэтому диск и GIL достаются кассирам, а запись не ждёт копию. Все шаги идут в одной
+читающей транзакции: в WAL это один снимок базы, и записи других соединений не
+заставляют SQLite начинать копирование заново. Если перезапуски всё же случаются
+(база не в WAL), после BACKUP_MAX_RESTARTS остаток копируется одним шагом.
+
+Готовая копия проверяется PRAGMA integrity_check, сжимается gzip и кладётся в
+BACKUP_DIR как orders_ГГГГММДД_ЧЧММСС.db.gz; старше BACKUP_KEEP последних — удаляются.
+Пока идёт копирование, db.observe_write_waits() собирает, сколько настоящие записи
+бота ждали BEGIN IMMEDIATE; самое долгое ожидание — метрика max_stall_ms.
+
+Архивы месяцев (archive.py) после переноса не меняются, поэтому они копируются в
+BACKUP_DIR/archive по одному файлу на месяц и только если архив новее своей копии.
+
+restore_backup подменяет живую базу копией (при остановленном боте) и очищает кэш отчётов.
+"""
+
+import asyncio
+import gzip
+import logging
+import re
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+import archive
+import db
+import report_cache
+import timeutils
+from config import (
+    BACKUP_DIR,
+    BACKUP_KEEP,
+    BACKUP_COMPRESS,
+    BACKUP_INTERVAL_HOURS,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_SLEEP_MS,
+    BACKUP_MAX_RESTARTS,
+    DB_BACKEND,
+)
+
+logger = logging.getLogger(__name__)
+
+_FILE_NAME = re.compile(r"^(?P<stem>.+)_\d{8}_\d{6}\.db(\.gz)?$")
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(source: sqlite3.Connection, target: sqlite3.Connection, pages: int, sleep_ms: float, max_restarts: int) -> dict:
+    """Постраничное копирование; возвращает число шагов и перезапусков."""
+    stats = {"steps": 0, "restarts": 0}
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        stats["steps"] += 1
+        nonlocal last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            # источник изменили другим соединением — SQLite начал заново
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if remaining:
+            time.sleep(sleep_ms / 1000)
+
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    except _TooManyRestarts:
+        logger.warning(f"Backup restarted {stats['restarts']} times, copying the rest in one step")
+        source.backup(target, pages=-1)
+        stats["steps"] += 1
+    return stats
+
+
+def _compress(path: Path) -> Path:
+    packed = path.with_name(path.name + ".gz")
+    with open(path, "rb") as src, gzip.open(packed, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    path.unlink()
+    return packed
+
+
+def _finish_copy(dest: sqlite3.Connection, partial: Path, target: Path) -> int:
+    """Проверяет копию, закрывает её и переименовывает .part в target; возвращает число страниц."""
+    try:
+        # копия — самостоятельный файл без -wal рядом
+        dest.execute("PRAGMA journal_mode=DELETE")
+        page_count = dest.execute("PRAGMA page_count").fetchone()[0]
+        check = dest.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        dest.close()
+    if [row[0] for row in check] != ["ok"]:
+        partial.unlink()
+        raise RuntimeError(f"Backup {target} failed integrity check: {check[:5]}")
+    partial.replace(target)
+    return page_count
+
+
+def backup_archives(folder: str | Path, *, compress: bool = BACKUP_COMPRESS) -> int:
+    """
+    Копирует архивы месяцев в folder (одна копия на месяц, без ротации), пропуская те,
+    чья копия не старше самого архива. Возвращает число скопированных архивов.
+    """
+    folder = Path(folder)
+    copied = 0
+    for _, path in archive.list_archives():
+        target = folder / path.name
+        stored = target.with_name(target.name + ".gz") if compress else target
+        if stored.exists() and stored.stat().st_mtime >= path.stat().st_mtime:
+            continue
+        folder.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(target.name + ".part")
+        source = sqlite3.connect(path.resolve().as_uri() + "?mode=ro", uri=True)
+        dest = sqlite3.connect(partial, isolation_level=None)
+        try:
+            source.backup(dest)
+        except BaseException:
+            dest.close()
+            raise
+        finally:
+            source.close()
+        _finish_copy(dest, partial, target)
+        if compress:
+            _compress(target)
+        copied += 1
+    return copied
+
+
+def list_backups(folder: str | Path = BACKUP_DIR, stem: str | None = None) -> list[Path]:
+    """Копии в папке по возрастанию времени (имя содержит метку времени)."""
+    folder = Path(folder)
+    if not folder.is_dir():
+        return []
+    stem = stem or Path(db.DB_PATH).stem
+    found = []
+    for path in folder.iterdir():
+        match = _FILE_NAME.match(path.name)
+        if match and match.group("stem") == stem:
+            found.append(path)
+    return sorted(found, key=lambda p: p.name)
+
+
+def rotate(folder: str | Path = BACKUP_DIR, keep: int = BACKUP_KEEP) -> list[Path]:
+    """Удаляет копии сверх keep последних; возвращает удалённые пути."""
+    backups = list_backups(folder)
+    removed = backups[: max(0, len(backups) - max(1, keep))]
+    for path in removed:
+        path.unlink()
+    return removed
+
+
+def run_backup(
+    folder: str | Path = BACKUP_DIR,
+    *,
+    keep: int = BACKUP_KEEP,
+    compress: bool = BACKUP_COMPRESS,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    sleep_ms: float = BACKUP_STEP_SLEEP_MS,
+    max_restarts: int = BACKUP_MAX_RESTARTS,
+) -> dict:
+    """
+    Снимает копию живой базы, проверяет её, сжимает и чистит старые копии,
+    затем докопирует изменившиеся архивы месяцев.
+    Возвращает метрики: путь, длительность, страницы, шаги, перезапуски,
+    самое долгое ожидание писателя, размеры до и после сжатия, число скопированных архивов.
+    """
+    source_path = db.DB_PATH
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    target = folder / f"{Path(source_path).stem}_{timeutils.now():%Y%m%d_%H%M%S}.db"
+    partial = target.with_name(target.name + ".part")
+
+    t0 = time.perf_counter()
+    # отдельные соединения: пул потоков-читателей и писателя копирование не занимает
+    source = sqlite3.connect(source_path, isolation_level=None, check_same_thread=False)
+    dest = sqlite3.connect(partial, isolation_level=None)
+    try:
+        with db.observe_write_waits() as waits:
+            # чтение внутри одной транзакции: все шаги видят один снимок WAL,
+            # и запись других соединений не заставляет SQLite начинать заново
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            stats = _copy(source, dest, pages if pages > 0 else -1, sleep_ms, max_restarts)
+    finally:
+        source.close()
+    max_stall = max(waits, default=0.0)
+    page_count = _finish_copy(dest, partial, target)
+
+    size = target.stat().st_size
+    if compress:
+        target = _compress(target)
+    removed = rotate(folder, keep)
+    archives = backup_archives(folder / "archive", compress=compress)
+    metrics = {
+        "path": str(target),
+        "duration_s": time.perf_counter() - t0,
+        "pages": page_count,
+        "steps": stats["steps"],
+        "restarts": stats["restarts"],
+        "max_stall_ms": max_stall,
+        "size": size,
+        "stored_size": target.stat().st_size,
+        "rotated": len(removed),
+        "archives": archives,
+    }
+    logger.info(
+        f"Backup {target}: {page_count} pages in {metrics['duration_s']:.2f} s, "
+        f"{stats['steps']} steps, {stats['restarts']} restarts, max writer stall {max_stall:.2f} ms, "
+        f"{size / 2**20:.1f} -> {metrics['stored_size'] / 2**20:.1f} MiB, rotated {len(removed)}, "
+        f"archives copied {archives}"
+    )
+    return metrics
+
+
+def restore_backup(path: str | Path) -> int:
+    """
+    Восстанавливает живую базу из копии (.db или .db.gz). Бот должен быть остановлен.
+    Копия распаковывается рядом с DB_PATH и проверяется, затем заменяет файл базы
+    вместе с её -wal/-shm. Кэш отчётов очищается: счётчики изменений дней в копии
+    старые, и версии периодов могут совпасть с версиями отчётов, построенных после неё.
+    Возвращает число страниц восстановленной базы.
+    """
+    source = Path(path)
+    target = Path(db.DB_PATH)
+    partial = target.with_name(target.name + ".restore")
+    opener = gzip.open if source.suffix == ".gz" else open
+    with opener(source, "rb") as src, open(partial, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    page_count = _finish_copy(sqlite3.connect(partial, isolation_level=None), partial, partial)
+
+    db.close_connections()
+    for suffix in ("-wal", "-shm"):
+        Path(f"{target}{suffix}").unlink(missing_ok=True)
+    partial.replace(target)
+    cleared = report_cache.clear()
+    logger.info(f"Restored {target} from {source}: {page_count} pages, cleared {cleared} cached reports")
+    return page_count
+
+
+async def backup_loop(interval_hours: float = BACKUP_INTERVAL_HOURS):
+    """Фоновая задача бота: копия раз в interval_hours (0 — отключено)."""
+    if interval_hours <= 0 or DB_BACKEND != "sqlite":
+        return
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await loop.run_in_executor(None, run_backup)
+        except Exception as exc:
+            logger.error(f"Scheduled backup failed: {exc}")
@@ -0,0 +1,1030 @@
+import argparse
+import asyncio
+import functools
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# ====== НАСТРОЙКИ ======
+THREADS = 8
+OPS_PER_THREAD = 300
+WRITE_SHARE = 0.3  # доля записей среди операций
+USERS = 20
+SEED_ORDERS = 20000
+REPORT_READERS = 1  # потоки, параллельно гоняющие тяжёлый отчётный SELECT
+INDEX_BENCH_LINES = 1_000_000  # строк order_items для сравнения планов запросов
+HISTORY_DAYS = 365
+LOOP_TICK_MS = 5  # период «пульса» цикла событий в loop-latency
+LOOP_WRITERS = 8  # одновременных «кассиров», пишущих заказы
+LOOP_ORDERS_PER_WRITER = 100
+LOOP_ITEMS_PER_ORDER = 40  # крупные заказы, чтобы запись была заметной
+BURST_CASHIERS = 50  # одновременных отправителей в batching
+BURST_ORDERS_PER_CASHIER = 40
+ARCHIVE_BENCH_LINES_PER_YEAR = 300_000  # строк order_items в год истории для archive
+ARCHIVE_BENCH_YEARS = (1, 2, 4)
+GROUP_ORDER_UNITS = (10, 50)  # штук одной позиции в «групповом» заказе
+GROUP_ORDER_REPEAT = 200
+BACKUP_BENCH_LINES = 1_000_000  # строк order_items в копируемой базе
+BACKUP_BENCH_CASHIERS = 8  # кассиров, пишущих заказы во время копии
+SUITE_SIZES = {"10k": 10_000, "1M": 1_000_000, "10M": 10_000_000}  # строк order_items в истории
+SUITE_THREADS = 8  # потоков в concurrent-прогонах
+SUITE_WRITE_OPS = 2000  # добавлений (и затем удалений) заказов на режим
+SUITE_READ_OPS = 2000  # страниц истории на режим
+SUITE_REPORT_OPS = 40  # отчётных выборок на режим
+SUITE_RESULTS_DIR = Path("bench_results")
+SUITE_JSON = None  # путь к JSON с результатами (--json)
+SUITE_COMPARE = None  # JSON прошлого прогона для сравнения (--compare)
+STORAGE_BENCH_ORDERS = 200_000  # синтетических заказов для сравнения бэкендов storage
+STORAGE_BENCH_CHUNK = 100  # заказов в одном write_batch
+STORAGE_BENCH_PAGE_READS = 2000
+LEGACY_TIMEOUT_S = 10  # как было в db.get_connection до пула
+# =======================
+
+import db
+import timeutils
+
+MENU_PATH = Path("menu.json")
+PAYMENT_TYPES = ["Наличный", "Безналичный"]
+
+
+def load_menu_items() -> list[tuple[str, int]]:
+    with open(MENU_PATH, "r", encoding="utf-8") as f:
+        menu = json.load(f)
+    return [(name, int(price)) for name, price in menu["main"].items() if price]
+
+
+def random_items(rng: random.Random, menu_items) -> list[dict]:
+    pay = rng.choice(PAYMENT_TYPES)
+    items = []
+    for _ in range(rng.randint(1, 4)):
+        name, price = rng.choice(menu_items)
+        items.append({"item_name": name, "price": price, "quantity": 1, "addons": [], "payment_type": pay})
+    return items
+
+
+# позиций в заказе и их частоты для mix_items
+MIX_ORDER_SIZES = (1, 2, 3, 4, 6)
+MIX_ORDER_SIZE_WEIGHTS = (45, 30, 15, 7, 3)
+
+
+def order_mix(path: Path = MENU_PATH, seed: int = 3) -> dict:
+    """
+    Распределение заказов по menu.json: популярность позиций убывает как 1/ранг
+    (порядок рангов перемешан seed-ом), у трети позиций есть добавки, иногда
+    берут несколько штук. Позиции с нулевой ценой (стаканчики и т.п.) не участвуют.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        menu = json.load(f)
+    main = [(name, int(price)) for name, price in menu["main"].items() if price]
+    random.Random(seed).shuffle(main)
+    return {
+        "names": [name for name, _ in main],
+        "prices": [price for _, price in main],
+        "weights": [1 / rank for rank in range(1, len(main) + 1)],
+        "addons": [{"name": name, "price": int(price)} for name, price in menu.get("addons", {}).items()],
+        "lines_per_order": sum(n * w for n, w in zip(MIX_ORDER_SIZES, MIX_ORDER_SIZE_WEIGHTS))
+        / sum(MIX_ORDER_SIZE_WEIGHTS),
+    }
+
+
+def mix_items(rng: random.Random, mix: dict) -> list[dict]:
+    """Позиции одного заказа по распределению order_mix (одна оплата на заказ)."""
+    pay = PAYMENT_TYPES[0] if rng.random() < 0.6 else rng.choice(PAYMENT_TYPES)
+    count = rng.choices(MIX_ORDER_SIZES, weights=MIX_ORDER_SIZE_WEIGHTS)[0]
+    picks = rng.choices(range(len(mix["names"])), weights=mix["weights"], k=count)
+    items = []
+    for idx in picks:
+        addons = rng.sample(mix["addons"], rng.choice((1, 1, 2))) if mix["addons"] and rng.random() < 0.33 else []
+        items.append(
+            {
+                "item_name": mix["names"][idx],
+                "price": mix["prices"][idx],
+                "quantity": rng.choices((1, 2, 3, 5), weights=(85, 10, 4, 1))[0],
+                "addons": addons,
+                "payment_type": pay,
+            }
+        )
+    return items
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def generate_history(
+    conn: sqlite3.Connection, lines: int, menu_items, *, users=USERS, days=HISTORY_DAYS, seed=42, mix=None
+):
+    """
+    Быстро заливает синтетическую историю заказов напрямую SQL-ом (без add_order_items).
+    Колонки ts/day, id справочников и подписи добавок заполняются, только если схема их уже содержит.
+    С mix (см. order_mix) позиции, количество и добавки берутся из его распределения,
+    иначе — равномерно из menu_items по одной штуке без добавок.
+    """
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=days)
+    span = days * 86400
+    with_time = "ts" in {r[1] for r in conn.execute("PRAGMA table_info(orders)")}
+    time_cols, time_marks = (", ts, day", ", ?, ?") if with_time else ("", "")
+    with_ids = "item_id" in {r[1] for r in conn.execute("PRAGMA table_info(order_items)")}
+    if with_ids:
+        name_cols = "item_id, payment_type_id"
+        conn.execute("BEGIN")
+        names = db._lookup_ids(conn, "menu_items", (name for name, _ in menu_items))
+        pays = db._lookup_ids(conn, "payment_types", PAYMENT_TYPES)
+        conn.execute("COMMIT")
+    else:
+        name_cols = "item_name, payment_type"
+        names = {name: name for name, _ in menu_items}
+        pays = {pay: pay for pay in PAYMENT_TYPES}
+    qty_col, qty_mark = (", quantity", ", ?") if with_ids else ("", "")
+    with_labels = "addons_text" in {r[1] for r in conn.execute("PRAGMA table_info(order_items)")}
+    label_cols, label_marks = (", addons_text, addons_key", ", ?, ?") if with_labels else ("", "")
+    if mix is not None:
+        conn.execute("BEGIN")
+        names.update(db._lookup_ids(conn, "menu_items", mix["names"]) if with_ids else {n: n for n in mix["names"]})
+        conn.execute("COMMIT")
+    orders, items, actions = [], [], []
+    order_id = (conn.execute("SELECT MAX(id) FROM orders").fetchone()[0] or 0)
+    written = 0
+    # даты растут вместе с id, как в реальной базе
+    step = span / max(1, lines / (mix["lines_per_order"] if mix is not None else 2.5))
+    moment = 0.0
+
+    def flush():
+        conn.execute("BEGIN")
+        conn.executemany(
+            f"INSERT INTO orders (id, date{time_cols}, user_id, username, raw_text, is_staff) "
+            f"VALUES (?, ?{time_marks}, ?, ?, ?, ?)",
+            orders,
+        )
+        conn.executemany(
+            f"INSERT INTO order_items (order_id, {name_cols}, price, quantity, addons_total, addons_json, row_total, "
+            f"is_staff{label_cols}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?{label_marks})",
+            items,
+        )
+        conn.executemany(
+            f"INSERT INTO actions_log (timestamp{time_cols}, action_type, {name_cols}{qty_col}, user_id, username, is_staff) "
+            f"VALUES (?{time_marks}, 'добавление', ?, ?{qty_mark}, ?, ?, ?)",
+            actions,
+        )
+        conn.execute("COMMIT")
+        orders.clear()
+        items.clear()
+        actions.clear()
+
+    while written < lines:
+        order_id += 1
+        moment += rng.random() * 2 * step
+        stamp = timeutils.stamp(start + timedelta(seconds=min(moment, span)))
+        when = stamp if with_time else stamp[:1]
+        user_id = rng.randrange(users)
+        is_staff = 1 if rng.random() < 0.1 else 0
+        pay = pays[rng.choice(PAYMENT_TYPES)]
+        orders.append((order_id, *when, user_id, f"user{user_id}", "bench", is_staff))
+        if mix is not None:
+            lines_of_order = [
+                (it["item_name"], it["price"], it["quantity"], it["addons"]) for it in mix_items(rng, mix)
+            ]
+        else:
+            lines_of_order = [(*rng.choice(menu_items), 1, []) for _ in range(rng.randint(1, 4))]
+        for name, price, qty, addons in lines_of_order[: lines - written]:
+            addons_total = sum(a["price"] for a in addons)
+            addons_json = json.dumps(addons, ensure_ascii=False) if addons else "[]"
+            row_total = (price + addons_total) * qty
+            item = (order_id, names[name], pay, price, qty, addons_total, addons_json, row_total, is_staff)
+            if with_labels:
+                item += (db.addons_label(addons), db.addons_key(addons))
+            items.append(item)
+            action = (*when, names[name], pay) + ((qty,) if with_ids else ())
+            actions.append((*action, user_id, f"user{user_id}", is_staff))
+            written += 1
+        if len(items) >= 50_000:
+            flush()
+    if orders:
+        flush()
+
+
+# ---------- «старый» доступ: новое соединение на каждый вызов, rollback-журнал ----------
+
+
+def _legacy_connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=LEGACY_TIMEOUT_S)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def legacy_add_order(path: str, items: list[dict], user_id: int):
+    conn = _legacy_connect(path)
+    try:
+        cur = conn.cursor()
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        cur.execute(
+            "INSERT INTO orders (date, user_id, username, raw_text, is_staff) VALUES (?, ?, ?, ?, 0)",
+            (now, user_id, f"user{user_id}", "bench"),
+        )
+        order_id = cur.lastrowid
+        for it in items:
+            cur.execute(
+                "INSERT INTO order_items (order_id, item_name, payment_type, price, quantity, addons_total, addons_json, row_total, is_staff) "
+                "VALUES (?, ?, ?, ?, 1, 0, '[]', ?, 0)",
+                (order_id, it["item_name"], it["payment_type"], it["price"], it["price"]),
+            )
+            cur.execute(
+                "INSERT INTO actions_log (timestamp, action_type, payment_type, item_name, user_id, username, is_staff) "
+                "VALUES (?, 'добавление', ?, ?, ?, ?, 0)",
+                (now, it["payment_type"], it["item_name"], user_id, f"user{user_id}"),
+            )
+        conn.commit()
+        return order_id
+    finally:
+        conn.close()
+
+
+LAST_ORDER_SQL = """
+SELECT oi.* FROM order_items oi
+WHERE oi.order_id = (SELECT MAX(id) FROM orders WHERE user_id = ?)
+"""
+
+LEGACY_REPORT_SQL = """
+SELECT i.payment_type, i.item_name, COUNT(*), SUM(i.row_total)
+FROM orders o JOIN order_items i ON i.order_id = o.id
+GROUP BY i.payment_type, i.item_name
+"""
+
+REPORT_SQL = """
+SELECT p.name, m.name, g.n, g.total
+FROM (
+    SELECT i.payment_type_id, i.item_id, COUNT(*) AS n, SUM(i.row_total) AS total
+    FROM orders o JOIN order_items i ON i.order_id = o.id
+    GROUP BY i.payment_type_id, i.item_id
+) g
+JOIN payment_types p ON p.id = g.payment_type_id
+JOIN menu_items m ON m.id = g.item_id
+"""
+
+
+def legacy_read(path: str, sql: str, params=()) -> int:
+    conn = _legacy_connect(path)
+    try:
+        return len(conn.execute(sql, params).fetchall())
+    finally:
+        conn.close()
+
+
+def pooled_read(sql: str, params=()) -> int:
+    return len(db.get_connection().execute(sql, params).fetchall())
+
+
+# ---------- общий прогон ----------
+
+
+def _prepare_db(path: str, menu_items, *, schema_version: int | None = None):
+    db.DB_PATH = path
+    db.migrate(target_version=schema_version)
+    # в среднем 2.5 позиции на заказ
+    generate_history(db.get_connection(), SEED_ORDERS * 5 // 2, menu_items, users=USERS, seed=1)
+    db.close_connections()
+
+
+def _run_workload(write_fn, read_fn, menu_items, report_sql: str) -> dict:
+    latencies = {"write": [], "read": []}
+    errors = {"locked": 0, "other": 0}
+    guard = threading.Lock()
+    done = threading.Event()
+    reports_run = [0]
+
+    def report_reader():
+        # имитирует менеджера, выгружающего отчёт в час пик
+        while not done.is_set():
+            try:
+                read_fn(report_sql, ())
+            except sqlite3.OperationalError:
+                pass
+            with guard:
+                reports_run[0] += 1
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        local = {"write": [], "read": []}
+        local_errors = {"locked": 0, "other": 0}
+        for _ in range(OPS_PER_THREAD):
+            user_id = rng.randrange(USERS)
+            kind = "write" if rng.random() < WRITE_SHARE else "read"
+            t0 = time.perf_counter()
+            try:
+                if kind == "write":
+                    write_fn(random_items(rng, menu_items), user_id)
+                else:
+                    read_fn(LAST_ORDER_SQL, (user_id,))
+            except sqlite3.OperationalError as exc:
+                local_errors["locked" if "locked" in str(exc).lower() else "other"] += 1
+                continue
+            local[kind].append((time.perf_counter() - t0) * 1000.0)
+        with guard:
+            for k in latencies:
+                latencies[k].extend(local[k])
+            for k in errors:
+                errors[k] += local_errors[k]
+
+    readers = [threading.Thread(target=report_reader) for _ in range(REPORT_READERS)]
+    threads = [threading.Thread(target=worker, args=(s,)) for s in range(THREADS)]
+    t0 = time.perf_counter()
+    for t in readers + threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    for t in readers:
+        t.join()
+
+    result = {"elapsed_s": elapsed, "errors": errors, "reports": reports_run[0]}
+    for kind, values in latencies.items():
+        result[kind] = {
+            "count": len(values),
+            "mean_ms": statistics.fmean(values) if values else 0.0,
+            "p95_ms": percentile(values, 95),
+        }
+    return result
+
+
+def _print_result(title: str, res: dict):
+    print(f"\n--- {title} ---")
+    print(f"Elapsed: {res['elapsed_s']:.2f} s  (report queries in background: {res['reports']})")
+    print(f"Lock errors: {res['errors']['locked']}  other errors: {res['errors']['other']}")
+    for kind in ("write", "read"):
+        r = res[kind]
+        print(f"{kind:>5}: n={r['count']:<6} mean={r['mean_ms']:.2f} ms  p95={r['p95_ms']:.2f} ms")
+
+
+def bench_connections():
+    """Сравнивает соединение-на-вызов (rollback-журнал) с пулом соединений в WAL."""
+    menu_items = load_menu_items()
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = str(Path(tmp) / "legacy.db")
+        pooled_path = str(Path(tmp) / "pooled.db")
+
+        # «старый» вариант работает на исходной схеме (миграция 1)
+        _prepare_db(legacy_path, menu_items, schema_version=1)
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        _prepare_db(pooled_path, menu_items)
+
+        legacy = _run_workload(
+            lambda items, uid: legacy_add_order(legacy_path, items, uid),
+            lambda sql, params: legacy_read(legacy_path, sql, params),
+            menu_items,
+            LEGACY_REPORT_SQL,
+        )
+
+        db.DB_PATH = pooled_path
+        try:
+            pooled = _run_workload(
+                lambda items, uid: db.add_order_items(items, uid, f"user{uid}", "bench"),
+                pooled_read,
+                menu_items,
+                REPORT_SQL,
+            )
+        finally:
+            db.close_connections()
+
+    print(f"threads={THREADS} ops/thread={OPS_PER_THREAD} write_share={WRITE_SHARE}")
+    _print_result("connection per call, rollback journal", legacy)
+    _print_result("pooled connections, WAL", pooled)
+
+
+# (запрос на исходной схеме, запрос на текущей схеме)
+HOT_QUERIES = {
+    "user history page": (
+        "SELECT o.id, o.date FROM orders o WHERE o.user_id = ? ORDER BY o.date DESC LIMIT 6",
+        "SELECT o.id, o.ts FROM orders o WHERE o.user_id = ? ORDER BY o.ts DESC, o.id DESC LIMIT 6",
+        lambda day: (3,),
+    ),
+    "order items": (
+        "SELECT item_name, price, quantity, row_total FROM order_items WHERE order_id = ?",
+        "SELECT m.name, i.price, i.quantity, i.row_total FROM order_items i "
+        "JOIN menu_items m ON m.id = i.item_id WHERE i.order_id = ?",
+        lambda day: (123_456,),
+    ),
+    "clear today (user, day)": (
+        "SELECT o.id FROM orders o WHERE o.user_id = ? AND date(o.date) = ?",
+        "SELECT o.id FROM orders o WHERE o.user_id = ? AND o.ts >= ? AND o.ts < ?",
+        lambda day: (3, day.isoformat()),
+    ),
+    "actions log for a day": (
+        "SELECT COUNT(*) FROM actions_log WHERE date(timestamp) = ?",
+        "SELECT COUNT(*) FROM actions_log WHERE ts >= ? AND ts < ?",
+        lambda day: (day.isoformat(),),
+    ),
+    "report for a day": (
+        "SELECT COUNT(*), SUM(i.row_total) FROM orders o JOIN order_items i ON i.order_id = o.id "
+        "WHERE date(o.date) BETWEEN ? AND ?",
+        "SELECT COUNT(*), SUM(i.row_total) FROM orders o JOIN order_items i ON i.order_id = o.id "
+        "WHERE o.day BETWEEN ? AND ?",
+        lambda day: (day.isoformat(), day.isoformat()),
+    ),
+}
+
+
+def _current_params(sql: str, legacy_params: tuple, day):
+    """Те же условия в терминах ts/day."""
+    start, end = (timeutils.to_epoch(b) for b in timeutils.business_day_bounds(day))
+    if "o.ts >= ?" in sql:
+        return (legacy_params[0], start, end)
+    if "ts >= ?" in sql:
+        return (start, end)
+    if "day BETWEEN" in sql:
+        return (timeutils.day_key(day), timeutils.day_key(day))
+    return legacy_params
+
+
+def _time_query(conn, sql, params, repeat=5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        best = min(best, (time.perf_counter() - t0) * 1000.0)
+    return best
+
+
+def _explain_hot_queries(conn, title: str, legacy: bool):
+    day = (datetime.now() - timedelta(days=1)).date()
+    print(f"\n=== {title} ===")
+    for name, (legacy_sql, current_sql, make_params) in HOT_QUERIES.items():
+        params = make_params(day)
+        sql = legacy_sql
+        if not legacy:
+            sql = current_sql
+            params = _current_params(sql, params, day)
+        plan = "; ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+        ms = _time_query(conn, sql, params)
+        print(f"{name:<24} {ms:9.2f} ms   {plan}")
+
+
+def bench_indexes():
+    """Планы и время горячих запросов до и после миграции с индексами."""
+    menu_items = load_menu_items()
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = str(Path(tmp) / "indexes.db")
+        try:
+            db.migrate(target_version=1)
+            conn = db.get_connection()
+            t0 = time.perf_counter()
+            generate_history(conn, INDEX_BENCH_LINES, menu_items)
+            print(f"Generated {INDEX_BENCH_LINES} order lines in {time.perf_counter() - t0:.1f} s")
+
+            _explain_hot_queries(conn, "before (schema v1)", legacy=True)
+            t0 = time.perf_counter()
+            applied = db.migrate()
+            print(f"\nApplied migrations {applied} in {time.perf_counter() - t0:.1f} s")
+            _explain_hot_queries(conn, "after (all migrations)", legacy=False)
+            t0 = time.perf_counter()
+            db.init_db()
+            print(f"\nRestart with up-to-date schema: {(time.perf_counter() - t0) * 1000:.2f} ms")
+        finally:
+            db.close_connections()
+
+
+async def _measure_loop_lag(workload) -> dict:
+    """Запускает workload и параллельно меряет, насколько опаздывают тики цикла событий."""
+    lags: list[float] = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        interval = LOOP_TICK_MS / 1000
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, (time.perf_counter() - t0 - interval) * 1000.0))
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.2)  # базовая линия без нагрузки
+    t0 = time.perf_counter()
+    await workload()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await tick_task
+    return {
+        "elapsed_s": elapsed,
+        "lag_p50_ms": percentile(lags, 50),
+        "lag_p99_ms": percentile(lags, 99),
+        "lag_max_ms": max(lags) if lags else 0.0,
+    }
+
+
+def bench_loop_latency():
+    """Задержка цикла событий при массовой записи: синхронные вызовы db против db_async."""
+    import db_async
+
+    menu_items = load_menu_items()
+    rng = random.Random(7)
+    orders = [
+        [
+            {"item_name": n, "price": p, "quantity": 1, "addons": [], "payment_type": "Наличный"}
+            for n, p in (rng.choice(menu_items) for _ in range(LOOP_ITEMS_PER_ORDER))
+        ]
+        for _ in range(LOOP_ORDERS_PER_WRITER)
+    ]
+
+    async def cashier_sync(uid):
+        for items in orders:
+            db.add_order_items(items, uid, f"user{uid}", "bench")
+            await asyncio.sleep(0)
+
+    async def cashier_async(uid):
+        for items in orders:
+            await db_async.add_order_items(items, uid, f"user{uid}", "bench")
+
+    async def run(cashier):
+        await asyncio.gather(*(cashier(uid) for uid in range(LOOP_WRITERS)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = str(Path(tmp) / "loop.db")
+        try:
+            db.init_db()
+            sync_res = asyncio.run(_measure_loop_lag(lambda: run(cashier_sync)))
+            async_res = asyncio.run(_measure_loop_lag(lambda: run(cashier_async)))
+        finally:
+            db_async.shutdown()
+
+    print(
+        f"writers={LOOP_WRITERS} orders/writer={LOOP_ORDERS_PER_WRITER} "
+        f"items/order={LOOP_ITEMS_PER_ORDER} tick={LOOP_TICK_MS} ms"
+    )
+    for title, res in (("sync db calls in handlers", sync_res), ("db_async", async_res)):
+        print(
+            f"{title:<26} elapsed={res['elapsed_s']:.2f} s  loop lag "
+            f"p50={res['lag_p50_ms']:.2f} ms  p99={res['lag_p99_ms']:.2f} ms  max={res['lag_max_ms']:.2f} ms"
+        )
+
+
+def bench_batching():
+    """
+    Нагрузочный тест записи: заказов в секунду с групповым коммитом и без него,
+    при synchronous=NORMAL и FULL (fsync на каждый коммит).
+    """
+    import db_async
+
+    menu_items = load_menu_items()
+
+    async def burst() -> list[float]:
+        latencies: list[float] = []
+
+        async def cashier(uid: int):
+            rng = random.Random(uid)
+            for _ in range(BURST_ORDERS_PER_CASHIER):
+                items = random_items(rng, menu_items)
+                t0 = time.perf_counter()
+                await db_async.add_order_items(items, uid, f"user{uid}", "bench")
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+
+        await asyncio.gather(*(cashier(uid) for uid in range(BURST_CASHIERS)))
+        return latencies
+
+    saved = db_async.DB_BATCH_MAX_ROWS, db_async.DB_BATCH_MAX_DELAY_MS
+    saved_pragmas = db.PRAGMAS
+    modes = {
+        f"{sync:<6} one transaction per order": (sync, 1, 0)
+        for sync in ("NORMAL", "FULL")
+    } | {
+        f"{sync:<6} group commit ({saved[0]} rows / {saved[1]} ms)": (sync, *saved)
+        for sync in ("NORMAL", "FULL")
+    }
+    total = BURST_CASHIERS * BURST_ORDERS_PER_CASHIER
+    print(f"cashiers={BURST_CASHIERS} orders/cashier={BURST_ORDERS_PER_CASHIER}")
+    logging_level = db_async.logger.level
+    db_async.logger.setLevel("WARNING")
+    try:
+        for title, (sync, max_rows, max_delay) in modes.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                db.DB_PATH = str(Path(tmp) / "batching.db")
+                db.PRAGMAS = tuple(
+                    f"PRAGMA synchronous={sync}" if p.startswith("PRAGMA synchronous") else p for p in saved_pragmas
+                )
+                db_async.DB_BATCH_MAX_ROWS, db_async.DB_BATCH_MAX_DELAY_MS = max_rows, max_delay
+                try:
+                    db.init_db()
+                    t0 = time.perf_counter()
+                    latencies = asyncio.run(burst())
+                    elapsed = time.perf_counter() - t0
+                    writer_batches = db_async._writer.batches
+                finally:
+                    db_async.shutdown()
+            print(
+                f"{title:<43} {total / elapsed:8.0f} orders/s  commits={writer_batches:<5} "
+                f"p50={percentile(latencies, 50):.2f} ms  p99={percentile(latencies, 99):.2f} ms"
+            )
+    finally:
+        db_async.DB_BATCH_MAX_ROWS, db_async.DB_BATCH_MAX_DELAY_MS = saved
+        db.PRAGMAS = saved_pragmas
+        db.close_connections()
+        db_async.logger.setLevel(logging_level)
+
+
+def _today_queries_ms(conn) -> float:
+    """Суммарное время горячих запросов (текущая схема) за сегодняшний рабочий день."""
+    day = timeutils.business_day()
+    total = 0.0
+    for _, current_sql, make_params in HOT_QUERIES.values():
+        total += _time_query(conn, current_sql, _current_params(current_sql, make_params(day), day))
+    return total
+
+
+def _used_mib(conn) -> float:
+    """Занятый объём базы без свободных страниц: их переиспользуют новые вставки."""
+    page_size, pages, free = (
+        conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_size", "page_count", "freelist_count")
+    )
+    return (pages - free) * page_size / 2**20
+
+
+def bench_archive():
+    """Размер живой базы и время запросов за сегодня при росте истории — до и после архивации."""
+    import archive
+
+    menu_items = load_menu_items()
+    print(f"lines/year={ARCHIVE_BENCH_LINES_PER_YEAR} keep_months={archive.ARCHIVE_KEEP_MONTHS}")
+    saved_dir = archive.ARCHIVE_DIR
+    try:
+        for years in ARCHIVE_BENCH_YEARS:
+            with tempfile.TemporaryDirectory() as tmp:
+                db.DB_PATH = str(Path(tmp) / "live.db")
+                archive.ARCHIVE_DIR = str(Path(tmp) / "archive")
+                try:
+                    db.init_db()
+                    conn = db.get_connection()
+                    generate_history(conn, ARCHIVE_BENCH_LINES_PER_YEAR * years, menu_items, days=365 * years)
+                    before = _used_mib(conn), _today_queries_ms(conn)
+                    t0 = time.perf_counter()
+                    months = archive.archive_closed_months()
+                    elapsed = time.perf_counter() - t0
+                    after = _used_mib(conn), _today_queries_ms(conn)
+                finally:
+                    db.close_connections()
+            print(
+                f"{years} y history: live {before[0]:7.1f} MiB, today's queries {before[1]:6.2f} ms | "
+                f"archived {len(months):>2} months in {elapsed:5.1f} s -> "
+                f"live {after[0]:6.1f} MiB, today's queries {after[1]:6.2f} ms"
+            )
+    finally:
+        archive.ARCHIVE_DIR = saved_dir
+
+
+def bench_group_order():
+    """Групповой заказ: строка на каждую штуку против одной строки с количеством."""
+    name, price = load_menu_items()[0]
+    addons = [{"name": "Сироп", "price": 30}]
+
+    def line(quantity: int) -> dict:
+        return {"item_name": name, "quantity": quantity, "price": price, "addons": addons, "payment_type": "Наличный"}
+
+    print(f"orders per run={GROUP_ORDER_REPEAT}")
+    for units in GROUP_ORDER_UNITS:
+        for title, items in (("row per unit", [line(1) for _ in range(units)]), ("quantity line", [line(units)])):
+            with tempfile.TemporaryDirectory() as tmp:
+                db.DB_PATH = str(Path(tmp) / "group.db")
+                try:
+                    db.init_db()
+                    t0 = time.perf_counter()
+                    for _ in range(GROUP_ORDER_REPEAT):
+                        db.add_order_items(items, 1, "user1", "bench")
+                    per_order_ms = (time.perf_counter() - t0) * 1000.0 / GROUP_ORDER_REPEAT
+                    item_rows, log_rows, counted = db.get_connection().execute(
+                        "SELECT (SELECT COUNT(*) FROM order_items), (SELECT COUNT(*) FROM actions_log), "
+                        "(SELECT SUM(quantity) FROM daily_sales)"
+                    ).fetchone()
+                finally:
+                    db.close_connections()
+            fsm_bytes = len(json.dumps(items, ensure_ascii=False).encode())
+            print(
+                f"{units:>3} units, {title:<14} FSM {fsm_bytes:>6} B  {per_order_ms:6.2f} ms/order  "
+                f"rows/order: items={item_rows // GROUP_ORDER_REPEAT} log={log_rows // GROUP_ORDER_REPEAT}  "
+                f"units in rollup={counted}"
+            )
+
+
+def bench_backup():
+    """Задержка записи заказов во время онлайн-копии: без копии, шагами с паузами, одним шагом."""
+    import backup
+    import db_async
+
+    menu_items = load_menu_items()
+    modes = {
+        "no backup": None,
+        f"stepped ({backup.BACKUP_PAGES_PER_STEP} pages / {backup.BACKUP_STEP_SLEEP_MS} ms)": (
+            backup.BACKUP_PAGES_PER_STEP, backup.BACKUP_STEP_SLEEP_MS,
+        ),
+        "single step": (-1, 0),
+    }
+    print(f"lines={BACKUP_BENCH_LINES} cashiers={BACKUP_BENCH_CASHIERS}")
+    logging_level = db_async.logger.level
+    db_async.logger.setLevel("WARNING")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db.DB_PATH = str(Path(tmp) / "live.db")
+            db.init_db()
+            generate_history(db.get_connection(), BACKUP_BENCH_LINES, menu_items)
+            db.close_connections()
+
+            for title, steps in modes.items():
+                metrics = {}
+
+                async def run() -> list[float]:
+                    latencies: list[float] = []
+                    done = asyncio.Event()
+
+                    async def cashier(uid: int):
+                        rng = random.Random(uid)
+                        while not done.is_set():
+                            items = random_items(rng, menu_items)
+                            t0 = time.perf_counter()
+                            await db_async.add_order_items(items, uid, f"user{uid}", "bench")
+                            latencies.append((time.perf_counter() - t0) * 1000.0)
+                            await asyncio.sleep(0.005)
+
+                    async def copy():
+                        if steps is None:
+                            await asyncio.sleep(2)
+                        else:
+                            metrics.update(await asyncio.to_thread(
+                                backup.run_backup, Path(tmp) / "backups", pages=steps[0], sleep_ms=steps[1]
+                            ))
+                        done.set()
+
+                    await asyncio.gather(copy(), *(cashier(uid) for uid in range(BACKUP_BENCH_CASHIERS)))
+                    return latencies
+
+                try:
+                    latencies = asyncio.run(run())
+                finally:
+                    db_async.shutdown()
+                line = (
+                    f"{title:<32} orders={len(latencies):<6} p50={percentile(latencies, 50):6.2f} ms  "
+                    f"p99={percentile(latencies, 99):6.2f} ms  max={max(latencies):7.2f} ms"
+                )
+                if metrics:
+                    line += (
+                        f" | backup {metrics['duration_s']:5.2f} s, steps={metrics['steps']} "
+                        f"restarts={metrics['restarts']} max writer stall {metrics['max_stall_ms']:.2f} ms, "
+                        f"{metrics['size'] / 2**20:.1f} -> {metrics['stored_size'] / 2**20:.1f} MiB"
+                    )
+                print(line)
+    finally:
+        db_async.logger.setLevel(logging_level)
+
+
+def _measure(calls, threads: int) -> dict:
+    """
+    Выполняет подготовленные вызовы (без аргументов) в threads потоках и считает
+    пропускную способность и перцентили задержки одного вызова.
+    """
+    latencies: list[float] = []
+    errors = [0]
+    guard = threading.Lock()
+
+    def worker(part):
+        local = []
+        for call in part:
+            t0 = time.perf_counter()
+            try:
+                call()
+            except Exception:
+                with guard:
+                    errors[0] += 1
+                continue
+            local.append((time.perf_counter() - t0) * 1000.0)
+        with guard:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(calls[t::threads],)) for t in range(threads)]
+    t0 = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return {
+        "count": len(latencies),
+        "errors": errors[0],
+        "elapsed_s": elapsed,
+        "ops_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def _suite_size(lines: int, mix: dict) -> dict:
+    """Все операции db.py на истории из lines строк: по очереди в одном потоке и в SUITE_THREADS."""
+    menu_items = list(zip(mix["names"], mix["prices"]))
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = str(Path(tmp) / "suite.db")
+        try:
+            db.init_db()
+            t0 = time.perf_counter()
+            generate_history(db.get_connection(), lines, menu_items, mix=mix, days=HISTORY_DAYS)
+            db.rebuild_daily_sales()
+            seed_s = time.perf_counter() - t0
+            size_mib = _used_mib(db.get_connection())
+
+            today = timeutils.business_day()
+            today_keys = (timeutils.day_key(today), timeutils.day_key(today))
+            month_keys = (timeutils.day_key(today - timedelta(days=30)), timeutils.day_key(today))
+            rng = random.Random(11)
+            modes = {"single": 1, "concurrent": SUITE_THREADS}
+            ops: dict[str, dict] = {}
+            added: dict[str, list] = {mode: [] for mode in modes}
+
+            def add_call(mode, uid, items):
+                def call():
+                    added[mode].append((db.add_order_items(items, uid, f"user{uid}", "bench"), uid))
+                return call
+
+            def report_call(i):
+                if i % 2:
+                    return lambda: (db.sales_summary(False, month_keys), db.author_summary(False, month_keys))
+                return lambda: sum(1 for _ in db.report_lines(days=today_keys))
+
+            plan = {
+                "add_order": lambda mode: [
+                    add_call(mode, uid, mix_items(rng, mix))
+                    for uid in (rng.randrange(USERS) for _ in range(SUITE_WRITE_OPS))
+                ],
+                "history_page": lambda mode: [
+                    functools.partial(db.get_user_orders_page, rng.randrange(USERS), 5)
+                    for _ in range(SUITE_READ_OPS)
+                ],
+                "report": lambda mode: [report_call(i) for i in range(SUITE_REPORT_OPS)],
+                "delete_order": lambda mode: [
+                    functools.partial(db.delete_entire_order, order_id, uid, f"user{uid}")
+                    for order_id, uid in added[mode]
+                ],
+            }
+            for op, make_calls in plan.items():
+                ops[op] = {mode: _measure(make_calls(mode), threads) for mode, threads in modes.items()}
+
+            # очистка «сегодня» — по одному разу на пользователя, половина в каждом режиме
+            start, end = timeutils.business_day_bounds(today)
+            users = list(range(USERS))
+            ops["delete_range"] = {
+                mode: _measure(
+                    [functools.partial(db.delete_orders_in_range, uid, start, end, f"user{uid}")
+                     for uid in users[i::len(modes)]],
+                    threads,
+                )
+                for i, (mode, threads) in enumerate(modes.items())
+            }
+        finally:
+            db.close_connections()
+    return {"lines": lines, "seed_s": seed_s, "db_mib": size_mib, "ops": ops}
+
+
+def _print_suite(name: str, res: dict, previous: dict | None):
+    print(f"\n--- {name}: {res['lines']} lines, {res['db_mib']:.1f} MiB, seeded in {res['seed_s']:.1f} s ---")
+    for op, by_mode in res["ops"].items():
+        for mode, r in by_mode.items():
+            line = (
+                f"{op:<13} {mode:<10} {r['ops_per_s']:9.1f} ops/s  p50={r['p50_ms']:8.2f} ms  "
+                f"p95={r['p95_ms']:8.2f} ms  p99={r['p99_ms']:8.2f} ms"
+            )
+            if r["errors"]:
+                line += f"  errors={r['errors']}"
+            before = (previous or {}).get("ops", {}).get(op, {}).get(mode)
+            if before and before["p95_ms"]:
+                line += f"  (p95 x{r['p95_ms'] / before['p95_ms']:.2f} vs previous)"
+            print(line)
+
+
+def bench_suite():
+    """
+    Набор нагрузок на db.py по историям разного размера (SUITE_SIZES).
+    Результаты пишутся в JSON (SUITE_JSON или SUITE_RESULTS_DIR/suite_<время>.json);
+    с SUITE_COMPARE рядом печатается изменение p95 относительно прошлого прогона.
+    """
+    mix = order_mix()
+    previous = json.loads(Path(SUITE_COMPARE).read_text(encoding="utf-8"))["sizes"] if SUITE_COMPARE else {}
+    result = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "settings": {
+            "threads": SUITE_THREADS,
+            "write_ops": SUITE_WRITE_OPS,
+            "read_ops": SUITE_READ_OPS,
+            "report_ops": SUITE_REPORT_OPS,
+            "users": USERS,
+            "history_days": HISTORY_DAYS,
+        },
+        "sizes": {},
+    }
+    logging_level = db.logger.level
+    db.logger.setLevel("WARNING")
+    try:
+        for name, lines in SUITE_SIZES.items():
+            result["sizes"][name] = _suite_size(lines, mix)
+            _print_suite(name, result["sizes"][name], previous.get(name))
+    finally:
+        db.logger.setLevel(logging_level)
+
+    out = Path(SUITE_JSON) if SUITE_JSON else SUITE_RESULTS_DIR / f"suite_{datetime.now():%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nSaved {out}")
+
+
+def _storage_workload(store, menu_items) -> dict:
+    """Одна и та же нагрузка на любой бэкенд: запись пачками, страницы истории, выборки для отчётов."""
+    rng = random.Random(7)
+    res = {}
+    t0 = time.perf_counter()
+    for start in range(0, STORAGE_BENCH_ORDERS, STORAGE_BENCH_CHUNK):
+        jobs = []
+        for _ in range(min(STORAGE_BENCH_CHUNK, STORAGE_BENCH_ORDERS - start)):
+            uid = rng.randrange(USERS)
+            jobs.append(("add_order", (random_items(rng, menu_items), uid, f"user{uid}", "bench"), {}))
+        store.write_batch(jobs)
+    res["write_orders_per_s"] = STORAGE_BENCH_ORDERS / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for _ in range(STORAGE_BENCH_PAGE_READS):
+        uid = rng.randrange(USERS)
+        page, has_more = store.get_user_orders_page(uid, 5)
+        if has_more:
+            store.get_user_orders_page(uid, 5, (page[-1]["ts"], page[-1]["id"]))
+    res["page_ms"] = (time.perf_counter() - t0) * 1000.0 / STORAGE_BENCH_PAGE_READS
+
+    day = timeutils.business_day()
+    t0 = time.perf_counter()
+    res["lines"] = sum(1 for _ in store.order_lines(day, day))
+    res["order_lines_ms"] = (time.perf_counter() - t0) * 1000.0
+
+    t0 = time.perf_counter()
+    store.sales_summary(False)
+    store.author_summary(False)
+    res["summary_ms"] = (time.perf_counter() - t0) * 1000.0
+    return res
+
+
+def bench_storage():
+    """Одинаковая нагрузка на storage.MemoryStorage и storage.SqliteStorage."""
+    import storage
+
+    menu_items = load_menu_items()
+    print(f"orders={STORAGE_BENCH_ORDERS} chunk={STORAGE_BENCH_CHUNK} page reads={STORAGE_BENCH_PAGE_READS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": storage.MemoryStorage(),
+            "sqlite": storage.SqliteStorage(str(Path(tmp) / "storage.db")),
+        }
+        for title, store in backends.items():
+            store.init()
+            try:
+                res = _storage_workload(store, menu_items)
+            finally:
+                store.close()
+            print(
+                f"{title:<7} write {res['write_orders_per_s']:8.0f} orders/s  "
+                f"history page {res['page_ms']:6.3f} ms  "
+                f"today's lines ({res['lines']}) {res['order_lines_ms']:7.1f} ms  "
+                f"all-time summary {res['summary_ms']:6.1f} ms"
+            )
+
+
+BENCHMARKS = {
+    "connections": bench_connections,
+    "indexes": bench_indexes,
+    "loop-latency": bench_loop_latency,
+    "batching": bench_batching,
+    "archive": bench_archive,
+    "group-order": bench_group_order,
+    "storage": bench_storage,
+    "backup": bench_backup,
+    "suite": bench_suite,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки слоя хранения (db.py)")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="+", choices=list(SUITE_SIZES), help="suite: размеры истории")
+    parser.add_argument("--json", help="suite: куда сохранить результаты")
+    parser.add_argument("--compare", help="suite: JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+    if args.sizes:
+        SUITE_SIZES = {name: SUITE_SIZES[name] for name in args.sizes}
+    SUITE_JSON, SUITE_COMPARE = args.json, args.compare
+    BENCHMARKS[args.benchmark]()
@@ -0,0 +1,528 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+# ====== НАСТРОЙКИ ======
+HISTORY_LINES = 1_000_000  # строк order_items в синтетической истории
+HISTORY_DAYS = 365
+PERIOD_DAYS = (1, 30, 120, None)  # длины отчётных периодов, None — за всё время
+WIDTHS_PERIOD_DAYS = None  # период для widths (None — за всё время)
+WIDTHS_SAMPLE_STEP = 50  # шаг выборки строк в режиме sampled
+LOOP_CASHIERS = 8  # кассиров, пишущих заказы, пока строятся отчёты
+LOOP_REPORTS = 3  # отчётов за всё время подряд в loop-latency
+OUTPUTS_PERIOD_DAYS = (30, None)  # периоды для outputs
+LOG_PERIOD_DAYS = (1, 30, None)  # периоды для log
+SUMMARY_REPEATS = 20  # повторов каждого запроса в summary
+DIGEST_PERIOD_DAYS = (1, 7, 30, None)  # периоды для digest
+CACHE_HITS = 20  # повторных запросов «за вчера» в cache
+RACE_ROUNDS = 10  # раундов «отправка против новой версии» в race
+RACE_SEND_S = 0.3  # сколько «отправляется» файл в race
+# =======================
+
+import config
+import db
+import timeutils
+from benchmark_db import generate_history, order_mix, mix_items, percentile, _measure_loop_lag
+
+
+# ---------- «старый» отчёт: всё в DataFrame, копии по типам оплаты, перечитывание книги ----------
+
+
+def legacy_auto_adjust_columns(file_path):
+    from openpyxl import load_workbook
+    from openpyxl.utils import get_column_letter
+
+    wb = load_workbook(file_path)
+    for sheet in wb.worksheets:
+        for column_cells in sheet.columns:
+            max_length = max(len(str(cell.value or "")) for cell in column_cells)
+            letter = get_column_letter(column_cells[0].column)
+            sheet.column_dimensions[letter].width = max_length + 2
+    wb.save(file_path)
+
+
+def legacy_generate_reports(start_date=None, end_date=None):
+    """
+    Отчёты так, как они строились до потоковой записи. Нужны pandas и openpyxl:
+    в зависимостях бота их больше нет, для сравнения их ставят отдельно.
+    """
+    import pandas as pd
+    from reports import ORDER_COLUMNS, ACTION_COLUMNS, GROUPED_COLUMNS, AUTHOR_COLUMNS
+    from storage import get_storage, ORDER_LINE_FIELDS, ACTION_LINE_FIELDS
+
+    store = get_storage()
+    orders_df = pd.DataFrame.from_records(store.order_lines(start_date, end_date), columns=list(ORDER_LINE_FIELDS))
+    actions_df = pd.DataFrame.from_records(store.action_lines(start_date, end_date), columns=list(ACTION_LINE_FIELDS))
+    orders_df["is_staff"] = orders_df["is_staff"].fillna(0).astype(int)
+
+    def prepare(df):
+        df = df.copy()
+        df = df[["date", "username", "payment_type", "item_name", "quantity", "base_price",
+                 "addons_text", "addons_total", "row_total", "raw_text", "is_staff"]]
+        df.columns = ORDER_COLUMNS
+        return df
+
+    def total_row(df, payment_type):
+        row = dict.fromkeys(ORDER_COLUMNS, "")
+        row.update({"Тип оплаты": payment_type, "Название": "ИТОГО",
+                    "Количество": df["Количество"].sum(), "Сумма позиции": df["Сумма позиции"].sum()})
+        return pd.concat([df, pd.DataFrame([row])], ignore_index=True)
+
+    def write(df, is_staff, path):
+        grouped = pd.DataFrame.from_records(store.sales_summary(is_staff, start_date, end_date), columns=GROUPED_COLUMNS)
+        by_author = pd.DataFrame.from_records(store.author_summary(is_staff, start_date, end_date), columns=AUTHOR_COLUMNS)
+        with pd.ExcelWriter(path, engine="openpyxl") as writer:
+            total_row(df.copy(), "").to_excel(writer, sheet_name="Все позиции", index=False)
+            for pt in sorted(df["Тип оплаты"].dropna().unique(), key=lambda s: str(s).lower()):
+                df_pt = df[df["Тип оплаты"].astype(str).str.lower() == str(pt).lower()].copy()
+                total_row(df_pt, str(pt).capitalize()).to_excel(writer, sheet_name=str(pt).capitalize(), index=False)
+            grouped.to_excel(writer, sheet_name="Группировка", index=False)
+            by_author.to_excel(writer, sheet_name="По авторам", index=False)
+        legacy_auto_adjust_columns(path)
+
+    write(prepare(orders_df[orders_df["is_staff"] == 0]), False, "legacy_report.xlsx")
+    write(prepare(orders_df[orders_df["is_staff"] == 1]), True, "legacy_report_staff.xlsx")
+    actions_df.columns = ACTION_COLUMNS
+    with pd.ExcelWriter("legacy_log.xlsx", engine="openpyxl") as writer:
+        actions_df.to_excel(writer, sheet_name="Журнал действий", index=False)
+    legacy_auto_adjust_columns("legacy_log.xlsx")
+
+
+# ---------- прогон в отдельном процессе: пиковый RSS не смешивается между прогонами ----------
+
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss в Linux — КиБ
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _child(db_path: str, workdir: str, engine: str, days, result):
+    import reports
+
+    db.DB_PATH = db_path
+    os.chdir(workdir)
+    end = timeutils.business_day()
+    start = end - timedelta(days=days - 1) if days else None
+    end = end if days else None
+    lines = sum(1 for _ in db.report_lines(days=(timeutils.day_key(start), timeutils.day_key(end)) if days else None))
+    if engine == "sampled":
+        config.REPORT_WIDTH_SAMPLE_STEP = WIDTHS_SAMPLE_STEP
+    before = _peak_rss_mib()
+    t0 = time.perf_counter()
+    paths = ()
+    if engine == "legacy":
+        legacy_generate_reports(start, end)
+    elif engine.startswith("only:"):
+        paths = reports.generate_reports(start, end, engine[len("only:"):].split(","))
+    else:
+        paths = reports.generate_reports(start, end)
+        if engine == "reload":
+            # как раньше: ширины — отдельным проходом по готовым файлам
+            for path in filter(None, paths):
+                legacy_auto_adjust_columns(path)
+    seconds = time.perf_counter() - t0
+    size = sum(os.path.getsize(path) for path in filter(None, paths))
+    result.put({"lines": lines, "seconds": seconds, "bytes": size, "base_mib": before, "peak_mib": _peak_rss_mib()})
+
+
+def run_isolated(db_path: str, engine: str, days) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    result = ctx.Queue()
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = ctx.Process(target=_child, args=(db_path, workdir, engine, days, result))
+        proc.start()
+        res = result.get()
+        proc.join()
+    return res
+
+
+def _seed(path: str) -> str:
+    db.DB_PATH = path
+    try:
+        db.init_db()
+        mix = order_mix()
+        generate_history(db.get_connection(), HISTORY_LINES, list(zip(mix["names"], mix["prices"])),
+                         mix=mix, days=HISTORY_DAYS)
+        db.rebuild_daily_sales()
+    finally:
+        db.close_connections()
+    return path
+
+
+def bench_memory():
+    """Пиковый RSS и время генерации отчётов по длине периода: pandas + openpyxl против потоковой записи."""
+    print(f"history lines={HISTORY_LINES} days={HISTORY_DAYS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        for days in PERIOD_DAYS:
+            for engine in ("legacy", "streaming"):
+                r = run_isolated(db_path, engine, days)
+                period = f"{days} d" if days else "all"
+                print(
+                    f"{period:>6} {r['lines']:>8} lines  {engine:<9} {r['seconds']:7.2f} s  "
+                    f"peak RSS {r['peak_mib']:7.1f} MiB (+{r['peak_mib'] - r['base_mib']:.1f} over start)"
+                )
+
+
+def bench_widths():
+    """
+    Время отчёта за большой период по способу подбора ширины колонок:
+    перечитывание готовых файлов (load_workbook + save), подсчёт при записи
+    по всем строкам и по выборке строк.
+    """
+    print(f"history lines={HISTORY_LINES} period={WIDTHS_PERIOD_DAYS or 'all'} sample step={WIDTHS_SAMPLE_STEP}")
+    titles = {
+        "reload": "reload workbook after writing",
+        "exact": "track widths while writing",
+        "sampled": f"track widths, every {WIDTHS_SAMPLE_STEP}th row",
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        for engine, title in titles.items():
+            engine_arg = "streaming" if engine == "exact" else engine
+            r = run_isolated(db_path, engine_arg, WIDTHS_PERIOD_DAYS)
+            print(f"{title:<34} {r['lines']:>8} lines  {r['seconds']:7.2f} s  peak RSS {r['peak_mib']:7.1f} MiB")
+
+
+def bench_outputs():
+    """
+    Время и пиковый RSS generate_reports по набору книг: все три (как раньше строил
+    любой запрос) против того, что выбрано в меню отчётов.
+    """
+    selections = {
+        "all (report, staff, log)": "only:report,staff,log",
+        "regular (report, log)": "only:report,log",
+        "staff (staff, log)": "only:staff,log",
+        "staff workbook only": "only:staff",
+    }
+    print(f"history lines={HISTORY_LINES} days={HISTORY_DAYS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        for days in OUTPUTS_PERIOD_DAYS:
+            for title, engine in selections.items():
+                r = run_isolated(db_path, engine, days)
+                period = f"{days} d" if days else "all"
+                print(f"{period:>6} {title:<26} {r['seconds']:7.2f} s  peak RSS {r['peak_mib']:7.1f} MiB")
+
+
+def bench_summary():
+    """
+    Итоги за год с разным шагом: запрос к почасовой сводке (reports.period_totals)
+    против суммирования сырых позиций в Python, как сводные листы считались раньше.
+    """
+    import reports
+    from storage import get_storage
+
+    print(f"history lines={HISTORY_LINES} days={HISTORY_DAYS} repeats={SUMMARY_REPEATS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        _seed(str(Path(tmp) / "reports.db"))
+        end = timeutils.business_day()
+        start = end - timedelta(days=HISTORY_DAYS - 1)
+        try:
+            for granularity in ("hour", "day", "week", "month"):
+                times = []
+                for _ in range(SUMMARY_REPEATS):
+                    t0 = time.perf_counter()
+                    rows = reports.period_totals(start, end, granularity)
+                    times.append((time.perf_counter() - t0) * 1000.0)
+                print(f"{granularity:<6} rollup query  {len(rows):>6} rows  p50={percentile(times, 50):9.2f} ms  "
+                      f"max={max(times):9.2f} ms")
+
+            t0 = time.perf_counter()
+            months: dict[str, list] = {}
+            for line in get_storage().order_lines(start, end):
+                acc = months.setdefault(line[1][:7], [set(), 0, 0])
+                acc[0].add(line[0])
+                acc[1] += line[6]
+                acc[2] += line[10]
+            print(f"month  raw lines     {len(months):>6} rows  {(time.perf_counter() - t0) * 1000.0:13.2f} ms")
+        finally:
+            db.close_connections()
+
+
+def bench_digest():
+    """
+    Сводка «📈 Сводка» в чате (reports.sales_digest) по длине периода: только запросы
+    к сводкам, поэтому время не должно расти вместе с историей. Для сравнения — отчёт
+    «за сегодня» целиком, который раньше был единственным способом узнать итоги.
+    """
+    import reports
+
+    print(f"history lines={HISTORY_LINES} days={HISTORY_DAYS} repeats={SUMMARY_REPEATS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        end = timeutils.business_day()
+        try:
+            for days in DIGEST_PERIOD_DAYS:
+                start = end - timedelta(days=days - 1) if days else None
+                times = []
+                for _ in range(SUMMARY_REPEATS):
+                    t0 = time.perf_counter()
+                    digest = reports.sales_digest(start, end if days else None)
+                    times.append((time.perf_counter() - t0) * 1000.0)
+                period = f"{days} d" if days else "all"
+                print(f"{period:>6} digest  {digest['orders']:>8} orders  p50={percentile(times, 50):8.2f} ms  "
+                      f"max={max(times):8.2f} ms")
+        finally:
+            db.close_connections()
+        r = run_isolated(db_path, "streaming", 1)
+        print(f"   1 d full report files  {r['seconds'] * 1000.0:10.2f} ms")
+
+
+def bench_addons():
+    """
+    Полный проход по позициям за всё время (как лист «Все позиции»): готовые подписи
+    addons_text против разбора addons_json в каждой строке — так было до миграции 8,
+    и так же читаются строки старых архивов (addons_text IS NULL).
+    """
+    from storage import get_storage
+
+    print(f"history lines={HISTORY_LINES} days={HISTORY_DAYS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        _seed(str(Path(tmp) / "reports.db"))
+        store = get_storage()
+        try:
+            with_addons = db.get_connection().execute(
+                "SELECT COUNT(*) FROM order_items WHERE addons_key != ''"
+            ).fetchone()[0]
+            print(f"lines with addons: {with_addons}")
+            for title in ("precomputed addons_text", "json.loads per row"):
+                if title.startswith("json"):
+                    with db.transaction() as conn:
+                        conn.execute("UPDATE order_items SET addons_text = NULL")
+                t0 = time.perf_counter()
+                rows = sum(1 for _ in store.order_lines())
+                print(f"{title:<26} {rows:>8} lines  {time.perf_counter() - t0:7.2f} s")
+        finally:
+            db.close_connections()
+
+
+def bench_log():
+    """
+    Выгрузка только журнала действий по длине периода: время, пиковый RSS и размер
+    файла. Дневная выгрузка не должна зависеть от того, сколько лет истории в базе.
+    """
+    print(f"history lines={HISTORY_LINES} days={HISTORY_DAYS}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        for days in LOG_PERIOD_DAYS:
+            r = run_isolated(db_path, "only:log", days)
+            period = f"{days} d" if days else "all"
+            print(
+                f"{period:>6} {r['seconds']:7.2f} s  peak RSS {r['peak_mib']:7.1f} MiB  "
+                f"file {r['bytes'] / 2**20:7.2f} MiB"
+            )
+
+
+def bench_loop_latency():
+    """
+    Задержка приёма заказов, пока менеджер выгружает отчёты за всё время:
+    без отчётов, с generate_reports прямо в хендлере и через пул report_jobs.
+    """
+    import db_async
+    import report_jobs
+    import reports
+
+    mix = order_mix()
+    print(f"history lines={HISTORY_LINES} cashiers={LOOP_CASHIERS} reports={LOOP_REPORTS} "
+          f"workers={report_jobs.REPORT_WORKERS}")
+
+    async def run(report_mode) -> tuple[dict, list[float]]:
+        latencies: list[float] = []
+        done = asyncio.Event()
+
+        async def cashier(uid: int):
+            rng = random.Random(uid)
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await db_async.add_order_items(mix_items(rng, mix), uid, f"user{uid}", "bench")
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+                await asyncio.sleep(0.01)
+
+        async def manager():
+            for _ in range(LOOP_REPORTS):
+                if report_mode == "handler":
+                    reports.generate_reports()
+                    await asyncio.sleep(0)
+                elif report_mode == "pool":
+                    await report_jobs.submit_report()
+                else:
+                    await asyncio.sleep(2)
+            done.set()
+
+        async def workload():
+            await asyncio.gather(manager(), *(cashier(uid) for uid in range(LOOP_CASHIERS)))
+
+        return await _measure_loop_lag(workload), latencies
+
+    titles = {
+        None: "no reports",
+        "handler": "generate_reports in handler",
+        "pool": "report_jobs process pool",
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        # процессы пула читают путь к базе из окружения
+        os.environ["DB_PATH"] = db_path
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        db_async.logger.setLevel("WARNING")
+        try:
+            for mode, title in titles.items():
+                try:
+                    lag, latencies = asyncio.run(run(mode))
+                finally:
+                    report_jobs.shutdown()
+                    db_async.shutdown()
+                print(
+                    f"{title:<30} {lag['elapsed_s']:6.1f} s  orders={len(latencies):<6} "
+                    f"order p50={percentile(latencies, 50):7.2f} ms  p99={percentile(latencies, 99):8.2f} ms  "
+                    f"max={max(latencies, default=0):8.1f} ms | loop lag p99={lag['lag_p99_ms']:8.2f} ms  "
+                    f"max={lag['lag_max_ms']:8.1f} ms"
+                )
+        finally:
+            os.chdir(cwd)
+
+
+def bench_cache():
+    """
+    Повторные запросы отчёта «за вчера» через report_jobs: первый строит файлы,
+    следующие берут их из report_cache. Затем заказ за сегодня (вчерашние отчёты
+    по заказам остаются в кэше) и удаление вчерашнего заказа (их версия меняется).
+    """
+    import db_async
+    import report_cache
+    import report_jobs
+
+    mix = order_mix()
+    yesterday = timeutils.business_day() - timedelta(days=1)
+    print(f"history lines={HISTORY_LINES} period={yesterday} hits={CACHE_HITS}")
+
+    async def request(title: str) -> float:
+        versions = await report_jobs._versions(yesterday, yesterday)
+        t0 = time.perf_counter()
+        paths = await report_jobs.submit_report(yesterday, yesterday)
+        ms = (time.perf_counter() - t0) * 1000.0
+        print(f"{title:<34} {ms:10.2f} ms  versions={versions}  {Path(paths[0]).parent.name}")
+        return ms
+
+    async def run():
+        await request("first request (build)")
+        await request("repeat (cache)")
+        times = []
+        for _ in range(CACHE_HITS):
+            t0 = time.perf_counter()
+            await report_jobs.submit_report(yesterday, yesterday)
+            times.append((time.perf_counter() - t0) * 1000.0)
+        print(f"{'cache hit p50 / p99':<34} {percentile(times, 50):10.2f} ms / {percentile(times, 99):.2f} ms")
+        await db_async.add_order_items(mix_items(random.Random(1), mix), 1, "user1", "bench")
+        await request("after an order today")
+        row = db.get_connection().execute(
+            "SELECT id, user_id FROM orders WHERE day = ? LIMIT 1", (timeutils.day_key(yesterday),)
+        ).fetchone()
+        await db_async.delete_entire_order(row[0], row[1], "bench")
+        await request("after deleting yesterday's order")
+        await request("repeat (cache)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        os.environ["DB_PATH"] = db_path
+        report_cache.REPORT_CACHE_DIR = str(Path(tmp) / "cache")
+        db_async.logger.setLevel("WARNING")
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            asyncio.run(run())
+        finally:
+            report_jobs.shutdown()
+            db_async.shutdown()
+            os.chdir(cwd)
+
+
+def bench_race():
+    """
+    Отправка отчёта «за сегодня», пока приходит заказ и другой запрос сохраняет в кэш
+    новую версию: файлы, полученные первым запросом, должны дочитаться до конца.
+    Для сравнения — то же с REPORT_CACHE_MIN_AGE_S=0, когда старая версия удаляется сразу.
+    """
+    import functools
+
+    import db_async
+    import report_cache
+    import report_jobs
+
+    mix = order_mix()
+    today = timeutils.business_day()
+    print(f"history lines={HISTORY_LINES} rounds={RACE_ROUNDS} send={RACE_SEND_S * 1000:.0f} ms")
+
+    async def send(paths) -> bool:
+        # как FSInputFile: файл открывается, когда до него дошла очередь отправки
+        await asyncio.sleep(RACE_SEND_S)
+        try:
+            for path in filter(None, paths):
+                Path(path).read_bytes()
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def newer_version(uid: int):
+        await db_async.add_order_items(mix_items(random.Random(uid), mix), uid, f"user{uid}", "bench")
+        await report_jobs.submit_report(today, today)
+
+    async def run(title: str):
+        sent = 0
+        for uid in range(RACE_ROUNDS):
+            paths = await report_jobs.submit_report(today, today)
+            ok, _ = await asyncio.gather(send(paths), newer_version(uid))
+            sent += ok
+        entries = len([e for e in Path(report_cache.REPORT_CACHE_DIR).iterdir() if e.is_dir()])
+        print(f"{title:<34} sent {sent}/{RACE_ROUNDS}  cache entries={entries}")
+
+    evict = report_cache.evict
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = _seed(str(Path(tmp) / "reports.db"))
+        os.environ["DB_PATH"] = db_path
+        db_async.logger.setLevel("WARNING")
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            for title, min_age in ((f"min age {report_cache.REPORT_CACHE_MIN_AGE_S:.0f} s", None), ("min age 0 s", 0)):
+                report_cache.REPORT_CACHE_DIR = str(Path(tmp) / f"cache_{min_age}")
+                report_cache.evict = evict if min_age is None else functools.partial(evict, min_age_s=min_age)
+                asyncio.run(run(title))
+        finally:
+            report_cache.evict = evict
+            report_jobs.shutdown()
+            db_async.shutdown()
+            os.chdir(cwd)
+
+
+BENCHMARKS = {
+    "addons": bench_addons,
+    "cache": bench_cache,
+    "digest": bench_digest,
+    "log": bench_log,
+    "loop-latency": bench_loop_latency,
+    "memory": bench_memory,
+    "outputs": bench_outputs,
+    "race": bench_race,
+    "summary": bench_summary,
+    "widths": bench_widths,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки генерации отчётов (reports.py)")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--lines", type=int, help="строк order_items в истории")
+    args = parser.parse_args()
+    if args.lines:
+        HISTORY_LINES = args.lines
+    BENCHMARKS[args.benchmark]()
@@ -1,35 +1,30 @@
 import logging
 import asyncio
+from functools import partial
 
-from aiogram import Bot, Dispatcher, F
+from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 
-from config import BOT_TOKEN, GROUP_CHAT_ID
-from db import init_db
+from config import BOT_TOKEN, GROUP_CHAT_ID, REPORT_PRECOMPUTE_POST
+from storage import get_storage
+import db_async
+import backup
+import report_jobs
 from keyboards import show_main_menu
-from utils import send_and_track
-from handlers import add, delete, report, misc, menu, chat_events
+from utils import send_and_track, report_input_file
+from handlers import add, delete, report, summary, misc, menu, chat_events
 
-logging.basicConfig(level=logging.INFO)
-init_db()
+# Рабочие процессы отчётов (spawn) заново импортируют этот модуль, поэтому здесь
+# только объявления: база, логирование, Bot и Dispatcher создаются в main()
+router = Router()
 
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
 
-dp.include_router(add.router)
-dp.include_router(delete.router)
-dp.include_router(report.router)
-dp.include_router(misc.router)
-dp.include_router(menu.router)
-dp.include_router(chat_events.router)
-
-
-@dp.message(F.chat.type == "private", F.text == "/start")
-async def cmd_start(message: Message, state: FSMContext):
+@router.message(F.chat.type == "private", F.text == "/start")
+async def cmd_start(message: Message, state: FSMContext, bot: Bot):
     await state.clear()
 
     welcome = (
@@ -46,7 +41,21 @@ async def cmd_start(message: Message, state: FSMContext):
     await show_main_menu(message.from_user.id, message.chat.id, bot)
 
 
-async def _log_configured_chats() -> None:
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    # /start — раньше остальных роутеров
+    dp.include_router(router)
+    dp.include_router(add.router)
+    dp.include_router(delete.router)
+    dp.include_router(report.router)
+    dp.include_router(summary.router)
+    dp.include_router(misc.router)
+    dp.include_router(menu.router)
+    dp.include_router(chat_events.router)
+    return dp
+
+
+async def _log_configured_chats(bot: Bot) -> None:
     raw_ids = (GROUP_CHAT_ID or "").split(",")
     chat_ids = [cid.strip() for cid in raw_ids if cid.strip()]
 
@@ -73,10 +82,34 @@ async def _log_configured_chats() -> None:
             logging.warning("⚠️ Не удалось получить чат %s: %s", raw_id, exc)
 
 
+async def _post_daily_reports(bot: Bot, day, built) -> None:
+    """Отчёты, подготовленные после закрытия, — в группу (REPORT_PRECOMPUTE_POST=1)."""
+    if not GROUP_CHAT_ID:
+        logging.warning(f"GROUP_CHAT_ID is not configured - precomputed reports for {day} are not posted")
+        return
+    await bot.send_message(GROUP_CHAT_ID, f"📊 Отчёты за {day:%d.%m.%Y}")
+    for doc in filter(None, built):
+        await bot.send_document(GROUP_CHAT_ID, report_input_file(doc))
+
+
 async def main():
-    await _log_configured_chats()
-    await dp.start_polling(bot)
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = create_dispatcher()
+    await _log_configured_chats(bot)
+    backups = asyncio.create_task(backup.backup_loop())
+    precompute = asyncio.create_task(
+        report_jobs.precompute_loop(partial(_post_daily_reports, bot) if REPORT_PRECOMPUTE_POST else None)
+    )
+    try:
+        await dp.start_polling(bot)
+    finally:
+        backups.cancel()
+        precompute.cancel()
+        report_jobs.shutdown()
+        db_async.shutdown()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    get_storage().init()
     asyncio.run(main())
@@ -41,3 +41,73 @@ OPENAI_API_BASE_URL = os.getenv("OPENAI_API_BASE_URL", "")
 if not OPENAI_MODEL:
     logger.warning("OPENAI_MODEL is not set - LLM functionality may not work!")
 
+
+# База данных: число потоков-читателей асинхронного слоя (писатель всегда один)
+DB_READER_THREADS = int(os.getenv("DB_READER_THREADS", "4"))
+# Групповой коммит: сколько ждать попутчиков и сколько строк максимум в одной транзакции
+DB_BATCH_MAX_DELAY_MS = float(os.getenv("DB_BATCH_MAX_DELAY_MS", "2"))
+DB_BATCH_MAX_ROWS = int(os.getenv("DB_BATCH_MAX_ROWS", "500"))
+# PRAGMA synchronous: FULL — COMMIT ждёт fsync, и подтверждённый заказ переживает
+# отключение питания (групповой коммит делает это дешёвым: один fsync на пачку);
+# NORMAL — быстрее, но последние подтверждённые транзакции могут пропасть
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "FULL").strip().upper()
+if DB_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    logger.warning(f"DB_SYNCHRONOUS={DB_SYNCHRONOUS!r} is not OFF/NORMAL/FULL/EXTRA, using FULL")
+    DB_SYNCHRONOUS = "FULL"
+
+# Время: часовой пояс кафе (пусто — системный) и начало рабочих суток («ЧЧ:ММ»).
+# Заказы до BUSINESS_DAY_START относятся к предыдущему рабочему дню.
+TIMEZONE = os.getenv("TIMEZONE", "")
+BUSINESS_DAY_START = os.getenv("BUSINESS_DAY_START", "00:00")
+
+# Архив: папка помесячных файлов со старыми заказами и сколько последних месяцев
+# (включая текущий) держать в живой базе
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_KEEP_MONTHS = int(os.getenv("ARCHIVE_KEEP_MONTHS", "1"))
+
+# Хранилище заказов: "sqlite" — файл DB_PATH (по умолчанию), "memory" — в памяти,
+# без диска и без сохранения между запусками (для бенчмарков и экспериментов)
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlite")
+DB_PATH = os.getenv("DB_PATH", "orders.db")
+
+# Резервные копии (backup.py): папка, сколько последних копий хранить, сжатие gzip
+# и период фоновой копии в боте (0 — только вручную: python manage.py backup)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "1") not in ("0", "false", "no")
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+# Копирование по шагам: страниц за шаг и пауза между шагами, чтобы не мешать записи
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP_MS = float(os.getenv("BACKUP_STEP_SLEEP_MS", "10"))
+# Сколько раз копирование может начаться заново из-за записи, прежде чем
+# остаток скопируется одним шагом
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+# Ширина колонок отчётов считается по ходу записи. Для очень больших листов можно
+# мерить не каждую строку: первые REPORT_WIDTH_EXACT_ROWS строк — все, дальше каждую
+# REPORT_WIDTH_SAMPLE_STEP-ю (1 — мерить все строки)
+REPORT_WIDTH_EXACT_ROWS = int(os.getenv("REPORT_WIDTH_EXACT_ROWS", "10000"))
+REPORT_WIDTH_SAMPLE_STEP = int(os.getenv("REPORT_WIDTH_SAMPLE_STEP", "1"))
+# Строк на листе отчёта (с заголовком), дальше — продолжение на листе «Имя (2)»;
+# больше предела Excel (1048576) не бывает
+REPORT_SHEET_MAX_ROWS = int(os.getenv("REPORT_SHEET_MAX_ROWS", "1048576"))
+
+# Отчёты строятся в пуле процессов: сколько процессов (0 — в потоке бота) и сколько
+# разных отчётов может одновременно строиться и ждать очереди
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "1"))
+REPORT_QUEUE_MAX = int(os.getenv("REPORT_QUEUE_MAX", "4"))
+
+# Кэш готовых отчётов (report_cache.py): папка и предельный размер в МБ;
+# сверх него удаляются давно не запрошенные отчёты (0 — кэш выключен)
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "report_cache")
+REPORT_CACHE_MAX_MB = float(os.getenv("REPORT_CACHE_MAX_MB", "200"))
+# Запись кэша, к которой обращались последние REPORT_CACHE_MIN_AGE_S секунд, не
+# удаляется даже сверх предела: её файл может ещё отправляться
+REPORT_CACHE_MIN_AGE_S = float(os.getenv("REPORT_CACHE_MIN_AGE_S", "600"))
+
+# Ночная подготовка отчётов: через REPORT_PRECOMPUTE_DELAY_MIN минут после закрытия
+# кафе (CAFE_CLOSING_TIME, «ЧЧ:ММ»; пусто — выключено) отчёты за закрывшийся рабочий
+# день строятся в кэш. REPORT_PRECOMPUTE_POST=1 — ещё и отправить их в группу
+CAFE_CLOSING_TIME = os.getenv("CAFE_CLOSING_TIME", "")
+REPORT_PRECOMPUTE_DELAY_MIN = float(os.getenv("REPORT_PRECOMPUTE_DELAY_MIN", "15"))
+REPORT_PRECOMPUTE_POST = os.getenv("REPORT_PRECOMPUTE_POST", "0") not in ("0", "false", "no")
@@ -1,11 +1,45 @@
+import os
+import re
 import sqlite3
 import logging
+import threading
+import time
+from collections.abc import Iterable
+from contextlib import contextmanager
 from datetime import datetime, date
 import json as _json
+from pathlib import Path
+
+import config
+import timeutils
 
 logger = logging.getLogger(__name__)
 
-DB_PATH = "orders.db"
+# Путь задаётся настройкой DB_PATH; бенчмарки подменяют его на временный файл
+DB_PATH = config.DB_PATH
+
+# Параметры соединений. WAL позволяет читателям работать параллельно с одним писателем.
+# synchronous=FULL (DB_SYNCHRONOUS): COMMIT возвращается после fsync журнала, поэтому
+# заказ, о котором хендлер уже ответил, не теряется при отключении питания. Групповой
+# коммит писателя платит один fsync за пачку; читателей настройка не замедляет.
+BUSY_TIMEOUT_MS = 10_000
+CACHE_SIZE_KIB = 16_384
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    f"PRAGMA synchronous={config.DB_SYNCHRONOUS}",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{CACHE_SIZE_KIB}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Соединения переиспользуются: по одному на поток и путь к базе
+_local = threading.local()
+_pool_lock = threading.Lock()
+_pool: list[sqlite3.Connection] = []
+# Писатели внутри процесса выстраиваются в очередь здесь, а не крутятся в busy-handler SQLite
+_write_lock = threading.Lock()
+# Списки, куда transaction() дописывает ожидание BEGIN IMMEDIATE (мс); см. observe_write_waits()
+_wait_observers: tuple[list, ...] = ()
 
 CREATE_ORDERS = """
 CREATE TABLE IF NOT EXISTS orders (
@@ -46,6 +80,60 @@ CREATE TABLE IF NOT EXISTS order_items (
 );
 """
 
+# Справочники: названия позиций и типов оплаты хранятся один раз,
+# в позициях и журнале — только целочисленные id
+CREATE_MENU_ITEMS = """
+CREATE TABLE IF NOT EXISTS menu_items (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+"""
+CREATE_PAYMENT_TYPES = """
+CREATE TABLE IF NOT EXISTS payment_types (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+"""
+
+# CREATE_LOG и CREATE_ORDER_ITEMS выше — исходная схема (миграция 1);
+# с миграции 5 таблицы пересобраны в этот вид
+CREATE_ORDER_ITEMS_BY_ID = """
+CREATE TABLE {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER,
+    item_id INTEGER NOT NULL REFERENCES menu_items(id),
+    payment_type_id INTEGER NOT NULL REFERENCES payment_types(id),
+    price INTEGER,
+    quantity INTEGER DEFAULT 1,
+    addons_total INTEGER DEFAULT 0,
+    addons_json  TEXT DEFAULT '[]',
+    row_total INTEGER NOT NULL,
+    is_staff INTEGER DEFAULT 0,
+    FOREIGN KEY(order_id) REFERENCES orders(id)
+);
+"""
+CREATE_LOG_BY_ID = """
+CREATE TABLE {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT,
+    ts INTEGER,
+    day INTEGER,
+    action_type TEXT,
+    payment_type_id INTEGER REFERENCES payment_types(id),
+    item_id INTEGER REFERENCES menu_items(id),
+    quantity INTEGER NOT NULL DEFAULT 1,
+    user_id INTEGER,
+    username TEXT,
+    is_staff INTEGER DEFAULT 0
+);
+"""
+
+# Названия к позициям i: подставляются только при выдаче результата
+NAMES_JOIN = """
+JOIN menu_items m ON m.id = i.item_id
+JOIN payment_types p ON p.id = i.payment_type_id
+"""
+
 
 def _ensure_column(cursor, table: str, column_def: str):
     try:
@@ -56,50 +144,789 @@ def _ensure_column(cursor, table: str, column_def: str):
         raise
 
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH, timeout=10)
+def addons_label(addons: list[dict]) -> str:
+    """Добавки позиции для отчётов и истории: «Сироп (30₽), Шот (50₽)»."""
+    return ", ".join(f"{a.get('name', '')} ({int(a.get('price', 0))}₽)" for a in addons)
+
+
+def addons_key(addons: list[dict]) -> str:
+    """Набор добавок без цен и порядка — одинаковый у одинаково собранных позиций: «сироп+шот»."""
+    return "+".join(sorted(str(a.get("name", "")).strip().lower() for a in addons))
+
+
+def addons_from_json(raw) -> list[dict]:
+    """Разбор addons_json; битое значение — без добавок."""
+    try:
+        return _json.loads(raw) if raw else []
+    except Exception:
+        return []
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # isolation_level=None: транзакции открываем явно через transaction(),
+    # чтобы чтения не держали неявных транзакций и не мешали чекпойнтам WAL;
+    # uri=True — чтобы архивы можно было подключать только для чтения (file:...?mode=ro)
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        uri=True,
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
-def init_db():
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает постоянное соединение текущего потока (создаёт при первом обращении).
+    Соединение общее — закрывать его не нужно, для этого есть close_connections().
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(DB_PATH)
+    if conn is None:
+        conn = conns[DB_PATH] = _connect(DB_PATH)
+        with _pool_lock:
+            _pool.append(conn)
+        logger.debug(f"Opened pooled connection to {DB_PATH} in {threading.current_thread().name}")
+    return conn
+
+
+def close_connections():
+    """Закрывает все соединения пула (при остановке бота и в бенчмарках)."""
+    with _pool_lock:
+        conns, _pool[:] = list(_pool), []
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception as exc:
+            logger.error(f"Failed to close pooled connection: {exc}")
+    _local.__dict__.clear()
+
+
+@contextmanager
+def transaction():
+    """
+    Пишущая транзакция на соединении потока: BEGIN IMMEDIATE сразу берёт
+    блокировку записи, поэтому конфликт решается на старте, а не посреди вставок.
+    """
     conn = get_connection()
-    cursor = conn.cursor()
+    with _write_lock:
+        t0 = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        for waits in _wait_observers:
+            waits.append((time.perf_counter() - t0) * 1000.0)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+
+@contextmanager
+def observe_write_waits():
+    """
+    На время блока собирает, сколько настоящие пишущие транзакции процесса ждали
+    BEGIN IMMEDIATE (мс). Очередь за _write_lock не считается: это время чужих
+    транзакций процесса, а не внешней блокировки файла.
+    """
+    global _wait_observers
+    waits: list[float] = []
+    _wait_observers = _wait_observers + (waits,)
+    try:
+        yield waits
+    finally:
+        _wait_observers = tuple(w for w in _wait_observers if w is not waits)
+
+
+# Сводная таблица продаж по дням. Обновляется в тех же транзакциях, что и заказы,
+# поэтому сводные листы отчётов читают O(позиций меню × дней) строк вместо всех позиций.
+# quantity — штук, total — сумма row_total.
+CREATE_DAILY_SALES = """
+CREATE TABLE IF NOT EXISTS daily_sales (
+    day INTEGER NOT NULL,
+    is_staff INTEGER NOT NULL,
+    payment_type_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (day, is_staff, payment_type_id, item_id, author)
+) WITHOUT ROWID;
+"""
+
+# Строки сводки, которые даёт выборка позиций; o — orders, i — order_items
+ROLLUP_SELECT = """
+SELECT COALESCE(o.day, 0) AS day,
+       COALESCE(o.is_staff, 0) AS is_staff,
+       i.payment_type_id AS payment_type_id,
+       i.item_id AS item_id,
+       COALESCE(o.username, '') AS author,
+       SUM(i.quantity) AS quantity,
+       SUM(i.row_total) AS total
+FROM orders o
+JOIN order_items i ON i.order_id = o.id
+{where}
+GROUP BY 1, 2, 3, 4, 5
+"""
+
+UPSERT_DAILY_SALES = """
+INSERT INTO daily_sales (day, is_staff, payment_type_id, item_id, author, quantity, total)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, is_staff, payment_type_id, item_id, author) DO UPDATE SET
+    quantity = quantity + excluded.quantity,
+    total = total + excluded.total
+"""
+
+# Заказы по часам рабочего дня: сколько заказов, штук и на какую сумму. Ведётся
+# вместе с daily_sales и, как она, не уходит в архивы, поэтому итоги по часам,
+# дням, неделям и месяцам считаются по нескольким тысячам строк за год.
+# hour — час от полуночи рабочего дня (timeutils.business_hour): ночные часы следующей
+# даты — 24 и больше, поэтому при начале суток не в целый час (04:30) 04:10 ночи
+# и 04:40 утра одного рабочего дня — разные строки.
+CREATE_HOURLY_ORDERS = """
+CREATE TABLE IF NOT EXISTS hourly_orders (
+    day INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    is_staff INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (day, hour, is_staff)
+) WITHOUT ROWID;
+"""
+
+HOURLY_SELECT = """
+SELECT COALESCE(o.day, 0) AS day,
+       CAST(substr(o.date, 12, 2) AS INTEGER)
+         + CASE WHEN CAST(replace(substr(o.date, 1, 10), '-', '') AS INTEGER) > o.day THEN 24 ELSE 0 END AS hour,
+       COALESCE(o.is_staff, 0) AS is_staff,
+       COUNT(DISTINCT o.id) AS orders,
+       SUM(i.quantity) AS quantity,
+       SUM(i.row_total) AS total
+FROM orders o
+JOIN order_items i ON i.order_id = o.id
+{where}
+GROUP BY 1, 2, 3
+"""
+
+UPSERT_HOURLY_ORDERS = """
+INSERT INTO hourly_orders (day, hour, is_staff, orders, quantity, total)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, hour, is_staff) DO UPDATE SET
+    orders = orders + excluded.orders,
+    quantity = quantity + excluded.quantity,
+    total = total + excluded.total
+"""
+
+# Счётчик изменений по рабочим дням: +1 при каждой записи или удалении, затронувших день.
+# Сумма счётчиков за период — версия данных периода (ключ кэша отчётов).
+CREATE_DAY_VERSIONS = """
+CREATE TABLE IF NOT EXISTS day_versions (
+    day INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+BUMP_DAY_SQL = """
+INSERT INTO day_versions (day, version) VALUES (?, 1)
+ON CONFLICT (day) DO UPDATE SET version = version + 1
+"""
+
+
+def _bump_all_days(cursor):
+    """+1 к счётчикам всех дней со сводками: после пересчёта сводок меняется версия любого периода."""
+    cursor.execute("UPDATE day_versions SET version = version + 1")
+    cursor.execute(
+        "INSERT OR IGNORE INTO day_versions (day, version) "
+        "SELECT day, 1 FROM daily_sales UNION SELECT day, 1 FROM hourly_orders"
+    )
+
+CREATE_SCHEMA_VERSION = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TEXT NOT NULL
+);
+"""
+
+
+def _migration_base_tables(cursor):
     cursor.execute(CREATE_ORDERS)
     cursor.execute(CREATE_LOG)
     cursor.execute(CREATE_ORDER_ITEMS)
 
+    # базы, созданные до появления признака сотрудника
     _ensure_column(cursor, "orders", "is_staff INTEGER DEFAULT 0")
     _ensure_column(cursor, "order_items", "is_staff INTEGER DEFAULT 0")
     _ensure_column(cursor, "actions_log", "is_staff INTEGER DEFAULT 0")
 
-    conn.commit()
-    conn.close()
 
+def _migration_hot_query_indexes(cursor):
+    # история пользователя: WHERE user_id = ? ORDER BY date (rowid входит в индекс)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders(user_id, date)")
+    # позиции заказа: WHERE order_id = ?
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+    # журнал действий по периоду
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_actions_log_timestamp ON actions_log(timestamp)")
+
+
+def _backfill_time_columns(cursor, table: str, text_column: str, chunk: int = 10_000):
+    epoch = datetime(1970, 1, 1)
+    offsets = {}  # смещение пояса кэшируется по часу: вызывать tz на каждую строку дорого
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            f"SELECT id, {text_column} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, chunk),
+        ).fetchall()
+        if not rows:
+            return
+        updates = []
+        for row_id, text in rows:
+            try:
+                moment = datetime.fromisoformat(text)
+            except (TypeError, ValueError):
+                logger.warning(f"Cannot parse {table}.{text_column} of row {row_id}: {text!r}")
+                continue
+            if moment.tzinfo is not None:
+                _, ts, day = timeutils.stamp(moment)
+            else:
+                hour = moment.replace(minute=0, second=0, microsecond=0)
+                offset = offsets.get(hour)
+                if offset is None:
+                    offset = offsets[hour] = timeutils.localize(hour).utcoffset()
+                ts = int((moment - offset - epoch).total_seconds())
+                day = timeutils.day_key((moment - timeutils.DAY_START).date())
+            updates.append((ts, day, row_id))
+        cursor.executemany(f"UPDATE {table} SET ts = ?, day = ? WHERE id = ?", updates)
+        last_id = rows[-1][0]
+
+
+def _migration_time_keys(cursor):
+    # epoch-секунды и ключ рабочего дня ГГГГММДД: диапазоны по ним идут по индексам,
+    # в отличие от date(o.date) над ISO-строкой
+    for table, text_column in (("orders", "date"), ("actions_log", "timestamp")):
+        _ensure_column(cursor, table, "ts INTEGER")
+        _ensure_column(cursor, table, "day INTEGER")
+        _backfill_time_columns(cursor, table, text_column)
+
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_user_date")
+    cursor.execute("DROP INDEX IF EXISTS idx_actions_log_timestamp")
+    # история и очистка пользователя: WHERE user_id = ? AND ts ...
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_ts ON orders(user_id, ts)")
+    # отчёты: WHERE day BETWEEN ? AND ? ORDER BY day, ts
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_day ON orders(day, ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_actions_log_ts ON actions_log(ts)")
+
+
+def _migration_daily_sales(cursor):
+    # сводка в исходном виде, по названиям; в миграции 5 пересобирается по id
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            day INTEGER NOT NULL,
+            is_staff INTEGER NOT NULL,
+            payment_type TEXT NOT NULL,
+            item_name TEXT NOT NULL,
+            author TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (day, is_staff, payment_type, item_name, author)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO daily_sales (day, is_staff, payment_type, item_name, author, quantity, total)
+        SELECT COALESCE(o.day, 0), COALESCE(o.is_staff, 0), COALESCE(i.payment_type, ''),
+               COALESCE(i.item_name, ''), COALESCE(o.username, ''), SUM(i.quantity), SUM(i.row_total)
+        FROM orders o
+        JOIN order_items i ON i.order_id = o.id
+        GROUP BY 1, 2, 3, 4, 5
+        """
+    )
+
+
+# старые записи «удаление» хранили количество в названии: «Латте x2»
+_LEGACY_QTY_SUFFIX = re.compile(r"^(.*) x(\d+)$")
+
+
+def _migration_dictionary_ids(cursor):
+    cursor.execute(CREATE_MENU_ITEMS)
+    cursor.execute(CREATE_PAYMENT_TYPES)
+
+    # названия из журнала разбираем в Python, но только различные — их единицы тысяч
+    cursor.execute(
+        "CREATE TEMP TABLE log_names (deleted INTEGER, text TEXT, name TEXT, quantity INTEGER, "
+        "PRIMARY KEY (deleted, text))"
+    )
+    log_names = []
+    for deleted, text in cursor.execute(
+        "SELECT DISTINCT action_type = 'удаление', item_name FROM actions_log WHERE item_name IS NOT NULL"
+    ).fetchall():
+        match = _LEGACY_QTY_SUFFIX.match(text) if deleted else None
+        if match:
+            log_names.append((deleted, text, match.group(1), int(match.group(2))))
+        else:
+            log_names.append((deleted, text, text, 1))
+    cursor.executemany("INSERT INTO log_names VALUES (?, ?, ?, ?)", log_names)
+
+    # «WHERE true» нужен парсеру SQLite перед ON CONFLICT в INSERT ... SELECT
+    for table, sql in (
+        ("menu_items", "SELECT COALESCE(item_name, '') FROM order_items"),
+        ("menu_items", "SELECT name FROM log_names"),
+        ("menu_items", "SELECT item_name FROM daily_sales"),
+        ("payment_types", "SELECT COALESCE(payment_type, '') FROM order_items"),
+        ("payment_types", "SELECT payment_type FROM actions_log WHERE payment_type IS NOT NULL"),
+        ("payment_types", "SELECT payment_type FROM daily_sales"),
+    ):
+        cursor.execute(
+            f"INSERT INTO {table} (name) SELECT DISTINCT * FROM ({sql}) WHERE true "
+            "ON CONFLICT (name) DO NOTHING"
+        )
+
+    # пересобираем таблицы: текстовые колонки заменяются на id справочников
+    cursor.execute(CREATE_ORDER_ITEMS_BY_ID.format(table="order_items_new"))
+    cursor.execute(
+        """
+        INSERT INTO order_items_new (id, order_id, item_id, payment_type_id, price, quantity,
+                                     addons_total, addons_json, row_total, is_staff)
+        SELECT i.id, i.order_id, m.id, p.id, i.price, i.quantity,
+               i.addons_total, i.addons_json, i.row_total, i.is_staff
+        FROM order_items i
+        JOIN menu_items m ON m.name = COALESCE(i.item_name, '')
+        JOIN payment_types p ON p.name = COALESCE(i.payment_type, '')
+        ORDER BY i.id
+        """
+    )
+    cursor.execute("DROP TABLE order_items")
+    cursor.execute("ALTER TABLE order_items_new RENAME TO order_items")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+
+    cursor.execute(CREATE_LOG_BY_ID.format(table="actions_log_new"))
+    cursor.execute(
+        """
+        INSERT INTO actions_log_new (id, timestamp, ts, day, action_type, payment_type_id, item_id,
+                                     quantity, user_id, username, is_staff)
+        SELECT a.id, a.timestamp, a.ts, a.day, a.action_type, p.id, m.id,
+               COALESCE(n.quantity, 1), a.user_id, a.username, a.is_staff
+        FROM actions_log a
+        LEFT JOIN log_names n ON n.deleted = (a.action_type = 'удаление') AND n.text = a.item_name
+        LEFT JOIN menu_items m ON m.name = n.name
+        LEFT JOIN payment_types p ON p.name = a.payment_type
+        ORDER BY a.id
+        """
+    )
+    cursor.execute("DROP TABLE actions_log")
+    cursor.execute("ALTER TABLE actions_log_new RENAME TO actions_log")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_actions_log_ts ON actions_log(ts)")
+    cursor.execute("DROP TABLE log_names")
 
-def log_action(action_type, payment_type, item_name, user_id, username, *, is_staff=False):
+    cursor.execute("DROP TABLE daily_sales")
+    cursor.execute(CREATE_DAILY_SALES)
+    _fill_daily_sales(cursor)
+
+
+def _migration_day_versions(cursor):
+    cursor.execute(CREATE_DAY_VERSIONS)
+
+
+def _migration_hourly_business_hours(cursor):
+    # раньше hour был календарным часом; часы до начала суток становятся 24+.
+    # Дни архивов переводятся на месте (точно, если сутки начинаются в целый час),
+    # дни живой базы пересчитываются по заказам
+    cursor.execute(
+        "UPDATE hourly_orders SET hour = hour + 24 WHERE (hour + 1) * 3600 <= ?",
+        (int(timeutils.DAY_START.total_seconds()),),
+    )
+    cursor.execute("DELETE FROM hourly_orders WHERE day IN (SELECT day FROM orders)")
+    _fill_hourly_orders(cursor)
+    _bump_all_days(cursor)
+
+
+def _migration_addons_text(cursor):
+    # подпись и ключ добавок считаются при записи; NULL — ещё не посчитаны
+    # (так остаются строки старых архивов, отчёты разбирают их JSON на лету)
+    _ensure_column(cursor, "order_items", "addons_text TEXT")
+    _ensure_column(cursor, "order_items", "addons_key TEXT")
+    # различных наборов добавок — сотни, а позиций — миллионы: разбираем только различные
+    cursor.execute("CREATE TEMP TABLE addons_labels (json TEXT PRIMARY KEY, text TEXT, key TEXT)")
+    labels = []
+    for (raw,) in cursor.execute("SELECT DISTINCT addons_json FROM order_items WHERE addons_json IS NOT NULL").fetchall():
+        addons = addons_from_json(raw)
+        labels.append((raw, addons_label(addons), addons_key(addons)))
+    cursor.executemany("INSERT INTO addons_labels (json, text, key) VALUES (?, ?, ?)", labels)
+    cursor.execute(
+        "UPDATE order_items SET addons_text = l.text, addons_key = l.key "
+        "FROM addons_labels l WHERE l.json = order_items.addons_json"
+    )
+    cursor.execute("UPDATE order_items SET addons_text = '', addons_key = '' WHERE addons_text IS NULL")
+    cursor.execute("DROP TABLE addons_labels")
+
+
+def _migration_hourly_orders(cursor):
+    # заказы уже заархивированных месяцев досчитывает manage.py rebuild-rollup
+    cursor.execute(CREATE_HOURLY_ORDERS)
+    _fill_hourly_orders(cursor)
+
+
+# Миграции применяются строго по возрастанию версии, каждая — в своей транзакции.
+# Уже применённые записаны в schema_version и при старте пропускаются.
+MIGRATIONS = [
+    (1, "base tables", _migration_base_tables),
+    (2, "hot query indexes", _migration_hot_query_indexes),
+    (3, "epoch and business day columns", _migration_time_keys),
+    (4, "daily sales rollup", _migration_daily_sales),
+    (5, "menu item and payment type ids", _migration_dictionary_ids),
+    (6, "day change counters", _migration_day_versions),
+    (7, "hourly order rollup", _migration_hourly_orders),
+    (8, "precomputed addon labels", _migration_addons_text),
+    (9, "hourly rollup by business day hour", _migration_hourly_business_hours),
+]
+
+
+def migrate(target_version: int | None = None) -> list[int]:
+    """
+    Применяет недостающие миграции (до target_version включительно, если задана).
+    Возвращает список применённых версий.
+    """
     conn = get_connection()
-    try:
-        cursor = conn.cursor()
+    conn.execute(CREATE_SCHEMA_VERSION)
+    current = {row[0] for row in conn.execute("SELECT version FROM schema_version")}
+    applied = []
+    for version, name, apply in MIGRATIONS:
+        if target_version is not None and version > target_version:
+            break
+        if version in current:
+            continue
+        with transaction() as conn:
+            # проверяем внутри транзакции: параллельный процесс мог успеть раньше
+            done = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+            ).fetchone()
+            if done:
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            apply(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now().isoformat()),
+            )
+        applied.append(version)
+    if applied:
+        # обновляем статистику планировщика для новых индексов
+        conn.execute("PRAGMA optimize")
+    return applied
+
+
+def init_db():
+    migrate()
+
+
+INSERT_ACTION_SQL = (
+    "INSERT INTO actions_log (timestamp, ts, day, action_type, payment_type_id, item_id, quantity, "
+    "user_id, username, is_staff) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# ---------- запись ----------
+# Функции с префиксом _write_ выполняются на уже открытой транзакции conn и не
+# коммитят сами: их вызывают и публичные обёртки ниже, и групповой коммит write_batch().
+
+
+def _lookup_ids(conn, table: str, names) -> dict:
+    """
+    id справочника (menu_items или payment_types) для названий; новые названия добавляются.
+    Не кэшируется: откат точки сохранения в write_batch() может убрать только что вставленный id.
+    """
+    names = list({name for name in names if name is not None})
+    if not names:
+        return {}
+    conn.executemany(
+        f"INSERT INTO {table} (name) VALUES (?) ON CONFLICT (name) DO NOTHING", [(n,) for n in names]
+    )
+    marks = ", ".join("?" * len(names))
+    return dict(conn.execute(f"SELECT name, id FROM {table} WHERE name IN ({marks})", names).fetchall())
+
+
+def _bump_days(conn, days):
+    """Отмечает изменение данных за рабочие дни (в той же транзакции, что и само изменение)."""
+    conn.executemany(BUMP_DAY_SQL, [(day,) for day in sorted(set(days) - {None})])
+
+
+def _write_action(conn, action_type, payment_type, item_name, user_id, username, *, is_staff=False, quantity=1):
+    now = timeutils.stamp()
+    _bump_days(conn, [now[2]])
+    conn.execute(
+        INSERT_ACTION_SQL,
+        (
+            *now,
+            action_type,
+            _lookup_ids(conn, "payment_types", [payment_type]).get(payment_type),
+            _lookup_ids(conn, "menu_items", [item_name]).get(item_name),
+            quantity,
+            user_id,
+            username,
+            1 if is_staff else 0,
+        ),
+    )
+
+
+def _write_order(conn, items: list[dict], user_id: int, username: str, raw_text: str, *, is_staff: bool = False) -> int:
+    cursor = conn.cursor()
+
+    # 1) создаём новую запись в orders
+    logger.debug(f"Saving order for user {user_id}: raw_text='{raw_text[:50]}...', items_count={len(items)}")
+    now = timeutils.stamp()
+    cursor.execute(
+        "INSERT INTO orders (date, ts, day, user_id, username, raw_text, is_staff) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (*now, user_id, username, raw_text, 1 if is_staff else 0),
+    )
+
+    order_id = cursor.lastrowid
+    logger.debug(f"Created order record with ID={order_id}")
+
+    staff_flag = 1 if is_staff else 0
+    item_ids = _lookup_ids(conn, "menu_items", (item["item_name"] or "" for item in items))
+    payment_ids = _lookup_ids(conn, "payment_types", (item["payment_type"] or "" for item in items))
+    # 2) все позиции + одно лог-сообщение на каждую — пачкой
+    item_rows = []
+    log_rows = []
+    for item in items:
+        qty = item.get("quantity", 1)
+        base_price = int(item["price"])
+        addons = item.get("addons", [])
+        addons_total = sum(int(a.get("price", 0)) for a in addons)
+        row_total = (base_price + addons_total) * qty
+        item_id = item_ids[item["item_name"] or ""]
+        payment_type_id = payment_ids[item["payment_type"] or ""]
+
+        item_rows.append(
+            (
+                order_id,
+                item_id,
+                payment_type_id,
+                base_price,
+                qty,
+                addons_total,
+                _json.dumps(addons, ensure_ascii=False),
+                row_total,
+                staff_flag,
+                addons_label(addons),
+                addons_key(addons),
+            )
+        )
+        log_rows.append(
+            (*now, "добавление", payment_type_id, item_id, qty, user_id, username, staff_flag)
+        )
+
+    cursor.executemany(
+        "INSERT INTO order_items (order_id, item_id, payment_type_id, price, quantity, addons_total, addons_json, "
+        "row_total, is_staff, addons_text, addons_key) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        item_rows,
+    )
+    cursor.executemany(INSERT_ACTION_SQL, log_rows)
+
+    cursor.executemany(
+        UPSERT_DAILY_SALES,
+        [
+            (now[2], staff_flag, row[2], row[1], username or "", row[4], row[7])
+            for row in item_rows
+        ],
+    )
+    if item_rows:
         cursor.execute(
-            """
-            INSERT INTO actions_log
-              (timestamp, action_type, payment_type, item_name, user_id, username, is_staff)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
+            UPSERT_HOURLY_ORDERS,
+            (now[2], timeutils.business_hour(now[0], now[2]), staff_flag, 1,
+             sum(row[4] for row in item_rows), sum(row[7] for row in item_rows)),
+        )
+    _bump_days(conn, [now[2]])
+    return order_id
+
+
+def _rollup_subtract(conn, where: str, params: tuple):
+    """Вычитает из daily_sales и hourly_orders заказы, подходящие под where (до их удаления)."""
+    days = conn.execute(
+        f"SELECT MIN(o.day), MAX(o.day) FROM orders o WHERE {where}", params
+    ).fetchone()
+    if days[0] is None and days[1] is None:
+        return
+    conn.execute(
+        f"""
+        UPDATE daily_sales
+        SET quantity = daily_sales.quantity - d.quantity,
+            total = daily_sales.total - d.total
+        FROM ({ROLLUP_SELECT.format(where="WHERE " + where)}) AS d
+        WHERE daily_sales.day = d.day
+          AND daily_sales.is_staff = d.is_staff
+          AND daily_sales.payment_type_id = d.payment_type_id
+          AND daily_sales.item_id = d.item_id
+          AND daily_sales.author = d.author
+        """,
+        params,
+    )
+    conn.execute(
+        "DELETE FROM daily_sales WHERE day BETWEEN ? AND ? AND quantity <= 0",
+        (days[0] or 0, days[1] or 0),
+    )
+    conn.execute(
+        f"""
+        UPDATE hourly_orders
+        SET orders = hourly_orders.orders - d.orders,
+            quantity = hourly_orders.quantity - d.quantity,
+            total = hourly_orders.total - d.total
+        FROM ({HOURLY_SELECT.format(where="WHERE " + where)}) AS d
+        WHERE hourly_orders.day = d.day
+          AND hourly_orders.hour = d.hour
+          AND hourly_orders.is_staff = d.is_staff
+        """,
+        params,
+    )
+    conn.execute(
+        "DELETE FROM hourly_orders WHERE day BETWEEN ? AND ? AND orders <= 0",
+        (days[0] or 0, days[1] or 0),
+    )
+
+
+def _write_delete_order(conn, order_id: int, user_id: int, username: str) -> list[dict]:
+    cursor = conn.cursor()
+    # позиции удаляются только вместе со своим заказом этого пользователя
+    cursor.execute(
+        f"""
+        SELECT m.name AS item_name, i.price, i.quantity, p.name AS payment_type,
+               i.row_total, i.addons_total, i.addons_text, i.is_staff,
+               i.item_id, i.payment_type_id
+        FROM orders o
+        JOIN order_items i ON i.order_id = o.id
+        {NAMES_JOIN}
+        WHERE o.id=? AND o.user_id=?
+        ORDER BY i.id
+        """,
+        (order_id, user_id),
+    )
+    items = [dict(r) for r in cursor.fetchall()]
+    day = cursor.execute("SELECT day FROM orders WHERE id=? AND user_id=?", (order_id, user_id)).fetchone()
+    _rollup_subtract(conn, "o.id = ? AND o.user_id = ?", (order_id, user_id))
+    cursor.execute(
+        "DELETE FROM order_items WHERE order_id IN (SELECT id FROM orders WHERE id=? AND user_id=?)",
+        (order_id, user_id),
+    )
+    cursor.execute("DELETE FROM orders WHERE id=? AND user_id=?", (order_id, user_id))
+
+    # Лог каждого удаления — в той же транзакции
+    now = timeutils.stamp()
+    cursor.executemany(
+        INSERT_ACTION_SQL,
+        [
             (
-                datetime.now().isoformat(),
-                action_type,
-                payment_type,
-                item_name,
+                *now,
+                "удаление",
+                it["payment_type_id"],
+                it["item_id"],
+                it["quantity"],
                 user_id,
                 username,
-                1 if is_staff else 0,
-            ),
+                1 if it.get("is_staff") else 0,
+            )
+            for it in items
+        ],
+    )
+    # день заказа (его позиции) и сегодняшний (записи журнала)
+    _bump_days(conn, ([day[0]] if day else []) + ([now[2]] if items else []))
+    return items
+
+
+RANGE_FILTER = "o.user_id = ? AND o.ts >= ? AND o.ts < ?"
+
+
+def _write_delete_orders_in_range(
+    conn, user_id: int, start: datetime, end: datetime, username: str = ""
+) -> list[dict]:
+    params = (user_id, timeutils.to_epoch(start), timeutils.to_epoch(end))
+    rows = conn.execute(
+        f"""
+        SELECT o.id AS order_id, m.name AS item_name, i.price, i.quantity, p.name AS payment_type,
+               i.row_total, i.addons_total, i.addons_text, i.is_staff
+        FROM orders o
+        JOIN order_items i ON i.order_id = o.id
+        {NAMES_JOIN}
+        WHERE {RANGE_FILTER}
+        ORDER BY o.id, i.id
+        """,
+        params,
+    ).fetchall()
+    if not rows:
+        return []
+    now = timeutils.stamp()
+    days = [r[0] for r in conn.execute(f"SELECT DISTINCT o.day FROM orders o WHERE {RANGE_FILTER}", params)]
+    _bump_days(conn, days + [now[2]])
+
+    conn.execute(
+        f"""
+        INSERT INTO actions_log (timestamp, ts, day, action_type, payment_type_id, item_id, quantity,
+                                 user_id, username, is_staff)
+        SELECT ?, ?, ?, 'очистка_сегодня', i.payment_type_id, i.item_id, i.quantity, o.user_id, ?, i.is_staff
+        FROM orders o
+        JOIN order_items i ON i.order_id = o.id
+        WHERE {RANGE_FILTER}
+        ORDER BY o.id, i.id
+        """,
+        (*now, username) + params,
+    )
+    _rollup_subtract(conn, RANGE_FILTER, params)
+    conn.execute(
+        f"DELETE FROM order_items WHERE order_id IN (SELECT o.id FROM orders o WHERE {RANGE_FILTER})",
+        params,
+    )
+    conn.execute(f"DELETE FROM orders AS o WHERE {RANGE_FILTER}", params)
+    return [dict(r) for r in rows]
+
+
+def write_batch(jobs: list[tuple]) -> list[tuple[bool, object]]:
+    """
+    Групповой коммит: выполняет задания (fn, args, kwargs) одной транзакцией.
+    fn — одна из функций _write_*; каждое задание изолировано точкой сохранения,
+    поэтому ошибка одного не откатывает остальные.
+    Возвращает [(успех, результат или исключение), ...] в порядке заданий.
+    Если не удался сам COMMIT, исключение пробрасывается — не записано ничего.
+    """
+    results: list[tuple[bool, object]] = []
+    with transaction() as conn:
+        for fn, args, kwargs in jobs:
+            conn.execute("SAVEPOINT job")
+            try:
+                result = fn(conn, *args, **kwargs)
+            except Exception as exc:
+                conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+                results.append((False, exc))
+            else:
+                conn.execute("RELEASE job")
+                results.append((True, result))
+    return results
+
+
+def log_action(action_type, payment_type, item_name, user_id, username, *, is_staff=False, quantity=1):
+    with transaction() as conn:
+        _write_action(
+            conn, action_type, payment_type, item_name, user_id, username, is_staff=is_staff, quantity=quantity
         )
-        conn.commit()
-    finally:
-        conn.close()
+
+
+def _prepare_order(items: list[dict], user_id: int, raw_text) -> str:
+    if raw_text is None:
+        raw_text = ""
+    if not items:
+        logger.warning(f"add_order_items called with empty items list for user {user_id}")
+        raise ValueError("Cannot add order with no items")
+    return str(raw_text).strip()
 
 
 def add_order_items(
@@ -111,171 +938,105 @@ def add_order_items(
     is_staff: bool = False,
 ):
     """
-    Записывает в БД сам заказ и сразу все позиции + логи в одном соединении.
+    Записывает в БД сам заказ и сразу все позиции + логи в одной транзакции.
     """
-    if raw_text is None:
-        raw_text = ""
-    raw_text = str(raw_text).strip()
-    
-    if not items:
-        logger.warning(f"add_order_items called with empty items list for user {user_id}")
-        raise ValueError("Cannot add order with no items")
-    
-    conn = None
+    raw_text = _prepare_order(items, user_id, raw_text)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # 1) создаём новую запись в orders
-        logger.debug(f"Saving order for user {user_id}: raw_text='{raw_text[:50]}...', items_count={len(items)}")
-        cursor.execute(
-            "INSERT INTO orders (date, user_id, username, raw_text, is_staff) VALUES (?, ?, ?, ?, ?)",
-            (datetime.now().isoformat(), user_id, username, raw_text, 1 if is_staff else 0),
-        )
-
-        order_id = cursor.lastrowid
-        logger.debug(f"Created order record with ID={order_id}")
-
-        now = datetime.now().isoformat()
-        # 2) вставляем все позиции + одно лог-сообщение на каждую
-        for idx, item in enumerate(items):
-            qty = item.get("quantity", 1)
-            base_price = int(item["price"])
-            addons = item.get("addons", [])
-            addons_total = sum(int(a.get("price", 0)) for a in addons)
-            row_total = (base_price + addons_total) * qty
-
-            addons_json = _json.dumps(addons, ensure_ascii=False)
-
-            cursor.execute(
-                "INSERT INTO order_items (order_id, item_name, payment_type, price, quantity, addons_total, addons_json, row_total, is_staff) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    order_id,
-                    item["item_name"],
-                    item["payment_type"],
-                    base_price,
-                    qty,
-                    addons_total,
-                    addons_json,
-                    row_total,
-                    1 if is_staff else 0,
-                ),
-            )
-            logger.debug(f"Added item {idx + 1}/{len(items)}: {item['item_name']} to order #{order_id}")
-            
-            cursor.execute(
-                "INSERT INTO actions_log (timestamp, action_type, payment_type, item_name, user_id, username, is_staff) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (
-                    now,
-                    "добавление",
-                    item["payment_type"],
-                    item["item_name"],
-                    user_id,
-                    username,
-                    1 if is_staff else 0,
-                ),
-            )
-
-        # 3) единственный коммит и закрытие
-        conn.commit()
-        logger.info(f"Order #{order_id} committed successfully for user {user_id} with {len(items)} items")
-        
-        return order_id
-    
+        with transaction() as conn:
+            order_id = _write_order(conn, items, user_id, username, raw_text, is_staff=is_staff)
     except Exception as e:
+        # откат уже выполнен в transaction()
         logger.error(f"Error in add_order_items for user {user_id}: {e}")
-        if conn:
-            try:
-                conn.rollback()
-                logger.debug(f"Transaction rolled back for user {user_id}")
-            except Exception as rollback_err:
-                logger.error(f"Failed to rollback transaction: {rollback_err}")
         raise
-    finally:
-        if conn:
-            try:
-                conn.close()
-                logger.debug(f"Database connection closed for user {user_id}")
-            except Exception as close_err:
-                logger.error(f"Failed to close database connection: {close_err}")
+    logger.info(f"Order #{order_id} committed successfully for user {user_id} with {len(items)} items")
+    return order_id
+
+
+USER_ORDERS_PAGE_SQL = """
+WITH page AS (
+    SELECT o.id, o.date, o.ts, o.is_staff
+    FROM orders o
+    WHERE o.user_id = ?
+      {keyset}
+      AND EXISTS (SELECT 1 FROM order_items x WHERE x.order_id = o.id)
+    ORDER BY o.ts DESC, o.id DESC
+    LIMIT ?
+)
+SELECT g.id, g.date, g.ts, g.is_staff,
+       m.name AS item_name, p.name AS payment_type, i.price, i.quantity,
+       i.addons_total, i.addons_text, i.row_total, i.is_staff AS item_is_staff
+FROM page g
+JOIN order_items i ON i.order_id = g.id
+JOIN menu_items m ON m.id = i.item_id
+JOIN payment_types p ON p.id = i.payment_type_id
+ORDER BY g.ts DESC, g.id DESC, i.id
+"""
 
 
-def get_user_orders_with_items(user_id: int) -> list[dict]:
+def get_user_orders_page(
+    user_id: int, limit: int, after: tuple[int, int] | None = None
+) -> tuple[list[dict], bool]:
     """
-    Возвращает список заказов пользователя с позициями и итоговой суммой каждого заказа.
-    Формат:
+    Одна страница заказов пользователя (новые сверху) вместе с позициями — одним запросом.
+    after — ключ (ts, id) последнего заказа предыдущей страницы (keyset-пагинация),
+    поэтому стоимость не зависит от длины истории.
+    Возвращает (заказы, есть_ли_следующая_страница), заказы в формате:
     [
       {
         "id": 123,
         "date": "2025-06-27T12:34:56",
+        "ts": 1751016896,
         "payment_type": "наличный",
         "items": [
-          {"item_name": "Американо", "price": 90, "quantity": 2, "row_total": 180},
-          {"item_name": "Латте",     "price": 150, "quantity": 1, "row_total": 150},
+          {"item_name": "Американо", "price": 90, "quantity": 2, "row_total": 180, ...},
+          {"item_name": "Латте",     "price": 150, "quantity": 1, "row_total": 150, ...},
         ],
-        "total": 330
+        "total": 330,
+        "is_staff": False
       },
       ...
     ]
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT DISTINCT o.id, o.date, o.is_staff, oi.payment_type
-        FROM orders o
-        JOIN order_items oi ON oi.order_id = o.id
-        WHERE o.user_id = ?
-        ORDER BY o.date DESC
-        """,
-        (user_id,),
-    )
-    orders = []
-    for oid, date_, is_staff, payment in cursor.fetchall():
-        cursor2 = conn.cursor()
-        cursor2.execute(
-            """
-            SELECT item_name, price, quantity, addons_total, addons_json, row_total, is_staff
-            FROM order_items
-            WHERE order_id = ?
-            """,
-            (oid,),
-        )
-        rows = cursor2.fetchall()
-        items = []
-        for r in rows:
-            addons = []
-            try:
-                addons = _json.loads(r["addons_json"]) if r["addons_json"] else []
-            except Exception:
-                addons = []
-            items.append(
+    params: list = [user_id]
+    keyset = ""
+    if after is not None:
+        keyset = "AND (o.ts, o.id) < (?, ?)"
+        params += [after[0], after[1]]
+    # берём на один заказ больше — так узнаём о следующей странице без COUNT(*)
+    params.append(limit + 1)
+
+    rows = get_connection().execute(USER_ORDERS_PAGE_SQL.format(keyset=keyset), params).fetchall()
+
+    orders: list[dict] = []
+    for r in rows:
+        if not orders or orders[-1]["id"] != r["id"]:
+            orders.append(
                 {
-                    "item_name": r["item_name"],
-                    "price": r["price"],  # базовая цена
-                    "quantity": r["quantity"],
-                    "addons_total": r["addons_total"],  # сумма добавок
-                    "addons": addons,  # список добавок [{name, price}, ...]
-                    "row_total": r["row_total"],  # ИТОГО по позиции (с добавками * qty)
+                    "id": r["id"],
+                    "date": r["date"],
+                    "ts": r["ts"],
+                    "payment_type": r["payment_type"],
+                    "items": [],
+                    "total": 0,
                     "is_staff": bool(r["is_staff"]),
                 }
             )
-        # Считаем суммарную стоимость заказа
-        total = sum(r["row_total"] for r in items)
-        orders.append(
+        order = orders[-1]
+        order["items"].append(
             {
-                "id": oid,
-                "date": date_,
-                "payment_type": payment,
-                "items": items,
-                "total": total,
-                "is_staff": bool(is_staff),
+                "item_name": r["item_name"],
+                "price": r["price"],
+                "quantity": r["quantity"],
+                "addons_total": r["addons_total"],
+                "addons_text": r["addons_text"] or "",
+                "row_total": r["row_total"],
+                "is_staff": bool(r["item_is_staff"]),
             }
         )
-    conn.close()
-    return orders
+        order["total"] += r["row_total"]
+
+    has_next = len(orders) > limit
+    return orders[:limit], has_next
 
 
 def delete_entire_order(order_id: int, user_id: int, username: str) -> list[dict]:
@@ -283,31 +1044,208 @@ def delete_entire_order(order_id: int, user_id: int, username: str) -> list[dict
     Удаляет весь заказ (строку в orders + все связанные order_items).
     Возвращает список удалённых позиций для лога и показа.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT item_name, price, quantity, payment_type,
-               row_total, addons_total, addons_json, is_staff
-        FROM order_items
-        WHERE order_id=?
+    with transaction() as conn:
+        return _write_delete_order(conn, order_id, user_id, username)
+
+
+def delete_orders_in_range(user_id: int, start: datetime, end: datetime, username: str = "") -> list[dict]:
+    """
+    Удаляет все заказы пользователя со временем в [start, end) одной транзакцией
+    (наивные datetime считаются местным временем кафе):
+    выборка, удаление позиций и заказов и запись в журнал — несколькими set-based запросами.
+    Возвращает удалённые позиции (с order_id) для показа.
+    """
+    with transaction() as conn:
+        return _write_delete_orders_in_range(conn, user_id, start, end, username)
+
+
+# ---------- выборки для отчётов ----------
+# schema — "main" или подключённый архив (см. archive.sources); days — ключи (первый, последний) рабочих дней
+
+
+# последняя колонка — JSON добавок только у строк без addons_text (архивы до миграции 8)
+REPORT_LINES_SQL = """
+SELECT o.id, o.date, o.username, o.is_staff, i.payment_type_id, i.item_id, i.quantity, i.price,
+       i.addons_text, i.addons_total, i.row_total, o.raw_text, i.addons_key,
+       CASE WHEN i.addons_text IS NULL OR i.addons_key IS NULL THEN i.addons_json END
+FROM {schema}.orders o
+JOIN {schema}.order_items i ON i.order_id = o.id
+{where}
+ORDER BY o.day, o.ts
+"""
+
+REPORT_ACTIONS_SQL = """
+SELECT timestamp, action_type, payment_type_id, item_id, quantity, user_id, username, is_staff
+FROM {schema}.actions_log
+{where}
+ORDER BY {order}
+"""
+
+
+def _tuple_cursor() -> sqlite3.Cursor:
+    # обычные кортежи вместо sqlite3.Row: на больших выборках заметно дешевле
+    cursor = get_connection().cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+def names(table: str) -> dict:
+    """Справочник id -> название (menu_items или payment_types)."""
+    return dict(get_connection().execute(f"SELECT id, name FROM {table}").fetchall())
+
+
+def report_lines(schema: str = "main", days: tuple[int, int] | None = None, is_staff: bool | None = None):
+    """
+    Курсор по позициям заказов периода в порядке времени (id справочников — без названий).
+    is_staff — только заказы сотрудников (True) или только обычные (False); None — все.
+    """
+    conditions, params = [], []
+    if days:
+        conditions.append("o.day BETWEEN ? AND ?")
+        params.extend(days)
+    if is_staff is not None:
+        # заказы отбираются до соединения с позициями: чужие позиции не читаются
+        conditions.append("COALESCE(o.is_staff, 0) = ?")
+        params.append(1 if is_staff else 0)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return _tuple_cursor().execute(REPORT_LINES_SQL.format(schema=schema, where=where), params)
+
+
+def report_actions(schema: str = "main", ts_range: tuple[int, int] | None = None):
+    """
+    Курсор по журналу действий (id справочников — без названий).
+    ts_range — полуинтервал epoch-секунд [начало, конец); без него — весь журнал.
+    """
+    if ts_range:
+        # диапазон и порядок (ts, id) идут по idx_actions_log_ts, без сортировки
+        where, order, params = "WHERE ts >= ? AND ts < ?", "ts, id", ts_range
+    else:
+        where, order, params = "", "id", ()
+    return _tuple_cursor().execute(REPORT_ACTIONS_SQL.format(schema=schema, where=where, order=order), params)
+
+
+def sales_summary(is_staff: bool, days: tuple[int, int] | None = None) -> list[tuple]:
+    """
+    Продажи из daily_sales: [(тип оплаты, название, штук, сумма), ...].
+    Группировка идёт по id, названия подставляются к уже сгруппированным строкам.
+    """
+    where = "WHERE is_staff = ?" + (" AND day BETWEEN ? AND ?" if days else "")
+    return _tuple_cursor().execute(
+        f"""
+        SELECT p.name, m.name, g.quantity, g.total
+        FROM (
+            SELECT payment_type_id, item_id, SUM(quantity) AS quantity, SUM(total) AS total
+            FROM daily_sales
+            {where}
+            GROUP BY payment_type_id, item_id
+            HAVING SUM(quantity) > 0
+        ) g
+        JOIN payment_types p ON p.id = g.payment_type_id
+        JOIN menu_items m ON m.id = g.item_id
+        ORDER BY p.name, m.name
+        """,
+        (1 if is_staff else 0, *(days or ())),
+    ).fetchall()
+
+
+def author_summary(is_staff: bool, days: tuple[int, int] | None = None) -> list[tuple]:
+    """Продажи по авторам из daily_sales: [(автор, штук, сумма), ...], крупные сверху."""
+    where = "WHERE is_staff = ?" + (" AND day BETWEEN ? AND ?" if days else "")
+    return _tuple_cursor().execute(
+        f"""
+        SELECT author, SUM(quantity), SUM(total)
+        FROM daily_sales
+        {where}
+        GROUP BY author
+        HAVING SUM(quantity) > 0
+        ORDER BY SUM(total) DESC
+        """,
+        (1 if is_staff else 0, *(days or ())),
+    ).fetchall()
+
+
+def data_version(days: tuple[int, int] | None = None) -> int:
+    """Версия данных периода (None — всей истории): растёт при любом изменении его дней."""
+    where, params = ("WHERE day BETWEEN ? AND ?", days) if days else ("", ())
+    return get_connection().execute(f"SELECT COALESCE(SUM(version), 0) FROM day_versions {where}", params).fetchone()[0]
+
+
+def order_totals(days: tuple[int, int] | None = None, is_staff: bool | None = None, by_hour: bool = False) -> list[tuple]:
+    """
+    Итоги заказов из hourly_orders по дням (или по часам): [(ключ дня, час или 0, заказов, штук, сумма), ...]
+    по возрастанию. is_staff — только заказы сотрудников или только обычные (None — все).
+    Недели и месяцы вызывающий собирает из дней: это сотни строк за год.
+    """
+    conditions, params = [], []
+    if days:
+        conditions.append("day BETWEEN ? AND ?")
+        params.extend(days)
+    if is_staff is not None:
+        conditions.append("is_staff = ?")
+        params.append(1 if is_staff else 0)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    # группировка по префиксу первичного ключа (day, hour, is_staff) идёт без сортировки
+    group = "day, hour" if by_hour else "day"
+    return _tuple_cursor().execute(
+        f"""
+        SELECT day, {"hour" if by_hour else "0"}, SUM(orders), SUM(quantity), SUM(total)
+        FROM hourly_orders
+        {where}
+        GROUP BY {group}
+        ORDER BY {group}
         """,
-        (order_id,),
+        params,
+    ).fetchall()
+
+
+def _fill_daily_sales(cursor):
+    cursor.execute(
+        "INSERT INTO daily_sales (day, is_staff, payment_type_id, item_id, author, quantity, total) "
+        + ROLLUP_SELECT.format(where="")
     )
-    items = [dict(r) for r in cursor.fetchall()]
-    cursor.execute("DELETE FROM order_items WHERE order_id=?", (order_id,))
-    cursor.execute("DELETE FROM orders WHERE id=? AND user_id=?", (order_id, user_id))
-    conn.commit()
-    conn.close()
-
-    # Лог каждого удаления
-    for it in items:
-        log_action(
-            action_type="удаление",
-            payment_type=it["payment_type"],
-            item_name=f"{it['item_name']} x{it['quantity']}",
-            user_id=user_id,
-            username=username,
-            is_staff=bool(it.get("is_staff")),
-        )
-    return items
+
+
+def _fill_hourly_orders(cursor):
+    cursor.execute(
+        "INSERT INTO hourly_orders (day, hour, is_staff, orders, quantity, total) "
+        + HOURLY_SELECT.format(where="")
+    )
+
+
+def rebuild_daily_sales(archives: Iterable = ()) -> int:
+    """
+    Пересчитывает сводки daily_sales и hourly_orders с нуля по orders/order_items живой базы
+    и архивных файлов archives (см. archive.rebuild_daily_sales). Возвращает число строк daily_sales.
+    """
+    archived, archived_hours = [], []
+    for path in archives:
+        # архивы читаем отдельным соединением: ATTACH внутри транзакции невозможен
+        src = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+        try:
+            archived.extend(src.execute(ROLLUP_SELECT.format(where="")).fetchall())
+            archived_hours.extend(src.execute(HOURLY_SELECT.format(where="")).fetchall())
+        finally:
+            src.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM daily_sales")
+        _fill_daily_sales(conn.cursor())
+        conn.executemany(UPSERT_DAILY_SALES, archived)
+        conn.execute("DELETE FROM hourly_orders")
+        _fill_hourly_orders(conn.cursor())
+        conn.executemany(UPSERT_HOURLY_ORDERS, archived_hours)
+        # отчёты в кэше построены по старым сводкам
+        _bump_all_days(conn.cursor())
+        return conn.execute("SELECT COUNT(*) FROM daily_sales").fetchone()[0]
+
+
+def vacuum() -> tuple[int, int]:
+    """
+    Переписывает файл базы без свободных страниц (после миграций и массовых удалений).
+    Возвращает размер файла в байтах до и после.
+    """
+    conn = get_connection()
+    before = os.path.getsize(DB_PATH)
+    with _write_lock:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return before, os.path.getsize(DB_PATH)
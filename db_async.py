@@ -0,0 +1,200 @@
+"""
+Асинхронная обёртка над хранилищем (storage.get_storage()) для хендлеров aiogram.
+
+Вызовы хранилища не выполняются в цикле событий: запись идёт в одном выделенном
+потоке-писателе, чтение — в пуле потоков-читателей. Для SQLite у каждого потока своё
+постоянное соединение из пула db.get_connection(), а WAL позволяет читателям
+работать параллельно с писателем.
+
+Писатель делает групповой коммит: вставки, пришедшие от разных хендлеров за
+DB_BATCH_MAX_DELAY_MS (или пока не наберётся DB_BATCH_MAX_ROWS строк), уходят
+одной транзакцией. Вызывающий получает результат только после COMMIT, а при
+DB_SYNCHRONOUS=FULL (по умолчанию) — и после fsync: подтверждённая запись надёжна.
+"""
+
+import asyncio
+import functools
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import db
+from storage import get_storage
+from config import DB_READER_THREADS, DB_BATCH_MAX_ROWS, DB_BATCH_MAX_DELAY_MS
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Job:
+    __slots__ = ("op", "args", "kwargs", "rows", "future")
+
+    def __init__(self, op: str, args, kwargs, rows: int):
+        self.op = op
+        self.args = args
+        self.kwargs = kwargs
+        self.rows = rows
+        self.future: Future = Future()
+
+
+class GroupCommitWriter(threading.Thread):
+    """
+    Единственный поток, который пишет в БД.
+    Задания — имена операций хранилища (Storage.WRITE_OPS) — копятся и коммитятся
+    пачкой через write_batch().
+    """
+
+    def __init__(self, max_rows: int, max_delay_ms: float):
+        super().__init__(name="db-writer", daemon=True)
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max(0.0, max_delay_ms) / 1000
+        self._jobs: queue.Queue = queue.Queue()
+        # переносится между итерациями: невошедшее в предыдущую пачку
+        self._pending = None
+        self.batches = 0
+        self.jobs_done = 0
+
+    def submit(self, job: _Job) -> Future:
+        self._jobs.put(job)
+        return job.future
+
+    def stop(self):
+        self._jobs.put(_STOP)
+        self.join()
+
+    def _next(self, timeout=None):
+        if self._pending is not None:
+            job, self._pending = self._pending, None
+            return job
+        return self._jobs.get(timeout=timeout) if timeout is not None else self._jobs.get()
+
+    def run(self):
+        while True:
+            job = self._next()
+            if job is _STOP:
+                break
+
+            batch, rows = [job], job.rows
+            deadline = time.monotonic() + self.max_delay
+            while rows < self.max_rows:
+                try:
+                    nxt = self._next(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    self._pending = nxt
+                    break
+                batch.append(nxt)
+                rows += nxt.rows
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: list[_Job]):
+        try:
+            results = get_storage().write_batch([(j.op, j.args, j.kwargs) for j in batch])
+        except BaseException as exc:
+            logger.error(f"Group commit of {len(batch)} jobs failed: {exc}")
+            for j in batch:
+                j.future.set_exception(exc)
+            return
+        self.batches += 1
+        self.jobs_done += len(batch)
+        for j, (ok, value) in zip(batch, results):
+            if ok:
+                j.future.set_result(value)
+            else:
+                j.future.set_exception(value)
+
+
+_writer: GroupCommitWriter | None = None
+_readers: ThreadPoolExecutor | None = None
+_start_lock = threading.Lock()
+
+
+def _workers() -> tuple[GroupCommitWriter, ThreadPoolExecutor]:
+    global _writer, _readers
+    if _writer is None:
+        with _start_lock:
+            if _writer is None:
+                _readers = ThreadPoolExecutor(
+                    max_workers=max(1, DB_READER_THREADS), thread_name_prefix="db-reader"
+                )
+                writer = GroupCommitWriter(DB_BATCH_MAX_ROWS, DB_BATCH_MAX_DELAY_MS)
+                writer.start()
+                _writer = writer
+                logger.info(
+                    f"DB workers started: 1 writer (batch up to {DB_BATCH_MAX_ROWS} rows / "
+                    f"{DB_BATCH_MAX_DELAY_MS} ms), {DB_READER_THREADS} readers"
+                )
+    return _writer, _readers
+
+
+async def _submit_write(op: str, args, kwargs, *, rows: int = 1):
+    future = _workers()[0].submit(_Job(op, args, kwargs, rows))
+    return await asyncio.wrap_future(future)
+
+
+async def run_read(fn, *args, **kwargs):
+    """Выполняет fn в одном из потоков-читателей."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_workers()[1], functools.partial(fn, *args, **kwargs))
+
+
+def shutdown():
+    """Дописывает очередь, дожидается начатых чтений и закрывает хранилище (при остановке бота)."""
+    global _writer, _readers
+    with _start_lock:
+        writer, readers = _writer, _readers
+        _writer = _readers = None
+    if writer is not None:
+        writer.stop()
+        readers.shutdown(wait=True)
+    get_storage().close()
+
+
+# ---------- операции, которые вызывают хендлеры ----------
+
+
+async def add_order_items(
+    items: list[dict],
+    user_id: int,
+    username: str,
+    raw_text: str = "",
+    *,
+    is_staff: bool = False,
+) -> int:
+    """Как db.add_order_items, но через групповой коммит. Возвращает id заказа после COMMIT."""
+    raw_text = db._prepare_order(items, user_id, raw_text)
+    order_id = await _submit_write(
+        "add_order",
+        (items, user_id, username, raw_text),
+        {"is_staff": is_staff},
+        rows=2 * len(items) + 1,
+    )
+    logger.info(f"Order #{order_id} committed successfully for user {user_id} with {len(items)} items")
+    return order_id
+
+
+async def log_action(action_type, payment_type, item_name, user_id, username, *, is_staff=False, quantity=1):
+    await _submit_write(
+        "log_action",
+        (action_type, payment_type, item_name, user_id, username),
+        {"is_staff": is_staff, "quantity": quantity},
+    )
+
+
+async def delete_entire_order(order_id: int, user_id: int, username: str) -> list[dict]:
+    return await _submit_write("delete_order", (order_id, user_id, username), {}, rows=8)
+
+
+async def delete_orders_in_range(user_id: int, start: datetime, end: datetime, username: str = "") -> list[dict]:
+    return await _submit_write("delete_orders_in_range", (user_id, start, end, username), {}, rows=64)
+
+
+async def get_user_orders_page(
+    user_id: int, limit: int, after: tuple[int, int] | None = None
+) -> tuple[list[dict], bool]:
+    return await run_read(get_storage().get_user_orders_page, user_id, limit, after)
@@ -2,7 +2,7 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-import json, logging, sqlite3, asyncio
+import json, logging, sqlite3
 
 from config import MENU_FILE, GROUP_CHAT_ID
 from llm_client import parse_order_from_text, LLMParseError
@@ -14,7 +14,8 @@ from utils import (
     check_membership,
 )
 from keyboards import show_main_menu, confirm_keyboard
-from db import add_order_items
+from db_async import add_order_items
+from db import addons_key
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -23,6 +24,26 @@ with open(MENU_FILE, encoding="utf-8") as f:
     MENU = json.load(f)
 MAIN_MENU = MENU["main"]
 ADDONS = MENU["addons"]
+# имя добавки в любом регистре -> как в меню: «сироп» и «Сироп» — одна добавка с одной ценой
+ADDON_NAMES = {name.lower(): name for name in ADDONS}
+
+
+def _order_total(items: list[dict]) -> int:
+    return sum(
+        (it["price"] + sum(a["price"] for a in it["addons"])) * it.get("quantity", 1) for it in items
+    )
+
+
+def _order_lines(items: list[dict], suffix: str = "") -> list[str]:
+    """Строки заказа для подтверждения: цены за штуку, количество — если больше одной."""
+    lines = []
+    for i, it in enumerate(items, 1):
+        qty = it.get("quantity", 1)
+        qty_text = f" ×{qty}" if qty > 1 else ""
+        lines.append(f"{i}) {it['item_name']}{qty_text} — {it['price']}₽{suffix}")
+        for a in it["addons"]:
+            lines.append(f"   • {a['name']} — {a['price']}₽")
+    return lines
 
 
 @router.message(F.chat.type == "private", F.voice)
@@ -77,7 +98,9 @@ async def handle_message(message: Message, state: FSMContext, bot):
         else:
             pay_text = "Не указано"
 
+        # одна строка на (позицию, набор добавок) с реальным количеством
         normalized = []
+        lines_by_key = {}
         for entry in raw_items:
             name = (entry.get("n") or entry.get("name") or "").strip()
             if name not in MAIN_MENU:
@@ -96,19 +119,22 @@ async def handle_message(message: Message, state: FSMContext, bot):
                 ad = str(addon).strip()
                 if not ad:
                     continue
+                ad = ADDON_NAMES.get(ad.lower(), ad)
                 addons_info.append({"name": ad, "price": ADDONS.get(ad, 0)})
 
-            price = MAIN_MENU[name]
-            for _ in range(qty):
-                normalized.append(
-                    {
-                        "item_name": name,
-                        "quantity": 1,
-                        "price": price,
-                        "addons": addons_info,
-                        "payment_type": pay_text,
-                    }
-                )
+            # набор добавок без учёта порядка: «сироп, шот» и «шот, сироп» — одна строка
+            key = (name, addons_key(addons_info))
+            if key in lines_by_key:
+                lines_by_key[key]["quantity"] += qty
+                continue
+            lines_by_key[key] = {
+                "item_name": name,
+                "quantity": qty,
+                "price": MAIN_MENU[name],
+                "addons": addons_info,
+                "payment_type": pay_text,
+            }
+            normalized.append(lines_by_key[key])
 
         if not normalized:
             return await notify_temp(message, "⚠️ Ни одна позиция не найдена в меню.")
@@ -116,14 +142,8 @@ async def handle_message(message: Message, state: FSMContext, bot):
         await state.update_data(items=normalized)
         await state.set_state("awaiting_add_confirmation")
 
-        total = sum(
-            it["price"] + sum(a["price"] for a in it["addons"]) for it in normalized
-        )
-        lines = []
-        for i, it in enumerate(normalized, 1):
-            lines.append(f"{i}) {it['item_name']} — {it['price']}₽")
-            for a in it["addons"]:
-                lines.append(f"   • {a['name']} — {a['price']}₽")
+        total = _order_total(normalized)
+        lines = _order_lines(normalized)
 
         kb = confirm_keyboard("✅ Добавить", "confirm_add", "cancel_add")
         prompt = (
@@ -159,37 +179,23 @@ async def _process_order_confirmation(call: CallbackQuery, state: FSMContext, is
             logger.warning(f"User {call.from_user.id} tried to confirm order with no items")
             return await notify_temp(call, "⚠️ Нет ни одной позиции.")
 
-        # Попытка сохранить заказ в БД с повторами
-        order_id = None
-        last_error = None
-        for attempt in range(3):
-            try:
-                order_id = add_order_items(
-                    items,
-                    call.from_user.id,
-                    call.from_user.username or "",
-                    raw_text,
-                    is_staff=is_staff_order,
-                )
-                logger.info(f"Order #{order_id} saved successfully for user {call.from_user.id} (attempt {attempt + 1})")
-                break
-            except sqlite3.OperationalError as err:
-                last_error = err
-                if "locked" in str(err).lower():
-                    logger.warning(f"Database locked, attempt {attempt + 1}/3 for user {call.from_user.id}")
-                    await asyncio.sleep(0.5)
-                    continue
-                logger.error(f"Database error while saving order for user {call.from_user.id}: {err}")
-                return await notify_temp(call, "⚠️ Ошибка базы данных. Попробуйте позже.")
-            except Exception as err:
-                last_error = err
-                logger.exception(f"Unexpected error while saving order for user {call.from_user.id}")
-                return await notify_temp(call, "⚠️ Не удалось сохранить заказ. Попробуйте позже.")
-
-        # Проверяем, что заказ действительно сохранился
-        if order_id is None:
-            logger.error(f"Failed to save order for user {call.from_user.id} after 3 attempts. Last error: {last_error}")
-            return await notify_temp(call, "⚠️ Не удалось сохранить заказ после нескольких попыток. Попробуйте позже.")
+        # Запись идёт через единственный писатель db_async: он сам ждёт блокировку
+        # (busy_timeout), поэтому «database is locked» здесь — уже настоящая ошибка, без повторов
+        try:
+            order_id = await add_order_items(
+                items,
+                call.from_user.id,
+                call.from_user.username or "",
+                raw_text,
+                is_staff=is_staff_order,
+            )
+            logger.info(f"Order #{order_id} saved successfully for user {call.from_user.id}")
+        except sqlite3.OperationalError as err:
+            logger.error(f"Database error while saving order for user {call.from_user.id}: {err}")
+            return await notify_temp(call, "⚠️ Ошибка базы данных. Попробуйте позже.")
+        except Exception:
+            logger.exception(f"Unexpected error while saving order for user {call.from_user.id}")
+            return await notify_temp(call, "⚠️ Не удалось сохранить заказ. Попробуйте позже.")
 
         # Удаляем предыдущее сообщение
         try:
@@ -198,13 +204,8 @@ async def _process_order_confirmation(call: CallbackQuery, state: FSMContext, is
             logger.warning(f"Could not delete message for user {call.from_user.id}: {e}")
 
         # Формируем текст подтверждения
-        total = sum(it["price"] + sum(a["price"] for a in it["addons"]) for it in items)
-        lines = []
-        for i, it in enumerate(items, 1):
-            staff_suffix = " (для сотрудника)" if is_staff_order else ""
-            lines.append(f"{i}) {it['item_name']} — {it['price']}₽{staff_suffix}")
-            for a in it["addons"]:
-                lines.append(f"   • {a['name']} — {a['price']}₽")
+        total = _order_total(items)
+        lines = _order_lines(items, " (для сотрудника)" if is_staff_order else "")
 
         confirmation = (
             f"✅ Заказ #{order_id} добавлен (оплата: <b>{items[0]['payment_type']}</b>)\n"
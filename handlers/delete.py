@@ -3,15 +3,15 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from datetime import datetime
-from db import (
-    get_user_orders_with_items,
+from db_async import (
+    get_user_orders_page,
     delete_entire_order,
-    log_action,
+    delete_orders_in_range,
 )
 from keyboards import show_main_menu, confirm_keyboard, get_main_menu
 from utils import send_and_track, notify_temp, check_membership
 from config import GROUP_CHAT_ID
-import json as _json
+import timeutils
 
 
 router = Router()
@@ -24,8 +24,7 @@ async def show_orders(call: CallbackQuery, state: FSMContext):
         return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
 
     await state.clear()
-    await state.update_data(offset=0)
-    await display_orders(call, state, offset=0)
+    await display_orders(call, state, after=None)
 
 
 @router.callback_query(F.message.chat.type == "private", F.data == "next_page")
@@ -33,27 +32,25 @@ async def next_page(call: CallbackQuery, state: FSMContext):
     if not await check_membership(call.bot, call.from_user.id):
         return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
     data = await state.get_data()
-    offset = data.get("offset", 0) + ORDERS_PER_PAGE
-    await state.update_data(offset=offset)
-    await display_orders(call, state, offset)
+    after = data.get("next_cursor")
+    await display_orders(call, state, after=tuple(after) if after else None)
 
 
 @router.callback_query(F.message.chat.type == "private", F.data == "reset_page")
 async def reset_page(call: CallbackQuery, state: FSMContext):
     if not await check_membership(call.bot, call.from_user.id):
         return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
-    await state.update_data(offset=0)
-    await display_orders(call, state, offset=0)
+    await display_orders(call, state, after=None)
 
 
-async def display_orders(call: CallbackQuery, state: FSMContext, offset: int):
-    if not await check_membership(call.bot, call.from_user.id):
-        return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
+async def display_orders(call: CallbackQuery, state: FSMContext, after: tuple[int, int] | None):
     """
     Показывает пагинированный список полных заказов (с позициями и суммами).
+    after — ключ (ts, id) последнего заказа предыдущей страницы, None — первая страница.
     """
-    orders = get_user_orders_with_items(call.from_user.id)
-    page = orders[offset : offset + ORDERS_PER_PAGE]
+    if not await check_membership(call.bot, call.from_user.id):
+        return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
+    page, has_next = await get_user_orders_page(call.from_user.id, ORDERS_PER_PAGE, after)
 
     if not page:
         await notify_temp(call, "🔸 У вас пока нет заказов.")
@@ -62,6 +59,9 @@ async def display_orders(call: CallbackQuery, state: FSMContext, offset: int):
         )
         return
 
+    last = page[-1]
+    await state.update_data(next_cursor=[last["ts"], last["id"]] if has_next else None)
+
     text_lines = []
     buttons = []
     for order in page:
@@ -84,9 +84,9 @@ async def display_orders(call: CallbackQuery, state: FSMContext, offset: int):
         )
 
     nav = []
-    if offset + ORDERS_PER_PAGE < len(orders):
+    if has_next:
         nav.append(InlineKeyboardButton(text="⏭ Далее", callback_data="next_page"))
-    if offset > 0:
+    if after is not None:
         nav.append(InlineKeyboardButton(text="🔙 В начало", callback_data="reset_page"))
 
     control = [
@@ -110,7 +110,7 @@ async def delete_one(call: CallbackQuery, state: FSMContext):
     order_id = int(call.data.split("_", 1)[1])
     username = call.from_user.username or ""
 
-    items = delete_entire_order(order_id, call.from_user.id, username)
+    items = await delete_entire_order(order_id, call.from_user.id, username)
     if not items:
         await call.answer("Заказ не найден или уже удалён.", show_alert=True)
         return
@@ -128,15 +128,8 @@ async def delete_one(call: CallbackQuery, state: FSMContext):
         staff_suffix = " (для сотрудника)" if is_staff_order else ""
         line = f"- {it['item_name']} ×{it['quantity']} — {it['price']}₽{staff_suffix}"
         lines.append(line)
-        
-        try:
-            addons = _json.loads(it.get("addons_json") or "[]")
-        except Exception:
-            addons = []
-        
-        for a in addons:
-            addon_price = int(a.get("price", 0))
-            lines.append(f"   • {a.get('name','')} — {addon_price}₽")
+        if it.get("addons_text"):
+            lines.append(f"   • {it['addons_text']}")
     summary = "\n".join(lines)
     staff_note = "\n(Заказ помечен как для сотрудника)" if is_staff_order else ""
     user_text = f"❌ Заказ #{order_id} удалён:\n{summary}{staff_note}\n\n💰 Итого: {total}₽"
@@ -184,30 +177,12 @@ async def do_clear_today(call: CallbackQuery, state: FSMContext):
     if not await check_membership(call.bot, call.from_user.id):
         return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
     await call.answer()
-    today = datetime.now().date()
-    orders = get_user_orders_with_items(call.from_user.id)
-    deleted_count = 0
-
-    for order in orders:
-        try:
-            order_date = datetime.fromisoformat(order["date"]).date()
-        except:
-            continue
-        if order_date == today:
-            items = delete_entire_order(
-                order["id"], call.from_user.id, call.from_user.username or ""
-            )
-            if items:
-                deleted_count += 1
-                for it in items:
-                    log_action(
-                        action_type="очистка_сегодня",
-                        payment_type=order["payment_type"],
-                        item_name=it["item_name"],
-                        user_id=call.from_user.id,
-                        username=call.from_user.username or "",
-                        is_staff=order.get("is_staff", False),
-                    )
+    today = timeutils.business_day()
+    start, end = timeutils.business_day_bounds(today)
+    items = await delete_orders_in_range(
+        call.from_user.id, start, end, call.from_user.username or ""
+    )
+    deleted_count = len({it["order_id"] for it in items})
 
     await state.clear()
     try:
@@ -1,17 +1,26 @@
 from aiogram import Router, F
 from aiogram.types import (
     CallbackQuery,
-    FSInputFile,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
 from aiogram.fsm.context import FSMContext
-from reports import generate_reports
+from report_jobs import submit_report, ReportQueueFull
 from keyboards import show_main_menu
-from utils import user_last_bot_message, check_membership, notify_temp
-from datetime import datetime, timedelta
+from utils import user_last_bot_message, check_membership, notify_temp, report_input_file
+from datetime import timedelta
+import logging
+import timeutils
 
 router = Router()
+logger = logging.getLogger(__name__)
+
+# какие книги строить для выбранного вида отчёта; журнал действий отправляется всегда
+REPORT_OUTPUTS = {
+    "regular": ("report", "log"),
+    "staff": ("staff", "log"),
+    "all": ("report", "staff", "log"),
+}
 
 
 @router.callback_query(F.message.chat.type == "private", F.data == "report")
@@ -59,6 +68,8 @@ async def choose_report_period(call: CallbackQuery, state: FSMContext):
         inline_keyboard=[
             [InlineKeyboardButton(text="📅 За сегодня", callback_data="period_today")],
             [InlineKeyboardButton(text="📆 За вчера", callback_data="period_yesterday")],
+            [InlineKeyboardButton(text="🗓 За 7 дней", callback_data="period_week")],
+            [InlineKeyboardButton(text="🗓 За месяц", callback_data="period_month")],
             [InlineKeyboardButton(text="🗓 За всё время", callback_data="period_all")],
             [InlineKeyboardButton(text="🔙 Назад", callback_data="report")],
         ]
@@ -68,7 +79,7 @@ async def choose_report_period(call: CallbackQuery, state: FSMContext):
 
 @router.callback_query(
     F.message.chat.type == "private",
-    F.data.in_({"period_today", "period_yesterday", "period_all"}),
+    F.data.in_({"period_today", "period_yesterday", "period_week", "period_month", "period_all"}),
 )
 async def generate_selected_report(call: CallbackQuery, state: FSMContext, bot):
     if not await check_membership(bot, call.from_user.id):
@@ -77,11 +88,15 @@ async def generate_selected_report(call: CallbackQuery, state: FSMContext, bot):
     data = await state.get_data()
     report_type = data.get("report_type", "regular")
     
-    today = datetime.now().date()
+    today = timeutils.business_day()
     if call.data == "period_today":
         start, end = today, today
     elif call.data == "period_yesterday":
         start, end = today - timedelta(days=1), today - timedelta(days=1)
+    elif call.data == "period_week":
+        start, end = today - timedelta(days=6), today
+    elif call.data == "period_month":
+        start, end = today.replace(day=1), today
     else:
         start = end = None
 
@@ -90,21 +105,45 @@ async def generate_selected_report(call: CallbackQuery, state: FSMContext, bot):
     except:
         pass
 
-    report_path, staff_report_path, log_path = generate_reports(start, end)
-    
-    if report_type == "staff":
-        if staff_report_path:
-            await call.message.answer_document(FSInputFile(staff_report_path))
-        else:
-            await call.message.answer("📊 Нет заказов сотрудников за выбранный период.")
-    elif report_type == "regular":
-        await call.message.answer_document(FSInputFile(report_path))
-    else:  # all
-        await call.message.answer_document(FSInputFile(report_path))
-        if staff_report_path:
-            await call.message.answer_document(FSInputFile(staff_report_path))
+    # отчёт строится в пуле процессов; пока ждём — сообщение-заглушка
+    status = await call.message.answer("⏳ Готовлю отчёт…")
+    try:
+        report_path, staff_report_path, log_path = await submit_report(
+            start, end, REPORT_OUTPUTS.get(report_type, REPORT_OUTPUTS["all"])
+        )
+    except ReportQueueFull:
+        await status.edit_text("⏳ Сейчас готовится слишком много отчётов, попробуйте через минуту.")
+        await state.clear()
+        return await show_main_menu(call.from_user.id, call.message.chat.id, bot)
+    except Exception:
+        logger.exception("Report generation failed")
+        await status.edit_text("⚠️ Не удалось подготовить отчёт, попробуйте ещё раз.")
+        await state.clear()
+        return await show_main_menu(call.from_user.id, call.message.chat.id, bot)
+    try:
+        await status.delete()
+    except:
+        pass
     
-    await call.message.answer_document(FSInputFile(log_path))
+    # файл из кэша читается только при отправке; если его всё же не стало
+    # (или Telegram не принял), пользователь узнаёт об этом, а хендлер не падает
+    try:
+        if report_type == "staff":
+            if staff_report_path:
+                await call.message.answer_document(report_input_file(staff_report_path))
+            else:
+                await call.message.answer("📊 Нет заказов сотрудников за выбранный период.")
+        elif report_type == "regular":
+            await call.message.answer_document(report_input_file(report_path))
+        else:  # all
+            await call.message.answer_document(report_input_file(report_path))
+            if staff_report_path:
+                await call.message.answer_document(report_input_file(staff_report_path))
+
+        await call.message.answer_document(report_input_file(log_path))
+    except Exception:
+        logger.exception("Sending report failed")
+        await call.message.answer("⚠️ Не удалось отправить отчёт, попробуйте ещё раз.")
     await state.clear()
     await show_main_menu(call.from_user.id, call.message.chat.id, bot)
 
@@ -0,0 +1,115 @@
+from aiogram import Router, F
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.fsm.context import FSMContext
+from db_async import run_read
+from reports import sales_digest
+from keyboards import show_main_menu
+from utils import user_last_bot_message, check_membership, notify_temp
+from datetime import timedelta
+from html import escape
+import logging
+import timeutils
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# сколько позиций показывать в «Топ позиций»
+SUMMARY_TOP_ITEMS = 5
+
+PERIOD_TITLES = {
+    "summary_today": "сегодня",
+    "summary_yesterday": "вчера",
+    "summary_week": "7 дней",
+    "summary_month": "месяц",
+}
+
+
+def _money(value) -> str:
+    return f"{value:,.0f}₽".replace(",", " ")
+
+
+def format_digest(digest: dict, title: str) -> str:
+    """Сводка sales_digest -> текст сообщения (HTML)."""
+    if not digest["orders"] and not digest["quantity"]:
+        return f"📈 <b>Сводка за {title}</b>\n\nЗаказов за период нет."
+    lines = [
+        f"📈 <b>Сводка за {title}</b>",
+        "",
+        f"🧾 Заказов: <b>{digest['orders']}</b>, позиций: {digest['quantity']}",
+        f"💰 Выручка: <b>{_money(digest['total'])}</b>",
+        f"   • обычные: {digest['regular']['orders']} зак. — {_money(digest['regular']['total'])}",
+        f"   • сотрудники: {digest['staff']['orders']} зак. — {_money(digest['staff']['total'])}",
+    ]
+    if digest["payments"]:
+        lines += ["", "💳 <b>По типам оплаты</b>"]
+        lines += [f"   • {escape(str(p))}: {_money(t)} ({q} шт.)" for p, q, t in digest["payments"]]
+    if digest["top_items"]:
+        lines += ["", "🏆 <b>Топ позиций</b>"]
+        lines += [
+            f"   {i}. {escape(str(name))} — {q} шт., {_money(t)}"
+            for i, (name, q, t) in enumerate(digest["top_items"], 1)
+        ]
+    return "\n".join(lines)
+
+
+@router.callback_query(F.message.chat.type == "private", F.data == "summary")
+async def choose_summary_period(call: CallbackQuery, state: FSMContext, bot):
+    if not await check_membership(bot, call.from_user.id):
+        return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
+    await state.clear()
+    last = user_last_bot_message.get(call.from_user.id)
+    if last:
+        try:
+            await bot.delete_message(call.message.chat.id, last)
+        except:
+            pass
+
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="📅 За сегодня", callback_data="summary_today")],
+            [InlineKeyboardButton(text="📆 За вчера", callback_data="summary_yesterday")],
+            [InlineKeyboardButton(text="🗓 За 7 дней", callback_data="summary_week")],
+            [InlineKeyboardButton(text="🗓 За месяц", callback_data="summary_month")],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="cancel_summary")],
+        ]
+    )
+    await call.message.answer("📈 Сводка продаж — выберите период:", reply_markup=kb)
+
+
+@router.callback_query(F.message.chat.type == "private", F.data.in_(set(PERIOD_TITLES)))
+async def show_summary(call: CallbackQuery, state: FSMContext, bot):
+    if not await check_membership(bot, call.from_user.id):
+        return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
+
+    today = timeutils.business_day()
+    if call.data == "summary_today":
+        start, end = today, today
+    elif call.data == "summary_yesterday":
+        start, end = today - timedelta(days=1), today - timedelta(days=1)
+    elif call.data == "summary_week":
+        start, end = today - timedelta(days=6), today
+    else:
+        start, end = today.replace(day=1), today
+
+    # сводка читается из сводных таблиц — миллисекунды, без очереди отчётов
+    try:
+        digest = await run_read(sales_digest, start, end, top=SUMMARY_TOP_ITEMS)
+    except Exception:
+        logger.exception("Sales summary failed")
+        return await notify_temp(call, "⚠️ Не удалось получить сводку, попробуйте ещё раз.")
+
+    await call.message.edit_text(format_digest(digest, PERIOD_TITLES[call.data]))
+    await state.clear()
+    await show_main_menu(call.from_user.id, call.message.chat.id, bot)
+
+
+@router.callback_query(F.message.chat.type == "private", F.data == "cancel_summary")
+async def cancel_summary(call: CallbackQuery, state: FSMContext, bot):
+    if not await check_membership(bot, call.from_user.id):
+        return await notify_temp(call, "⛔ Доступ запрещён: вы не участник группы.")
+    await state.clear()
+    try:
+        await call.message.delete()
+    except:
+        pass
+    await show_main_menu(call.from_user.id, call.message.chat.id, bot)
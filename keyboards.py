@@ -20,6 +20,7 @@ def get_main_menu() -> InlineKeyboardMarkup:
         inline_keyboard=[
             [InlineKeyboardButton(text="📋 Меню", callback_data="show_menu")],
             [InlineKeyboardButton(text="❌ Удалить", callback_data="delete")],
+            [InlineKeyboardButton(text="📈 Сводка", callback_data="summary")],
             [InlineKeyboardButton(text="📄 Получить отчёт", callback_data="report")],
         ]
     )
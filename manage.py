@@ -0,0 +1,105 @@
+"""
+Служебные команды обслуживания базы:
+
+    python manage.py rebuild-rollup
+    python manage.py vacuum
+    python manage.py archive [--keep-months N]
+    python manage.py backup [--keep N] [--no-compress]
+    python manage.py restore ПУТЬ_К_КОПИИ
+"""
+
+import argparse
+import logging
+import time
+
+import archive
+import backup
+import db
+
+
+def cmd_rebuild_rollup(args):
+    """Пересчитать сводки daily_sales и hourly_orders по сырым заказам (живая база и архивы)."""
+    t0 = time.perf_counter()
+    rows = archive.rebuild_daily_sales()
+    print(f"daily_sales rebuilt: {rows} rows in {time.perf_counter() - t0:.2f} s")
+
+
+def cmd_vacuum(args):
+    """Сжать файл базы (после миграций и массовых удалений). Блокирует запись на время работы."""
+    t0 = time.perf_counter()
+    before, after = db.vacuum()
+    print(f"{db.DB_PATH}: {before / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB in {time.perf_counter() - t0:.2f} s")
+
+
+def cmd_archive(args):
+    """Перенести закрытые месяцы в архивные файлы (со сверкой перед удалением)."""
+    t0 = time.perf_counter()
+    done = archive.archive_closed_months(args.keep_months)
+    for month, moved in done:
+        print(f"{month:%Y-%m}: " + ", ".join(f"{table}={count}" for table, count in moved.items()))
+    print(f"Archived {len(done)} months in {time.perf_counter() - t0:.2f} s")
+
+
+def cmd_backup(args):
+    """Снять онлайн-копию базы (не останавливая бота), проверить, сжать и удалить старые копии."""
+    m = backup.run_backup(keep=args.keep, compress=not args.no_compress)
+    print(
+        f"{m['path']}: {m['pages']} pages in {m['duration_s']:.2f} s ({m['steps']} steps, "
+        f"{m['restarts']} restarts), max writer stall {m['max_stall_ms']:.2f} ms, "
+        f"{m['size'] / 2**20:.1f} -> {m['stored_size'] / 2**20:.1f} MiB, rotated {m['rotated']}, "
+        f"archives copied {m['archives']}"
+    )
+
+
+def cmd_restore(args):
+    """Заменить базу копией из backup (бот должен быть остановлен) и очистить кэш отчётов."""
+    pages = backup.restore_backup(args.path)
+    # копия могла быть снята до последних миграций
+    db.init_db()
+    print(f"{db.DB_PATH}: restored {pages} pages from {args.path}")
+
+
+COMMANDS = {
+    "rebuild-rollup": cmd_rebuild_rollup,
+    "vacuum": cmd_vacuum,
+    "archive": cmd_archive,
+    "backup": cmd_backup,
+    "restore": cmd_restore,
+}
+
+# дополнительные аргументы команд
+ARGUMENTS = {
+    "archive": [
+        (("--keep-months",), {"type": int, "default": archive.ARCHIVE_KEEP_MONTHS,
+                              "help": "сколько последних месяцев оставить в живой базе"}),
+    ],
+    "backup": [
+        (("--keep",), {"type": int, "default": backup.BACKUP_KEEP, "help": "сколько последних копий хранить"}),
+        (("--no-compress",), {"action": "store_true", "help": "не сжимать копию gzip"}),
+    ],
+    "restore": [
+        (("path",), {"help": "файл копии (.db или .db.gz)"}),
+    ],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание базы заказов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, fn in COMMANDS.items():
+        command = sub.add_parser(name, help=fn.__doc__)
+        for flags, options in ARGUMENTS.get(name, []):
+            command.add_argument(*flags, **options)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db.init_db()
+    archive.upgrade_archives()
+    try:
+        COMMANDS[args.command](args)
+    finally:
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Кэш готовых отчётов.
+
+Запись кэша — папка REPORT_CACHE_DIR/<вид>_<период>_v<версия> с одним xlsx под тем
+же именем, что отдаёт generate_reports (пустая папка вида staff — «заказов
+сотрудников за период нет»). Версия — Storage.data_version: сумма счётчиков
+изменений по дням периода, поэтому новый заказ или удаление за день меняет
+версию только тех периодов, которые этот день включают; записи других периодов
+остаются в силе. Пересчёт сводок (manage.py rebuild-rollup) увеличивает счётчики
+всех дней, а восстановление базы из копии (manage.py restore) очищает кэш целиком:
+счётчики в копии старые и могли бы совпасть с версиями отчётов, построенных позже.
+
+Файл, отданный запросу, может ещё отправляться, когда данные периода уже
+поменялись и новая версия сохранена, поэтому при сохранении старые версии не
+удаляются. Их, как и всё остальное, убирает evict, и только спустя
+REPORT_CACHE_MIN_AGE_S после последнего обращения (время обращения — mtime папки
+записи): сначала вытесненные более новой версией того же отчёта, затем, пока кэш
+больше REPORT_CACHE_MAX_MB, те, что дольше всех не запрашивали.
+Функции вызываются только из цикла событий бота (report_jobs), без блокировок.
+
+Отчёты строятся во временных папках REPORT_CACHE_DIR/.build_* (build_dir): у каждого
+построения своя, поэтому параллельные запросы не перезаписывают файлы друг друга,
+а перенос в запись кэша — переименование на том же диске.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from config import REPORT_CACHE_DIR, REPORT_CACHE_MAX_MB, REPORT_CACHE_MIN_AGE_S
+
+logger = logging.getLogger(__name__)
+
+BUILD_PREFIX = ".build_"
+
+
+def enabled() -> bool:
+    return REPORT_CACHE_MAX_MB > 0
+
+
+def build_dir() -> str:
+    """Новая пустая папка для одного построения отчётов; удаляет её вызывающий."""
+    Path(REPORT_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    return tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=REPORT_CACHE_DIR)
+
+
+def clear_builds() -> int:
+    """Удаляет папки построений, оставшиеся от прошлого запуска (бот упал посреди отчёта)."""
+    root = Path(REPORT_CACHE_DIR)
+    if not root.is_dir():
+        return 0
+    leftovers = [entry for entry in root.glob(f"{BUILD_PREFIX}*") if entry.is_dir()]
+    for entry in leftovers:
+        shutil.rmtree(entry, ignore_errors=True)
+    return len(leftovers)
+
+
+def clear() -> int:
+    """Удаляет все записи кэша; возвращает их число."""
+    root = Path(REPORT_CACHE_DIR)
+    if not root.is_dir():
+        return 0
+    entries = [entry for entry in root.iterdir() if entry.is_dir() and not entry.name.startswith(BUILD_PREFIX)]
+    for entry in entries:
+        shutil.rmtree(entry, ignore_errors=True)
+    return len(entries)
+
+
+def _entry(kind: str, period: str, version: int) -> Path:
+    return Path(REPORT_CACHE_DIR) / f"{kind}_{period}_v{version}"
+
+
+def lookup(period: str, versions: dict[str, int]) -> dict[str, str | None]:
+    """
+    Закэшированные отчёты периода в текущих версиях: {вид: путь}; виды,
+    которых в кэше нет, в ответ не попадают. Путь None — пустой отчёт staff.
+    """
+    found = {}
+    for kind, version in versions.items():
+        entry = _entry(kind, period, version)
+        if not entry.is_dir():
+            continue
+        files = list(entry.iterdir())
+        if not files and kind != "staff":
+            continue
+        os.utime(entry)
+        found[kind] = str(files[0]) if files else None
+    if found:
+        logger.info(f"Report cache hit: {period} {sorted(found)}")
+    return found
+
+
+def store(period: str, versions: dict[str, int], paths: dict[str, str | None]) -> dict[str, str | None]:
+    """
+    Переносит только что построенные отчёты ({вид: путь}) в кэш и возвращает их
+    новые пути, затем кэш ужимается (evict). Старые версии тех же отчётов остаются
+    до evict. Если та же версия уже в кэше (её построил параллельный запрос с другим
+    набором отчётов), остаётся она: её файл, возможно, уже отправляется.
+    """
+    stored = {}
+    entries = []
+    for kind, path in paths.items():
+        entry = _entry(kind, period, versions[kind])
+        entries.append(entry)
+        if entry.is_dir():
+            files = list(entry.iterdir())
+            if files or kind == "staff":
+                os.utime(entry)
+                stored[kind] = str(files[0]) if files else None
+                continue
+            shutil.rmtree(entry)
+        entry.mkdir(parents=True)
+        if path is None:
+            stored[kind] = None
+            continue
+        target = entry / Path(path).name
+        shutil.move(path, target)
+        stored[kind] = str(target)
+    evict(keep=entries)
+    return stored
+
+
+def _size(entry: Path) -> int:
+    return sum(f.stat().st_size for f in entry.iterdir())
+
+
+def _version_of(entry: Path) -> tuple[str, int]:
+    """Папка записи -> («вид_период», версия)."""
+    name, _, version = entry.name.rpartition("_v")
+    return name, int(version)
+
+
+def evict(max_mb: float = REPORT_CACHE_MAX_MB, keep=(), min_age_s: float = REPORT_CACHE_MIN_AGE_S) -> list[Path]:
+    """
+    Удаляет записи, к которым не обращались дольше min_age_s: сначала вытесненные
+    более новой версией того же отчёта, затем самые давние, пока кэш больше max_mb.
+    Записи из keep (только что сохранённые) не трогает. Возвращает удалённые папки.
+    """
+    root = Path(REPORT_CACHE_DIR)
+    if not root.is_dir():
+        return []
+    entries = sorted(
+        (e for e in root.iterdir() if e.is_dir() and not e.name.startswith(BUILD_PREFIX)),
+        key=lambda e: e.stat().st_mtime,
+    )
+    sizes = {entry: _size(entry) for entry in entries}
+    total = sum(sizes.values())
+    limit = max_mb * 2**20
+    newest = {}
+    for entry in entries:
+        name, version = _version_of(entry)
+        newest[name] = max(newest.get(name, version), version)
+    # моложе min_age_s — файл мог только что уйти запросу и ещё отправляется
+    cutoff = time.time() - min_age_s
+    idle = [e for e in entries if e not in keep and e.stat().st_mtime <= cutoff]
+    superseded = [e for e in idle if _version_of(e)[1] < newest[_version_of(e)[0]]]
+    removed = []
+    for entry in superseded + [e for e in idle if e not in superseded]:
+        if entry not in superseded and total <= limit:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+        removed.append(entry)
+    if removed:
+        logger.info(f"Report cache: evicted {len(removed)} entries, {total / 2**20:.1f} MiB left")
+    return removed
@@ -0,0 +1,221 @@
+"""
+Очередь генерации отчётов вне цикла событий.
+
+generate_reports — долгая синхронная работа (чтение всей истории за период и запись
+xlsx). В хендлере она останавливала бы приём заказов у всех кассиров, поэтому
+отчёты строятся в пуле процессов из REPORT_WORKERS процессов: у каждого свой GIL
+и свои соединения с базой (в WAL чтение не мешает писателю бота).
+
+Одновременно в работе и в очереди не больше REPORT_QUEUE_MAX разных отчётов;
+сверх этого submit_report сразу отвечает ReportQueueFull. Одинаковые запросы
+(тот же период и те же отчёты), пока отчёт строится, получают один и тот же результат.
+
+Каждое построение пишет файлы в свою временную папку, так что одновременные
+запросы одного периода не перезаписывают файлы друг друга, а рабочая папка бота
+не копит старые отчёты. Готовые отчёты переносятся в report_cache с версией данных
+периода; пока данные периода не менялись, повторный запрос отдаёт файлы из кэша
+без пула. С выключенным кэшем файлы читаются в память, а папка сразу удаляется.
+
+Если задан CAFE_CLOSING_TIME, precompute_loop каждый вечер через
+REPORT_PRECOMPUTE_DELAY_MIN минут после закрытия строит все отчёты за закрывшийся
+рабочий день: утренние запросы «за вчера» отдаются из кэша сразу.
+
+Если рабочий процесс умер (нехватка памяти, сигнал), пул больше не принимает задачи:
+отчёты, которые в нём строились, завершаются ошибкой, а пул пересоздаётся при
+следующем запросе.
+
+С DB_BACKEND=memory данные живут только в процессе бота, поэтому отчёт строится
+в потоке, а не в отдельном процессе (так же при REPORT_WORKERS=0).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+
+import db_async
+import report_cache
+import timeutils
+from config import (
+    CAFE_CLOSING_TIME,
+    DB_BACKEND,
+    REPORT_PRECOMPUTE_DELAY_MIN,
+    REPORT_QUEUE_MAX,
+    REPORT_WORKERS,
+)
+from reports import REPORT_KINDS, generate_reports, normalize_period, period_name
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+class ReportQueueFull(Exception):
+    """В очереди уже REPORT_QUEUE_MAX отчётов."""
+
+
+_executor: Executor | None = None
+_start_lock = threading.Lock()
+# папки построений прошлого запуска удаляются один раз: пересозданный пул их не трогает
+_builds_cleared = False
+# (начало, конец) -> asyncio.Future с путями отчёта; только из цикла событий
+_pending: dict[tuple, asyncio.Future] = {}
+
+
+def _pool() -> Executor:
+    global _executor, _builds_cleared
+    if _executor is None:
+        with _start_lock:
+            if _executor is None:
+                if not _builds_cleared and report_cache.enabled() and report_cache.clear_builds():
+                    logger.info("Removed report build folders left from the previous run")
+                _builds_cleared = True
+                if REPORT_WORKERS > 0 and DB_BACKEND != "memory":
+                    # spawn: рабочий процесс не наследует потоки и открытые соединения бота
+                    _executor = ProcessPoolExecutor(
+                        max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                    )
+                    logger.info(f"Report pool started: {REPORT_WORKERS} processes, queue up to {REPORT_QUEUE_MAX}")
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report")
+                    logger.info(f"Reports run in a thread, queue up to {REPORT_QUEUE_MAX}")
+    return _executor
+
+
+def _discard_pool(pool: Executor):
+    """Убирает сломанный пул; следующий _pool() создаст новый."""
+    global _executor
+    with _start_lock:
+        if _executor is pool:
+            _executor = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _versions(start, end) -> dict[str, int]:
+    """Версии данных для ключей кэша: все отчёты зависят только от дней периода."""
+    version = await db_async.run_read(get_storage().data_version, start, end)
+    return dict.fromkeys(REPORT_KINDS, version)
+
+
+def _read(path: str | None) -> tuple[str, bytes] | None:
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return os.path.basename(path), f.read()
+
+
+async def _build(start, end, kinds, versions) -> dict:
+    loop = asyncio.get_running_loop()
+    # пул — до папки: при запуске он удаляет папки построений прошлого запуска
+    pool = _pool()
+    folder = report_cache.build_dir() if versions is not None else tempfile.mkdtemp(prefix="report_")
+    try:
+        try:
+            paths = await loop.run_in_executor(pool, generate_reports, start, end, kinds, folder)
+        except BrokenProcessPool:
+            logger.error(f"Report worker died while building {start}..{end}: restarting the report pool")
+            _discard_pool(pool)
+            raise
+        built = {kind: path for kind, path in zip(REPORT_KINDS, paths) if kind in kinds}
+        if versions is None:
+            return {kind: _read(path) for kind, path in built.items()}
+        # версии сняты до построения: если данные успели измениться, запись просто
+        # не совпадёт со следующей версией, устаревший отчёт из кэша не отдаётся
+        return report_cache.store(period_name(start, end), {kind: versions[kind] for kind in kinds}, built)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+async def submit_report(start=None, end=None, outputs=REPORT_KINDS):
+    """
+    Возвращает отчёты за период в порядке REPORT_KINDS, как generate_reports (None на
+    месте невыбранных): пути файлов в кэше или, если кэш выключен, (имя файла, байты) —
+    см. utils.report_input_file. Отчёты, чьи данные не менялись, берутся из кэша,
+    остальные строятся в пуле. Бросает ReportQueueFull, если очередь заполнена.
+    """
+    start, end = normalize_period(start, end)
+    kinds = tuple(kind for kind in REPORT_KINDS if kind in outputs)
+    result = {}
+    versions = None
+    if report_cache.enabled():
+        versions = await _versions(start, end)
+        result = report_cache.lookup(period_name(start, end), {kind: versions[kind] for kind in kinds})
+    missing = tuple(kind for kind in kinds if kind not in result)
+    if missing:
+        key = (start, end, missing)
+        future = _pending.get(key)
+        if future is None:
+            if len(_pending) >= max(1, REPORT_QUEUE_MAX):
+                raise ReportQueueFull()
+            future = asyncio.ensure_future(_build(start, end, missing, versions))
+            _pending[key] = future
+            future.add_done_callback(lambda _: _pending.pop(key, None))
+            logger.info(f"Report job {key} queued ({len(_pending)} in queue)")
+        # shield: отмена одного ожидающего не отменяет отчёт для остальных
+        result.update(await asyncio.shield(future))
+    return tuple(result.get(kind) for kind in REPORT_KINDS)
+
+
+def next_precompute(closing: timedelta, delay_min: float, after: datetime) -> tuple[datetime, date]:
+    """
+    Ближайший после after запуск ночной подготовки: (момент запуска, рабочий день).
+    День — тот, к которому относится последняя минута перед закрытием.
+    """
+    delay = timedelta(minutes=delay_min)
+    day = timeutils.localize(after).date() - timedelta(days=1)
+    while True:
+        closed_at = timeutils.localize(datetime.combine(day, datetime.min.time()) + closing)
+        if closed_at + delay > after:
+            return closed_at + delay, timeutils.business_day(closed_at - timedelta(seconds=1))
+        day += timedelta(days=1)
+
+
+async def precompute_loop(on_ready=None, closing_time: str = CAFE_CLOSING_TIME,
+                          delay_min: float = REPORT_PRECOMPUTE_DELAY_MIN):
+    """
+    Фоновая задача бота: после закрытия кафе строит все отчёты за закрывшийся рабочий
+    день через submit_report (в пул и в кэш). on_ready(день, отчёты) — что сделать с
+    готовыми отчётами (например, отправить в группу); без него отчёты только ждут в кэше.
+    Без CAFE_CLOSING_TIME ничего не делает.
+    """
+    closing = timeutils.parse_time_of_day(closing_time, "CAFE_CLOSING_TIME", None) if closing_time else None
+    if closing is None:
+        return
+    if not report_cache.enabled() and on_ready is None:
+        logger.warning("CAFE_CLOSING_TIME is set, but the report cache is off and nothing is posted: skipping")
+        return
+    run_at = timeutils.now()
+    while True:
+        run_at, day = next_precompute(closing, delay_min, run_at)
+        logger.info(f"Next report precompute for {day} at {run_at:%Y-%m-%d %H:%M}")
+        await asyncio.sleep(max(0.0, (run_at - timeutils.now()).total_seconds()))
+        t0 = time.perf_counter()
+        try:
+            built = await submit_report(day, day)
+        except ReportQueueFull:
+            logger.warning(f"Report precompute for {day} skipped: queue is full")
+            continue
+        except Exception:
+            logger.exception(f"Report precompute for {day} failed")
+            continue
+        logger.info(f"Reports for {day} precomputed in {time.perf_counter() - t0:.2f} s")
+        if on_ready is not None:
+            try:
+                await on_ready(day, built)
+            except Exception:
+                logger.exception(f"Posting precomputed reports for {day} failed")
+
+
+def shutdown():
+    """Дожидается начатых отчётов и останавливает пул (при остановке бота)."""
+    global _executor
+    with _start_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
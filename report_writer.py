@@ -0,0 +1,123 @@
+"""
+Потоковая запись xlsx-отчётов.
+
+Строки пишутся через xlsxwriter в режиме constant_memory: каждая строка сразу
+уходит во временный файл листа, в памяти держится только текущая. Поэтому отчёт
+за всё время занимает столько же памяти, сколько отчёт за день. Ширина колонок
+считается по ходу записи (максимум длины текста в колонке) и выставляется перед
+закрытием книги — перечитывать готовый файл не нужно. На очень больших листах
+ширину можно оценивать по выборке строк (REPORT_WIDTH_SAMPLE_STEP > 1).
+
+На листе Excel не больше 1 048 576 строк. Когда лист заполняется (или доходит до
+REPORT_SHEET_MAX_ROWS), строки продолжаются на следующем листе «Имя (2)», «Имя (3)»…
+с тем же заголовком, поэтому выгрузка за всё время не падает на больших базах.
+"""
+
+import xlsxwriter
+
+import config
+
+# Excel не даёт колонке быть шире 255 символов
+MAX_COLUMN_WIDTH = 255
+COLUMN_PADDING = 2
+# строк на листе Excel, вместе с заголовком
+EXCEL_MAX_ROWS = 1_048_576
+# длина имени листа в Excel
+MAX_SHEET_NAME = 31
+
+
+def _text_len(value) -> int:
+    return 0 if value is None else len(str(value))
+
+
+class Sheet:
+    """
+    Лист с заголовком; строки добавляются по одной сверху вниз.
+    Ширина меряется по всем строкам до exact_rows, дальше — по каждой sample_step-й
+    (и по строкам, добавленным с measure=True, например итоговым).
+    Больше max_rows строк (с заголовком) на одном листе не пишется — дальше следующий лист.
+    """
+
+    def __init__(self, workbook, name: str, columns, header_format, *, exact_rows: int, sample_step: int,
+                 max_rows: int):
+        self._wb = workbook
+        self._name = name
+        self._columns = columns
+        self._header = header_format
+        self._parts = []
+        self._part_rows = 0
+        self._max_rows = max(2, min(max_rows, EXCEL_MAX_ROWS))
+        self.rows = 0
+        self._widths = [_text_len(c) for c in columns]
+        self._exact_rows = exact_rows
+        self._sample_step = max(1, sample_step)
+        self._new_part()
+
+    def _new_part(self):
+        suffix = f" ({len(self._parts) + 1})" if self._parts else ""
+        self._ws = self._wb.add_worksheet(self._name[: MAX_SHEET_NAME - len(suffix)] + suffix)
+        self._ws.write_row(0, 0, self._columns, self._header)
+        self._parts.append(self._ws)
+        self._part_rows = 0
+
+    def append(self, values, *, measure: bool = False):
+        if self._part_rows + 1 >= self._max_rows:
+            self._new_part()
+        self.rows += 1
+        self._part_rows += 1
+        # None пишется пустой ячейкой, bool — логическим значением, числа — числами
+        self._ws.write_row(self._part_rows, 0, values)
+        if not (measure or self.rows <= self._exact_rows or self.rows % self._sample_step == 0):
+            return
+        self._widths = list(map(max, self._widths, map(_text_len, values)))
+
+    def finish(self):
+        for ws in self._parts:
+            for i, width in enumerate(self._widths):
+                ws.set_column(i, i, min(width + COLUMN_PADDING, MAX_COLUMN_WIDTH))
+
+
+class ReportWorkbook:
+    """Книга xlsx, которая пишется потоком; листы создаются в порядке вызова sheet()."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        exact_rows: int | None = None,
+        sample_step: int | None = None,
+        max_rows: int | None = None,
+    ):
+        self.path = path
+        self._exact_rows = config.REPORT_WIDTH_EXACT_ROWS if exact_rows is None else exact_rows
+        self._sample_step = config.REPORT_WIDTH_SAMPLE_STEP if sample_step is None else sample_step
+        self._max_rows = config.REPORT_SHEET_MAX_ROWS if max_rows is None else max_rows
+        self._wb = xlsxwriter.Workbook(
+            path,
+            {
+                "constant_memory": True,
+                # текст заказов пишется как есть: не формулы и не ссылки
+                "strings_to_formulas": False,
+                "strings_to_urls": False,
+            },
+        )
+        self._header = self._wb.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        self._sheets: list[Sheet] = []
+
+    def sheet(self, name: str, columns) -> Sheet:
+        sheet = Sheet(
+            self._wb,
+            name,
+            columns,
+            self._header,
+            exact_rows=self._exact_rows,
+            sample_step=self._sample_step,
+            max_rows=self._max_rows,
+        )
+        self._sheets.append(sheet)
+        return sheet
+
+    def close(self):
+        for sheet in self._sheets:
+            sheet.finish()
+        self._wb.close()
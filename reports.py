@@ -1,280 +1,293 @@
-import pandas as pd
-from openpyxl.utils import get_column_letter
-from openpyxl import load_workbook
-from db import get_connection
+from storage import get_storage
+from report_writer import ReportWorkbook
 from datetime import datetime
-import json
+from pathlib import Path
+import timeutils
 
+# Виды отчётов: обычные заказы, заказы сотрудников, журнал действий
+REPORT_KINDS = ("report", "staff", "log")
 
-def auto_adjust_columns(file_path):
-    wb = load_workbook(file_path)
-    for sheet in wb.worksheets:
-        for column_cells in sheet.columns:
-            max_length = max(len(str(cell.value or "")) for cell in column_cells)
-            letter = get_column_letter(column_cells[0].column)
-            sheet.column_dimensions[letter].width = max_length + 2
-    wb.save(file_path)
+# Колонки листов отчётов
+ORDER_COLUMNS = [
+    "Дата",
+    "Автор",
+    "Тип оплаты",
+    "Название",
+    "Количество",
+    "Базовая цена",
+    "Добавки",
+    "Сумма добавок",
+    "Сумма позиции",
+    "Запрос",
+    "Сотрудник",
+]
+GROUPED_COLUMNS = ["Тип оплаты", "Название", "Количество", "Общая_сумма"]
+PERIOD_COLUMNS = ["Период", "Заказов", "Количество", "Общая_сумма"]
+AUTHOR_COLUMNS = ["Автор", "Количество", "Общая_сумма"]
+ADDON_COLUMNS = ["Название", "Добавки", "Количество", "Общая_сумма"]
+# Листы итогов по периодам: гранулярность -> имя листа
+PERIOD_SHEETS = {
+    "hour": "По часам",
+    "day": "По дням",
+    "week": "По неделям",
+    "month": "По месяцам",
+}
+ACTION_COLUMNS = [
+    "Дата/время",
+    "Действие",
+    "Тип оплаты",
+    "Название",
+    "Кол-во",
+    "user_id",
+    "username",
+    "Сотрудник",
+]
 
 
-def generate_reports(start_date=None, end_date=None):
-    conn = get_connection()
+def _order_row(line) -> tuple:
+    """Кортеж storage.ORDER_LINE_FIELDS -> строка листа по ORDER_COLUMNS."""
+    (_, date, username, is_staff, payment_type, item_name, quantity,
+     base_price, addons_text, addons_total, row_total, raw_text, _) = line
+    return (
+        date,
+        username,
+        payment_type,
+        item_name,
+        quantity,
+        base_price,
+        addons_text,
+        addons_total,
+        row_total,
+        raw_text,
+        1 if is_staff else 0,
+    )
 
-    # 0) Приведение строк к datetime
-    if isinstance(start_date, str):
-        start_date = datetime.fromisoformat(start_date)
-    if isinstance(end_date, str):
-        end_date = datetime.fromisoformat(end_date)
 
-    # 1) Фильтр периода
-    date_filter = ""
-    params = []
-    if start_date and end_date:
-        date_filter = "WHERE date(o.date) BETWEEN ? AND ?"
-        params = [start_date.isoformat(), end_date.isoformat()]
+def _total_row(payment_type, quantity, total) -> tuple:
+    return (None, None, payment_type, "ИТОГО", quantity, None, None, None, total, None, None)
 
-    # 2) Читаем данные, включая признак сотрудника
-    orders_df = pd.read_sql_query(
-        f"""
-        SELECT 
-          o.id            AS order_id,
-          o.date          AS date,
-          o.username      AS username,
-          o.is_staff      AS is_staff,
-          i.payment_type  AS payment_type,
-          i.item_name     AS item_name,
-          i.price         AS base_price,
-          i.addons_json   AS addons_json,
-          i.addons_total  AS addons_total,
-          i.row_total     AS row_total,
-          o.raw_text      AS raw_text
-        FROM orders o
-        JOIN order_items i ON i.order_id = o.id
-        {date_filter}
-        ORDER BY o.date
-        """,
-        conn,
-        params=params,
-    )
 
-    actions_df = pd.read_sql_query(
-        "SELECT timestamp, action_type, payment_type, item_name, user_id, username, is_staff FROM actions_log",
-        conn,
-    )
-    conn.close()
+class _OrdersReport:
+    """
+    Отчёт по позициям, который заполняется одним проходом по строкам периода:
+    «Все позиции», лист на каждый тип оплаты, затем сводные листы из сводки продаж.
+    Итоги и лист «По добавкам» (позиции с одинаковым набором добавок — по addons_key,
+    без учёта порядка и цен) считаются по ходу записи.
+    """
 
-    if orders_df.empty:
-        orders_df["is_staff"] = pd.Series(dtype=int)
-    else:
-        orders_df["is_staff"] = orders_df["is_staff"].fillna(0).astype(int)
+    def __init__(self, path: str, rollup):
+        self.path = path
+        self._grouped, self._by_author, (self._granularity, self._periods) = rollup
+        self._book = ReportWorkbook(path)
+        self._all = self._book.sheet("Все позиции", ORDER_COLUMNS)
+        self._totals = {}  # лист -> [штук, сумма]
+        self._addons = {}  # (название, addons_key) -> [подпись добавок, штук, сумма]
+        # листы типов оплаты — по алфавиту; типы известны из сводки периода
+        self._by_payment = {}
+        for payment_type in sorted({row[0] for row in self._grouped if row[0]}, key=lambda s: str(s).lower()):
+            self._payment_sheet(payment_type)
 
-    def _fmt_addons(raw):
-        try:
-            arr = json.loads(raw) if raw else []
-        except Exception:
-            return ""
-        if not arr:
-            return ""
-        return ", ".join(f"{a.get('name','')} ({int(a.get('price',0))}₽)" for a in arr)
+    def _payment_sheet(self, payment_type):
+        key = str(payment_type).lower()
+        if key not in self._by_payment:
+            name = str(payment_type).capitalize()
+            self._by_payment[key] = (name, self._book.sheet(name, ORDER_COLUMNS))
+        return self._by_payment[key]
+
+    def add(self, line):
+        row = _order_row(line)
+        if line[12]:
+            acc = self._addons.setdefault((row[3], line[12]), [row[6], 0, 0])
+            acc[1] += row[4] or 0
+            acc[2] += row[8] or 0
+        targets = [self._all]
+        if row[2]:
+            # строки, которых нет в сводке (например, она ещё не пересчитана), получат лист в конце
+            targets.append(self._payment_sheet(row[2])[1])
+        for sheet in targets:
+            sheet.append(row)
+            totals = self._totals.setdefault(sheet, [0, 0])
+            totals[0] += row[4] or 0
+            totals[1] += row[8] or 0
 
-    def _prepare_orders_df(df: pd.DataFrame) -> pd.DataFrame:
-        if df.empty:
-            return pd.DataFrame(
-                columns=[
-                    "Дата",
-                    "Автор",
-                    "Тип оплаты",
-                    "Название",
-                    "Базовая цена",
-                    "Добавки",
-                    "Сумма добавок",
-                    "Сумма позиции",
-                    "Запрос",
-                    "Сотрудник",
-                ]
+    def close(self):
+        for name, sheet in [("", self._all), *self._by_payment.values()]:
+            if sheet.rows:
+                quantity, total = self._totals[sheet]
+                sheet.append(_total_row(name or None, quantity, total), measure=True)
+
+        # сводные листы — из daily_sales, без группировки сырых строк
+        grouped = self._book.sheet("Группировка", GROUPED_COLUMNS)
+        for row in self._grouped:
+            grouped.append(tuple(row))
+        if self._grouped:
+            grouped.append(
+                (None, "ИТОГО", sum(r[2] for r in self._grouped), sum(r[3] for r in self._grouped)),
+                measure=True,
             )
+        if self._by_author:
+            by_author = self._book.sheet("По авторам", AUTHOR_COLUMNS)
+            for row in self._by_author:
+                by_author.append(tuple(row))
+        if self._addons:
+            by_addons = self._book.sheet("По добавкам", ADDON_COLUMNS)
+            rows = sorted(self._addons.items(), key=lambda kv: (-kv[1][1], str(kv[0][0]).lower(), kv[0][1]))
+            for (item_name, _), (label, quantity, total) in rows:
+                by_addons.append((item_name, label, quantity, total))
+        if self._periods:
+            periods = self._book.sheet(PERIOD_SHEETS[self._granularity], PERIOD_COLUMNS)
+            for row in self._periods:
+                periods.append(tuple(row))
+        self._book.close()
 
-        df = df.copy()
-        df["addons_text"] = df["addons_json"].apply(_fmt_addons)
-        rename_map = {
-            "date": "Дата",
-            "username": "Автор",
-            "payment_type": "Тип оплаты",
-            "item_name": "Название",
-            "base_price": "Базовая цена",
-            "addons_text": "Добавки",
-            "addons_total": "Сумма добавок",
-            "row_total": "Сумма позиции",
-            "raw_text": "Запрос",
-            "is_staff": "Сотрудник",
-        }
-        df = df.rename(columns=rename_map)
-        desired_cols = [
-            "Дата",
-            "Автор",
-            "Тип оплаты",
-            "Название",
-            "Базовая цена",
-            "Добавки",
-            "Сумма добавок",
-            "Сумма позиции",
-            "Запрос",
-            "Сотрудник",
-        ]
-        existing_cols = [c for c in desired_cols if c in df.columns]
-        return df[existing_cols]
 
-    def _write_report(df_prepared: pd.DataFrame, path: str):
-        with pd.ExcelWriter(path, engine="openpyxl") as writer:
-            df_all = df_prepared.copy()
-            total_all = df_all["Сумма позиции"].sum() if "Сумма позиции" in df_all else 0
-            if not df_all.empty:
-                df_all = pd.concat(
-                    [
-                        df_all,
-                        pd.DataFrame(
-                            [
-                                {
-                                    "Дата": "",
-                                    "Автор": "",
-                                    "Тип оплаты": "",
-                                    "Название": "ИТОГО",
-                                    "Базовая цена": "",
-                                    "Добавки": "",
-                                    "Сумма добавок": "",
-                                    "Сумма позиции": total_all,
-                                    "Запрос": "",
-                                    "Сотрудник": "",
-                                }
-                            ]
-                        ),
-                    ],
-                    ignore_index=True,
-                )
-            df_all.to_excel(writer, sheet_name="Все позиции", index=False)
+def normalize_period(start_date=None, end_date=None):
+    """Строки и datetime -> рабочие дни; неполный период — всё время (None, None)."""
+    if isinstance(start_date, str):
+        start_date = datetime.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        end_date = datetime.fromisoformat(end_date)
+    if isinstance(start_date, datetime):
+        start_date = timeutils.business_day(start_date)
+    if isinstance(end_date, datetime):
+        end_date = timeutils.business_day(end_date)
+    if not (start_date and end_date):
+        start_date = end_date = None
+    return start_date, end_date
 
-            if not df_prepared.empty and "Тип оплаты" in df_prepared:
-                for pt in sorted(
-                    df_prepared["Тип оплаты"].dropna().unique(), key=lambda s: str(s).lower()
-                ):
-                    mask = (
-                        df_prepared["Тип оплаты"].astype(str).str.lower()
-                        == str(pt).lower()
-                    )
-                    df_pt = df_prepared[mask].copy()
-                    sheet = str(pt).capitalize()
 
-                    total_pt = (
-                        df_pt["Сумма позиции"].sum() if "Сумма позиции" in df_pt else 0
-                    )
-                    if not df_pt.empty:
-                        df_pt = pd.concat(
-                            [
-                                df_pt,
-                                pd.DataFrame(
-                                    [
-                                    {
-                                        "Дата": "",
-                                        "Автор": "",
-                                        "Тип оплаты": sheet,
-                                        "Название": "ИТОГО",
-                                        "Базовая цена": "",
-                                        "Добавки": "",
-                                        "Сумма добавок": "",
-                                        "Сумма позиции": total_pt,
-                                        "Запрос": "",
-                                        "Сотрудник": "",
-                                    }
-                                ]
-                            ),
-                        ],
-                        ignore_index=True,
-                        )
-                    df_pt.to_excel(writer, sheet_name=sheet, index=False)
+def period_name(start_date=None, end_date=None) -> str:
+    """Период в именах файлов отчётов: день, «начало__конец» или all."""
+    start_date, end_date = normalize_period(start_date, end_date)
+    if start_date and end_date:
+        return (
+            start_date.isoformat()
+            if start_date == end_date
+            else f"{start_date.isoformat()}__{end_date.isoformat()}"
+        )
+    return "all"
 
-            if not df_prepared.empty:
-                grouped = (
-                    df_prepared.groupby(["Тип оплаты", "Название"], dropna=False)
-                    .agg(
-                        Количество=("Сумма позиции", "size"),
-                        Общая_сумма=("Сумма позиции", "sum"),
-                    )
-                    .reset_index()
-                )
-            else:
-                grouped = pd.DataFrame(
-                    columns=["Тип оплаты", "Название", "Количество", "Общая_сумма"]
-                )
 
-            if not grouped.empty:
-                grouped_total = pd.DataFrame(
-                    [
-                        [
-                            "",
-                            "ИТОГО",
-                            grouped["Количество"].sum(),
-                            grouped["Общая_сумма"].sum(),
-                        ]
-                    ],
-                    columns=["Тип оплаты", "Название", "Количество", "Общая_сумма"],
-                )
-                grouped = pd.concat([grouped, grouped_total], ignore_index=True)
+def pick_granularity(start_date=None, end_date=None) -> str:
+    """Шаг листа итогов по периодам: день — по часам, до двух месяцев — по дням, дальше — по месяцам."""
+    start_date, end_date = normalize_period(start_date, end_date)
+    if start_date is None:
+        return "month"
+    days = (end_date - start_date).days + 1
+    if days <= 1:
+        return "hour"
+    return "day" if days <= 62 else "month"
 
-            grouped.to_excel(writer, sheet_name="Группировка", index=False)
 
-            if not df_prepared.empty and "Автор" in df_prepared:
-                by_author = (
-                    df_prepared.groupby(["Автор"], dropna=False)
-                    .agg(
-                        Количество=("Сумма позиции", "size"),
-                        Общая_сумма=("Сумма позиции", "sum"),
-                    )
-                    .reset_index()
-                    .sort_values(["Общая_сумма"], ascending=False)
-                )
-                by_author.to_excel(writer, sheet_name="По авторам", index=False)
+def period_totals(start_date=None, end_date=None, granularity=None, *, is_staff=None) -> list[tuple]:
+    """
+    Итоги периода с шагом granularity (hour, day, week, month; по умолчанию — pick_granularity):
+    [(период, заказов, штук, сумма), ...]. Считаются в базе по почасовой сводке,
+    сырые позиции не читаются.
+    """
+    start_date, end_date = normalize_period(start_date, end_date)
+    granularity = granularity or pick_granularity(start_date, end_date)
+    return get_storage().period_totals(granularity, start_date, end_date, is_staff)
 
-        auto_adjust_columns(path)
 
-    orders_regular = orders_df[orders_df["is_staff"] == 0].copy()
-    orders_staff = orders_df[orders_df["is_staff"] == 1].copy()
+def sales_digest(start_date=None, end_date=None, *, top: int = 5) -> dict:
+    """
+    Короткая сводка продаж за период для ответа в чате, без построения файлов:
+    заказы, штуки и сумма всего и отдельно по обычным заказам и сотрудникам,
+    суммы по типам оплаты и top самых продаваемых позиций. Всё считается по
+    сводкам daily_sales и hourly_orders, сырые позиции не читаются.
+    """
+    store = get_storage()
+    start_date, end_date = normalize_period(start_date, end_date)
+    groups = {}
+    payments = {}
+    items = {}
+    for staff in (False, True):
+        orders = sum(row[1] for row in store.period_totals("month", start_date, end_date, staff))
+        quantity = total = 0
+        for payment_type, item_name, q, t in store.sales_summary(staff, start_date, end_date):
+            quantity += q
+            total += t
+            acc = payments.setdefault(payment_type or "—", [0, 0])
+            acc[0] += q
+            acc[1] += t
+            acc = items.setdefault(item_name, [0, 0])
+            acc[0] += q
+            acc[1] += t
+        groups["staff" if staff else "regular"] = {"orders": orders, "quantity": quantity, "total": total}
+    return {
+        "start": start_date,
+        "end": end_date,
+        "orders": sum(g["orders"] for g in groups.values()),
+        "quantity": sum(g["quantity"] for g in groups.values()),
+        "total": sum(g["total"] for g in groups.values()),
+        **groups,
+        # по убыванию выручки / штук; при равенстве — по алфавиту
+        "payments": sorted(((p, q, t) for p, (q, t) in payments.items()), key=lambda r: (-r[2], str(r[0]).lower())),
+        "top_items": sorted(((i, q, t) for i, (q, t) in items.items()), key=lambda r: (-r[1], -r[2], str(r[0]).lower()))[:top],
+    }
 
-    prepared_regular = _prepare_orders_df(orders_regular)
-    prepared_staff = _prepare_orders_df(orders_staff)
 
-    if start_date and end_date:
-        period_str = (
-            start_date.isoformat()
-            if start_date == end_date
-            else f"{start_date.isoformat()}__{end_date.isoformat()}"
-        )
-    else:
-        period_str = "all"
+def generate_reports(start_date=None, end_date=None, outputs=REPORT_KINDS, folder="."):
+    """
+    Строит выбранные отчёты за период (outputs — виды из REPORT_KINDS) в папке folder
+    и возвращает пути в порядке REPORT_KINDS: (обычные заказы, заказы сотрудников, журнал действий).
+    Имена файлов зависят только от периода, поэтому у параллельных построений
+    папки должны быть разными (report_jobs даёт каждому свою временную).
+    На месте невыбранных — None; у staff None ещё и когда заказов сотрудников нет.
+    Сводные листы считаются запросами к сводкам; сырые позиции читаются только
+    для листов позиций выбранных книг.
+    """
+    store = get_storage()
 
-    report_path = f"report_{period_str}.xlsx"
-    staff_report_path = (
-        f"report_staff_{period_str}.xlsx" if not orders_staff.empty else None
-    )
-    log_path = f"log_report_{period_str}.xlsx"
+    # 0) Приведение строк и datetime к рабочим дням
+    start_date, end_date = normalize_period(start_date, end_date)
+    period_str = period_name(start_date, end_date)
 
-    _write_report(prepared_regular, report_path)
-    if staff_report_path:
-        _write_report(prepared_staff, staff_report_path)
+    folder = Path(folder)
+    report_path = str(folder / f"report_{period_str}.xlsx") if "report" in outputs else None
+    staff_report_path = str(folder / f"report_staff_{period_str}.xlsx") if "staff" in outputs else None
+    log_path = str(folder / f"log_report_{period_str}.xlsx") if "log" in outputs else None
 
-    # 7) Лог действий
-    actions_df.columns = [
-        "Дата/время",
-        "Действие",
-        "Тип оплаты",
-        "Название",
-        "user_id",
-        "username",
-        "Сотрудник",
-    ]
-    actions_df["Сотрудник"] = actions_df["Сотрудник"].apply(lambda v: bool(v))
+    # 1) Сводки периода — только для выбранных книг
+    paths = {False: report_path, True: staff_report_path}
+    granularity = pick_granularity(start_date, end_date)
+    rollups = {
+        staff: (
+            store.sales_summary(staff, start_date, end_date),
+            store.author_summary(staff, start_date, end_date),
+            (granularity, store.period_totals(granularity, start_date, end_date, staff)),
+        )
+        for staff, path in paths.items()
+        if path
+    }
 
-    with pd.ExcelWriter(log_path, engine="openpyxl") as writer:
-        actions_df.to_excel(writer, sheet_name="Журнал действий", index=False)
+    # 2) Позиции периода — одним проходом сразу в выбранные книги; если книга одна,
+    # позиции другого вида не читаются. Книга сотрудников появляется только с первой их позицией
+    if rollups:
+        only = None if len(rollups) == 2 else next(iter(rollups))
+        books = {False: _OrdersReport(report_path, rollups[False]) if report_path else None, True: None}
+        try:
+            for line in store.order_lines(start_date, end_date, only):
+                staff = bool(line[3])
+                if books[staff] is None:
+                    books[staff] = _OrdersReport(staff_report_path, rollups[staff])
+                books[staff].add(line)
+        finally:
+            for book in books.values():
+                if book is not None:
+                    book.close()
+        if books[True] is None:
+            staff_report_path = None
 
-    auto_adjust_columns(log_path)
+    # 3) Лог действий
+    if log_path:
+        log_book = ReportWorkbook(log_path)
+        try:
+            sheet = log_book.sheet("Журнал действий", ACTION_COLUMNS)
+            for row in store.action_lines(start_date, end_date):
+                sheet.append(row[:7] + (bool(row[7]),))
+        finally:
+            log_book.close()
 
     return report_path, staff_report_path, log_path
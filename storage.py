@@ -0,0 +1,576 @@
+"""
+Хранилище заказов: общий интерфейс и две реализации.
+
+SqliteStorage — рабочая база (db.py) вместе с помесячными архивами (archive.py).
+MemoryStorage — всё в словарях с индексами, без диска: на нём бенчмарки хендлеров
+и отчётов гоняют миллионы синтетических заказов, а SQLite профилируется на той же нагрузке.
+
+Бэкенд выбирается настройкой DB_BACKEND ("sqlite" или "memory"), общий экземпляр
+возвращает get_storage(). Операции записи принимают те же аргументы, что и
+db._write_* (без conn); по имени их же принимает write_batch() — через него
+идёт групповой коммит db_async.
+"""
+
+import json as _json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import archive
+import db
+import timeutils
+from config import DB_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# поля строк order_lines() и action_lines()
+ORDER_LINE_FIELDS = (
+    "order_id",
+    "date",
+    "username",
+    "is_staff",
+    "payment_type",
+    "item_name",
+    "quantity",
+    "base_price",
+    "addons_text",
+    "addons_total",
+    "row_total",
+    "raw_text",
+    "addons_key",
+)
+ACTION_LINE_FIELDS = (
+    "timestamp",
+    "action_type",
+    "payment_type",
+    "item_name",
+    "quantity",
+    "user_id",
+    "username",
+    "is_staff",
+)
+
+
+# строк за одно чтение курсора в выгрузках для отчётов
+REPORT_CHUNK_ROWS = 5000
+
+
+def _chunks(cursor):
+    while rows := cursor.fetchmany(REPORT_CHUNK_ROWS):
+        yield rows
+
+
+def _ts_range(start: date | None, end: date | None) -> tuple[int, int] | None:
+    """Рабочие дни [start, end] -> полуинтервал epoch-секунд."""
+    if start is None or end is None:
+        return None
+    return (
+        timeutils.to_epoch(timeutils.business_day_bounds(start)[0]),
+        timeutils.to_epoch(timeutils.business_day_bounds(end)[1]),
+    )
+
+
+# гранулярности period_totals
+GRANULARITIES = ("hour", "day", "week", "month")
+
+
+def _period_label(granularity: str, day: int, hour: int) -> str:
+    d = timeutils.key_to_date(day)
+    if granularity == "hour":
+        # час отсчитан от полуночи рабочего дня: 24 и больше — уже следующая дата
+        return f"{datetime.combine(d, datetime.min.time()) + timedelta(hours=hour):%Y-%m-%d %H}:00"
+    if granularity == "day":
+        return d.isoformat()
+    if granularity == "week":
+        return (d - timedelta(days=d.weekday())).isoformat()
+    return f"{d:%Y-%m}"
+
+
+def _fold_periods(granularity: str, rows) -> list[tuple]:
+    """(ключ дня, час, заказов, штук, сумма) по возрастанию -> [(период, заказов, штук, сумма), ...]."""
+    grouped: dict[str, list[int]] = {}
+    for day, hour, *values in rows:
+        acc = grouped.setdefault(_period_label(granularity, day, hour), [0, 0, 0])
+        for i, value in enumerate(values):
+            acc[i] += value
+    # (день, час от полуночи дня) по возрастанию — это и есть порядок времени
+    return [(label, *values) for label, values in grouped.items() if values[0] > 0]
+
+
+def _days(start: date | None, end: date | None) -> tuple[int, int] | None:
+    if start is None or end is None:
+        return None
+    return timeutils.day_key(start), timeutils.day_key(end)
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища. Периоды задаются рабочими днями [start, end] включительно,
+    None — без ограничения. Бэкенд без какого-либо из абстрактных методов не создастся.
+    """
+
+    # операции записи, которые можно передавать в write_batch() по имени
+    WRITE_OPS = ("add_order", "log_action", "delete_order", "delete_orders_in_range")
+
+    def init(self):
+        """Готовит хранилище к работе (для SQLite — миграции)."""
+
+    def close(self):
+        """Освобождает ресурсы (при остановке бота)."""
+
+    @abstractmethod
+    def write_batch(self, jobs: list[tuple]) -> list[tuple[bool, object]]:
+        """
+        Выполняет задания (имя операции, args, kwargs) одной пачкой; ошибка одного
+        задания не отменяет остальные. Возвращает [(успех, результат или исключение), ...].
+        """
+
+    # ---------- запись ----------
+
+    @abstractmethod
+    def add_order(self, items: list[dict], user_id: int, username: str, raw_text: str, *, is_staff: bool = False) -> int:
+        ...
+
+    @abstractmethod
+    def log_action(self, action_type, payment_type, item_name, user_id, username, *, is_staff=False, quantity=1):
+        ...
+
+    @abstractmethod
+    def delete_order(self, order_id: int, user_id: int, username: str) -> list[dict]:
+        ...
+
+    @abstractmethod
+    def delete_orders_in_range(self, user_id: int, start: datetime, end: datetime, username: str = "") -> list[dict]:
+        ...
+
+    # ---------- чтение ----------
+
+    @abstractmethod
+    def get_user_orders_page(
+        self, user_id: int, limit: int, after: tuple[int, int] | None = None
+    ) -> tuple[list[dict], bool]:
+        """Страница заказов пользователя, новые сверху; формат — как у db.get_user_orders_page."""
+
+    @abstractmethod
+    def order_lines(self, start: date | None = None, end: date | None = None, is_staff: bool | None = None):
+        """
+        Позиции заказов периода в порядке времени, кортежи по ORDER_LINE_FIELDS.
+        is_staff — только заказы сотрудников или только обычные (None — все).
+        """
+
+    @abstractmethod
+    def action_lines(self, start: date | None = None, end: date | None = None):
+        """Журнал действий за рабочие дни периода в порядке времени, кортежи по ACTION_LINE_FIELDS."""
+
+    @abstractmethod
+    def sales_summary(self, is_staff: bool, start: date | None = None, end: date | None = None) -> list[tuple]:
+        """[(тип оплаты, название, штук, сумма), ...] по типу оплаты и названию."""
+
+    @abstractmethod
+    def author_summary(self, is_staff: bool, start: date | None = None, end: date | None = None) -> list[tuple]:
+        """[(автор, штук, сумма), ...], крупные сверху."""
+
+    @abstractmethod
+    def period_totals(
+        self, granularity: str, start: date | None = None, end: date | None = None, is_staff: bool | None = None
+    ) -> list[tuple]:
+        """
+        [(период, заказов, штук, сумма), ...] по часам, дням, неделям или месяцам
+        (GRANULARITIES) по возрастанию. Период — «ГГГГ-ММ-ДД ЧЧ:00», «ГГГГ-ММ-ДД»,
+        понедельник недели «ГГГГ-ММ-ДД» или «ГГГГ-ММ». Час подписан настоящей календарной
+        датой (при BUSINESS_DAY_START=04:00 ночь рабочего дня 17-го — «18-е 01:00»),
+        дни, недели и месяцы — рабочие.
+        """
+
+    @abstractmethod
+    def data_version(self, start: date | None = None, end: date | None = None) -> int:
+        """Версия данных периода (без дат — всей истории); меняется при любой записи или удалении в его днях."""
+
+
+class SqliteStorage(Storage):
+    """SQLite-файл db.DB_PATH; детальные выборки за прошлые месяцы читают и архивы."""
+
+    _WRITERS = {
+        "add_order": db._write_order,
+        "log_action": db._write_action,
+        "delete_order": db._write_delete_order,
+        "delete_orders_in_range": db._write_delete_orders_in_range,
+    }
+
+    def __init__(self, path: str | None = None):
+        # db держит один путь на процесс
+        if path is not None:
+            db.DB_PATH = path
+
+    def init(self):
+        db.init_db()
+        archive.upgrade_archives()
+
+    def close(self):
+        db.close_connections()
+
+    def write_batch(self, jobs):
+        return db.write_batch([(self._WRITERS[name], args, kwargs) for name, args, kwargs in jobs])
+
+    def _write(self, name: str, *args, **kwargs):
+        with db.transaction() as conn:
+            return self._WRITERS[name](conn, *args, **kwargs)
+
+    def add_order(self, items, user_id, username, raw_text, *, is_staff=False):
+        return self._write("add_order", items, user_id, username, raw_text, is_staff=is_staff)
+
+    def log_action(self, action_type, payment_type, item_name, user_id, username, *, is_staff=False, quantity=1):
+        self._write(
+            "log_action", action_type, payment_type, item_name, user_id, username, is_staff=is_staff, quantity=quantity
+        )
+
+    def delete_order(self, order_id, user_id, username):
+        return self._write("delete_order", order_id, user_id, username)
+
+    def delete_orders_in_range(self, user_id, start, end, username=""):
+        return self._write("delete_orders_in_range", user_id, start, end, username)
+
+    def get_user_orders_page(self, user_id, limit, after=None):
+        return db.get_user_orders_page(user_id, limit, after)
+
+    def order_lines(self, start=None, end=None, is_staff=None):
+        items, payments = db.names("menu_items"), db.names("payment_types")
+        days = _days(start, end)
+        for schema in archive.sources(start, end):
+            for rows in _chunks(db.report_lines(schema, days, is_staff)):
+                # названия — только на выходе, строки базы несут id
+                for row in rows:
+                    addons_text, key = row[8], row[12]
+                    if addons_text is None or key is None:
+                        # позиции архивов, созданных до подписей и ключей добавок
+                        addons = db.addons_from_json(row[13])
+                        addons_text, key = db.addons_label(addons), db.addons_key(addons)
+                    yield (
+                        row[:4] + (payments.get(row[4]), items.get(row[5])) + row[6:8]
+                        + (addons_text,) + row[9:12] + (key,)
+                    )
+
+    def action_lines(self, start=None, end=None):
+        items, payments = db.names("menu_items"), db.names("payment_types")
+        ts_range = _ts_range(start, end)
+        for schema in archive.sources(start, end):
+            for rows in _chunks(db.report_actions(schema, ts_range)):
+                for row in rows:
+                    yield row[:2] + (payments.get(row[2]), items.get(row[3])) + row[4:]
+
+    def sales_summary(self, is_staff, start=None, end=None):
+        return db.sales_summary(is_staff, _days(start, end))
+
+    def author_summary(self, is_staff, start=None, end=None):
+        return db.author_summary(is_staff, _days(start, end))
+
+    def period_totals(self, granularity, start=None, end=None, is_staff=None):
+        if granularity not in GRANULARITIES:
+            raise KeyError(granularity)
+        rows = db.order_totals(_days(start, end), is_staff, by_hour=granularity == "hour")
+        return _fold_periods(granularity, rows)
+
+    def data_version(self, start=None, end=None):
+        return db.data_version(_days(start, end))
+
+
+class MemoryStorage(Storage):
+    """
+    Заказы в словарях: по id, по пользователю ((ts, id) по возрастанию) и по рабочему дню,
+    плюс сводка продаж по дням, как daily_sales. Один RLock: писатель один, читатели
+    получают копии. Ничего не сохраняется между запусками.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._next_id = 1
+        self._orders: dict[int, dict] = {}
+        self._items: dict[int, list[dict]] = {}
+        self._by_user: dict[int, list[tuple[int, int]]] = defaultdict(list)
+        self._by_day: dict[int, list[int]] = defaultdict(list)
+        self._day_keys: list[int] = []  # ключи _by_day по возрастанию
+        # (timestamp, action_type, payment_type, item_name, quantity, user_id, username, is_staff, ts, day)
+        self._actions: list[tuple] = []
+        # (day, is_staff, payment_type, item_name, author) -> [штук, сумма]
+        self._sales: dict[tuple, list[int]] = {}
+        # (day, hour, is_staff) -> [заказов, штук, сумма], как hourly_orders
+        self._hourly: dict[tuple, list[int]] = {}
+        # день -> счётчик изменений, как day_versions
+        self._day_versions: dict[int, int] = defaultdict(int)
+
+    def write_batch(self, jobs):
+        results = []
+        for name, args, kwargs in jobs:
+            try:
+                results.append((True, getattr(self, name)(*args, **kwargs)))
+            except Exception as exc:
+                results.append((False, exc))
+        return results
+
+    def _add_sales(self, day, is_staff, line: dict, author: str, sign: int):
+        key = (day, is_staff, line["payment_type"], line["item_name"], author or "")
+        totals = self._sales.setdefault(key, [0, 0])
+        totals[0] += sign * line["quantity"]
+        totals[1] += sign * line["row_total"]
+        if totals[0] <= 0:
+            del self._sales[key]
+
+    def _add_hourly(self, order: dict, lines: list[dict], sign: int):
+        if not lines:
+            return
+        key = (order["day"], timeutils.business_hour(order["date"], order["day"]), order["is_staff"])
+        totals = self._hourly.setdefault(key, [0, 0, 0])
+        totals[0] += sign
+        totals[1] += sign * sum(line["quantity"] for line in lines)
+        totals[2] += sign * sum(line["row_total"] for line in lines)
+        if totals[0] <= 0:
+            del self._hourly[key]
+
+    def _log(self, now, action_type, payment_type, item_name, quantity, user_id, username, is_staff):
+        # каждое изменение пишет журнал, так что его день отмечается здесь
+        self._day_versions[now[2]] += 1
+        self._actions.append(
+            (now[0], action_type, payment_type, item_name, quantity, user_id, username, is_staff, now[1], now[2])
+        )
+
+    def add_order(self, items, user_id, username, raw_text, *, is_staff=False):
+        staff_flag = 1 if is_staff else 0
+        lines = []
+        for item in items:
+            qty = item.get("quantity", 1)
+            base_price = int(item["price"])
+            addons = item.get("addons", [])
+            addons_total = sum(int(a.get("price", 0)) for a in addons)
+            lines.append(
+                {
+                    "item_name": item["item_name"] or "",
+                    "payment_type": item["payment_type"] or "",
+                    "price": base_price,
+                    "quantity": qty,
+                    "addons_total": addons_total,
+                    "addons_json": _json.dumps(addons, ensure_ascii=False),
+                    "addons_text": db.addons_label(addons),
+                    "addons_key": db.addons_key(addons),
+                    "row_total": (base_price + addons_total) * qty,
+                    "is_staff": staff_flag,
+                }
+            )
+        now = timeutils.stamp()
+        with self._lock:
+            order_id = self._next_id
+            self._next_id += 1
+            self._orders[order_id] = {
+                "date": now[0],
+                "ts": now[1],
+                "day": now[2],
+                "user_id": user_id,
+                "username": username,
+                "raw_text": raw_text,
+                "is_staff": staff_flag,
+            }
+            self._items[order_id] = lines
+            self._add_hourly(self._orders[order_id], lines, +1)
+            insort(self._by_user[user_id], (now[1], order_id))
+            if now[2] not in self._by_day:
+                insort(self._day_keys, now[2])
+            self._by_day[now[2]].append(order_id)
+            for line in lines:
+                self._log(now, "добавление", line["payment_type"], line["item_name"], line["quantity"],
+                          user_id, username, staff_flag)
+                self._add_sales(now[2], staff_flag, line, username, +1)
+        return order_id
+
+    def log_action(self, action_type, payment_type, item_name, user_id, username, *, is_staff=False, quantity=1):
+        with self._lock:
+            self._log(timeutils.stamp(), action_type, payment_type, item_name, quantity,
+                      user_id, username, 1 if is_staff else 0)
+
+    def _remove(self, order_id: int) -> list[dict]:
+        order = self._orders.pop(order_id)
+        lines = self._items.pop(order_id)
+        keys = self._by_user[order["user_id"]]
+        del keys[bisect_left(keys, (order["ts"], order_id))]
+        self._by_day[order["day"]].remove(order_id)
+        if not self._by_day[order["day"]]:
+            del self._by_day[order["day"]]
+            self._day_keys.remove(order["day"])
+        for line in lines:
+            self._add_sales(order["day"], order["is_staff"], line, order["username"], -1)
+        self._add_hourly(order, lines, -1)
+        self._day_versions[order["day"]] += 1
+        return lines
+
+    def delete_order(self, order_id, user_id, username):
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None or order["user_id"] != user_id:
+                return []
+            lines = self._remove(order_id)
+            now = timeutils.stamp()
+            for line in lines:
+                self._log(now, "удаление", line["payment_type"], line["item_name"], line["quantity"],
+                          user_id, username, line["is_staff"])
+        return [dict(line) for line in lines]
+
+    def delete_orders_in_range(self, user_id, start, end, username=""):
+        start_ts, end_ts = timeutils.to_epoch(start), timeutils.to_epoch(end)
+        deleted = []
+        with self._lock:
+            keys = self._by_user.get(user_id, [])
+            ids = [oid for _, oid in keys[bisect_left(keys, (start_ts, 0)):bisect_left(keys, (end_ts, 0))]]
+            now = timeutils.stamp()
+            for order_id in ids:
+                for line in self._remove(order_id):
+                    self._log(now, "очистка_сегодня", line["payment_type"], line["item_name"], line["quantity"],
+                              user_id, username, line["is_staff"])
+                    deleted.append({"order_id": order_id, **line})
+        return deleted
+
+    def get_user_orders_page(self, user_id, limit, after=None):
+        with self._lock:
+            keys = self._by_user.get(user_id, [])
+            hi = bisect_left(keys, tuple(after)) if after is not None else len(keys)
+            page = []
+            for ts, order_id in reversed(keys[max(0, hi - limit - 1):hi]):
+                order = self._orders[order_id]
+                lines = self._items[order_id]
+                page.append(
+                    {
+                        "id": order_id,
+                        "date": order["date"],
+                        "ts": ts,
+                        "payment_type": lines[0]["payment_type"] if lines else None,
+                        "items": [
+                            {
+                                "item_name": line["item_name"],
+                                "price": line["price"],
+                                "quantity": line["quantity"],
+                                "addons_total": line["addons_total"],
+                                "addons_text": line["addons_text"],
+                                "row_total": line["row_total"],
+                                "is_staff": bool(line["is_staff"]),
+                            }
+                            for line in lines
+                        ],
+                        "total": sum(line["row_total"] for line in lines),
+                        "is_staff": bool(order["is_staff"]),
+                    }
+                )
+        return page[:limit], len(page) > limit
+
+    def order_lines(self, start=None, end=None, is_staff=None):
+        days = _days(start, end)
+        staff_flag = None if is_staff is None else (1 if is_staff else 0)
+        rows = []
+        with self._lock:
+            day_keys = self._day_keys
+            if days is not None:
+                day_keys = day_keys[bisect_left(day_keys, days[0]):bisect_left(day_keys, days[1] + 1)]
+            for day in day_keys:
+                for order_id in self._by_day[day]:
+                    order = self._orders[order_id]
+                    if staff_flag is not None and order["is_staff"] != staff_flag:
+                        continue
+                    for line in self._items[order_id]:
+                        rows.append(
+                            (
+                                order_id,
+                                order["date"],
+                                order["username"],
+                                order["is_staff"],
+                                line["payment_type"],
+                                line["item_name"],
+                                line["quantity"],
+                                line["price"],
+                                line["addons_text"],
+                                line["addons_total"],
+                                line["row_total"],
+                                order["raw_text"],
+                                line["addons_key"],
+                            )
+                        )
+        return rows
+
+    def action_lines(self, start=None, end=None):
+        days = _days(start, end)
+        with self._lock:
+            actions = self._actions
+            if days is not None:
+                # журнал дописывается по времени, рабочие дни в нём не убывают
+                lo = bisect_left(actions, days[0], key=lambda row: row[9])
+                hi = bisect_left(actions, days[1] + 1, lo=lo, key=lambda row: row[9])
+                actions = actions[lo:hi]
+            return [row[:8] for row in actions]
+
+    def _summary(self, is_staff, start, end, key_of) -> dict:
+        days = _days(start, end)
+        staff_flag = 1 if is_staff else 0
+        grouped: dict = {}
+        with self._lock:
+            for key, (quantity, total) in self._sales.items():
+                if key[1] != staff_flag or (days is not None and not days[0] <= key[0] <= days[1]):
+                    continue
+                acc = grouped.setdefault(key_of(key), [0, 0])
+                acc[0] += quantity
+                acc[1] += total
+        return grouped
+
+    def sales_summary(self, is_staff, start=None, end=None):
+        grouped = self._summary(is_staff, start, end, lambda key: (key[2], key[3]))
+        return sorted((pay, item, q, t) for (pay, item), (q, t) in grouped.items() if q > 0)
+
+    def author_summary(self, is_staff, start=None, end=None):
+        grouped = self._summary(is_staff, start, end, lambda key: key[4])
+        rows = [(author, q, t) for author, (q, t) in grouped.items() if q > 0]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def period_totals(self, granularity, start=None, end=None, is_staff=None):
+        if granularity not in GRANULARITIES:
+            raise KeyError(granularity)
+        days = _days(start, end)
+        staff_flag = None if is_staff is None else (1 if is_staff else 0)
+        with self._lock:
+            rows = sorted(
+                (day, hour if granularity == "hour" else 0, *values)
+                for (day, hour, flag), values in self._hourly.items()
+                if (days is None or days[0] <= day <= days[1]) and staff_flag in (None, flag)
+            )
+        return _fold_periods(granularity, rows)
+
+    def data_version(self, start=None, end=None):
+        days = _days(start, end)
+        with self._lock:
+            return sum(v for day, v in self._day_versions.items() if days is None or days[0] <= day <= days[1])
+
+
+def create_storage(backend: str) -> Storage:
+    if backend == "sqlite":
+        return SqliteStorage()
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown DB_BACKEND: {backend!r}")
+
+
+_storage: Storage | None = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """Общее хранилище процесса (создаётся при первом обращении по DB_BACKEND)."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(DB_BACKEND)
+                logger.info(f"Storage backend: {DB_BACKEND}")
+    return _storage
+
+
+def set_storage(storage: Storage | None):
+    """Подменяет общее хранилище (бенчмарки); None — пересоздать по DB_BACKEND."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
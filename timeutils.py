@@ -0,0 +1,85 @@
+"""
+Время заказов: часовой пояс кафе и рабочие сутки.
+
+В БД рядом с ISO-строкой хранятся epoch-секунды (ts) и ключ рабочего дня
+(day, целое ГГГГММДД). Периоды переводятся в диапазоны этих колонок здесь,
+поэтому запросы фильтруют по индексам без функций над каждой строкой.
+"""
+
+import logging
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from config import TIMEZONE, BUSINESS_DAY_START
+
+logger = logging.getLogger(__name__)
+
+
+def parse_time_of_day(raw: str, setting: str, default: timedelta | None = timedelta(0)) -> timedelta | None:
+    """«ЧЧ:ММ» из настройки setting -> смещение от полуночи; при ошибке — default."""
+    try:
+        hours, minutes = (int(part) for part in raw.strip().split(":", 1))
+        return timedelta(hours=hours, minutes=minutes)
+    except ValueError:
+        logger.warning(f"{setting} is not in HH:MM format: {raw!r}, using {default}")
+        return default
+
+
+TZ = ZoneInfo(TIMEZONE) if TIMEZONE else None  # None — системный часовой пояс
+DAY_START = parse_time_of_day(BUSINESS_DAY_START, "BUSINESS_DAY_START")
+
+
+def now() -> datetime:
+    """Текущий момент с часовым поясом кафе."""
+    return datetime.now(TZ) if TZ else datetime.now().astimezone()
+
+
+def localize(dt: datetime) -> datetime:
+    """Наивное время считается местным временем кафе."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=TZ) if TZ else dt.astimezone()
+    return dt.astimezone(TZ) if TZ else dt.astimezone()
+
+
+def to_epoch(dt: datetime) -> int:
+    return int(localize(dt).timestamp())
+
+
+def day_key(d: date) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def key_to_date(key: int) -> date:
+    return date(key // 10000, key // 100 % 100, key % 100)
+
+
+def business_day(dt: datetime | None = None) -> date:
+    """Рабочий день, к которому относится момент dt (по умолчанию — сейчас)."""
+    local = localize(dt) if dt is not None else now()
+    return (local.replace(tzinfo=None) - DAY_START).date()
+
+
+def business_hour(local_iso: str, day: int) -> int:
+    """
+    Час заказа от полуночи его рабочего дня day по ISO-строке местного времени:
+    часы следующей календарной даты (ночь до начала суток) — 24 и больше.
+    """
+    hour = int(local_iso[11:13])
+    return hour + 24 if int(local_iso[:10].replace("-", "")) > day else hour
+
+
+def business_day_bounds(d: date) -> tuple[datetime, datetime]:
+    """Начало рабочего дня d и начало следующего — полуинтервал [start, end)."""
+    start = localize(datetime.combine(d, time()) + DAY_START)
+    end = localize(datetime.combine(d + timedelta(days=1), time()) + DAY_START)
+    return start, end
+
+
+def stamp(dt: datetime | None = None) -> tuple[str, int, int]:
+    """(ISO-строка местного времени, epoch-секунды, ключ рабочего дня) для записи в БД."""
+    local = localize(dt) if dt is not None else now()
+    return (
+        local.replace(tzinfo=None).isoformat(),
+        int(local.timestamp()),
+        day_key((local.replace(tzinfo=None) - DAY_START).date()),
+    )
@@ -3,7 +3,7 @@ import shutil
 import logging
 from aiogram.types import InlineKeyboardMarkup
 from aiogram import Bot
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, FSInputFile, InputFile
 
 import speech_recognition as sr
 from pydub import AudioSegment
@@ -170,3 +170,14 @@ async def check_membership(bot, user_id: int) -> bool:
         return mem.status in ("member", "creator", "administrator")
     except:
         return False
+
+
+def report_input_file(report) -> InputFile:
+    """
+    Отчёт из report_jobs.submit_report -> файл для отправки: путь в кэше отчётов
+    читается с диска при отправке, (имя, байты) собранного без кэша отчёта — из памяти.
+    """
+    if isinstance(report, str):
+        return FSInputFile(report)
+    filename, data = report
+    return BufferedInputFile(data, filename=filename)